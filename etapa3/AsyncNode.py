@@ -0,0 +1,155 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from Node import Node
+from ControlChannel import read_message_async
+from WorkerPool import datagram_priority
+from ReceptionReports import REPORT_INTERVAL
+from RtspRequests import RequestBuffer
+
+HANDLER_WORKERS = 16  # Threads do pool que corre os handlers que fazem I/O bloqueante
+
+class StreamReplySocket:
+    """Adapta um StreamWriter do asyncio à interface de socket usada pelos handlers do Node."""
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def send(self, data):
+        self.loop.call_soon_threadsafe(self.writer.write, bytes(data))
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+class DatagramReplySocket:
+    """Adapta um DatagramTransport do asyncio à interface de socket (sendto) usada pelos handlers."""
+    def __init__(self, loop, transport):
+        self.loop = loop
+        self.transport = transport
+
+    def sendto(self, data, address):
+        self.loop.call_soon_threadsafe(self.transport.sendto, bytes(data), address)
+        return len(data)
+
+class RtpProtocol(asyncio.DatagramProtocol):
+    """Recebe os pacotes RTP no event loop e entrega-os diretamente ao motor de fan-out."""
+    def __init__(self, forwarder):
+        self.forwarder = forwarder
+
+    def datagram_received(self, data, addr):
+        buffer = bytearray(data)
+        self.forwarder.forward(buffer, memoryview(buffer))
+
+class DataProtocol(asyncio.DatagramProtocol):
+    """Recebe as mensagens UDP de controlo (clientes) e despacha-as para o pool limitado de datagramas."""
+    def __init__(self, node):
+        self.node = node
+
+    def connection_made(self, transport):
+        self.reply_socket = DatagramReplySocket(self.node.loop, transport)
+
+    def datagram_received(self, data, addr):
+        self.node.datagram_pool.submit(datagram_priority(data), self.node.handle_data_message, data, addr, self.reply_socket)
+
+class AsyncNode(Node):
+    """
+    Node em modo event loop: os servidores de controlo e RTSP usam asyncio.start_server,
+    os dados e o RTP usam DatagramProtocol e todas as ligações são servidas por um único loop.
+    Os handlers que fazem I/O bloqueante (ligações TCP aos vizinhos, pedidos RTSP
+    reencaminhados) correm num pool de threads de tamanho fixo em vez de uma thread por ligação;
+    todas essas esperas têm timeout (RTSP_TIMEOUT, CONNECT_TIMEOUT) e as esperas fixas são
+    agendadas no loop (schedule), para que ligações paradas não esgotem o pool.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=HANDLER_WORKERS)
+
+    def start(self):
+        """Regista o nó no Bootstrapper e corre todos os servidores no event loop."""
+        self.register_with_bootstrapper()
+        self.probe.start()
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+
+        control_server = await asyncio.start_server(self.handle_control_stream, '', self.control_port)
+        print(f"Node {self.node_id} listening on control port {self.control_port}")
+
+        self.rtsp_socket.setblocking(False)
+        rtsp_server = await asyncio.start_server(self.handle_rtsp_stream, sock=self.rtsp_socket)
+
+        self.rtp_socket.setblocking(False)
+        await self.loop.create_datagram_endpoint(lambda: RtpProtocol(self.forwarder), sock=self.rtp_socket)
+
+        if self.node_type == "pop":
+            self.datagram_pool.start()
+            await self.loop.create_datagram_endpoint(lambda: DataProtocol(self), local_addr=('0.0.0.0', self.data_port))
+            print(f"Node {self.node_id} listening on data port {self.data_port}")
+
+        self.loop.create_task(self.ping_loop())
+        self.loop.create_task(self.report_loop())
+
+        async with control_server, rtsp_server:
+            await asyncio.gather(control_server.serve_forever(), rtsp_server.serve_forever())
+
+    def handle_rtp_forwarding(self):
+        """O RTP já é recebido pelo RtpProtocol do event loop."""
+        pass
+
+    async def ping_loop(self):
+        while True:
+            await self.loop.run_in_executor(self.executor, self.ping_neighbors, self.submit_ping)
+            await asyncio.sleep(15)
+
+    async def report_loop(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            await self.loop.run_in_executor(self.executor, self.report_upstream)
+
+    def schedule(self, delay, function, *args):
+        """Agenda no event loop (em vez de uma thread por temporizador) e corre no pool de handlers."""
+        if self.loop is None:
+            super().schedule(delay, function, *args)  # Eventos das sondas antes de o loop arrancar
+            return
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.executor.submit, function, *args)
+
+    def submit_ping(self, neighbor_ip, neighbor_info):
+        self.executor.submit(self.manage_neighbor_communication, neighbor_ip, neighbor_info)
+
+    async def handle_control_stream(self, reader, writer):
+        print(f"Connection from {writer.get_extra_info('peername')} established.")
+        conn = StreamReplySocket(self.loop, writer)
+        try:
+            while True:
+                # Lê uma mensagem enquadrada (header + comprimento + corpo)
+                header, data = await read_message_async(reader)
+                if header is None:
+                    break  # Conexão fechada pelo vizinho
+
+                await self.loop.run_in_executor(self.executor, self.handle_control_message, header, data, conn)
+        except (OSError, ValueError) as e:
+            print(f"Control connection closed: {e}")
+        finally:
+            writer.close()
+
+    async def handle_rtsp_stream(self, reader, writer):
+        neighbor_address = writer.get_extra_info('peername')
+        print(f"Conexão recebida de {neighbor_address}")
+        neighbor_socket = StreamReplySocket(self.loop, writer)
+        requests = RequestBuffer()
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                for request in requests.feed(data):
+                    result = await self.loop.run_in_executor(self.executor, self.handle_rtsp_request, request, neighbor_socket, neighbor_address)
+                    if result is False:
+                        return
+        except Exception as e:
+            print(f"Ocorreu um erro: {e}")
+        finally:
+            writer.close()
@@ -1,6 +1,7 @@
 import socket
 import threading
 from control_protocol_pb2 import ControlMessage, NeighborInfo
+from ControlChannel import CONTROL_MESSAGE, FLOODING_MESSAGE, send_message, read_message
 
 class Bootstrapper:
     def __init__(self, host='0.0.0.0', port=5000, config_file='config.txt'):
@@ -10,12 +11,10 @@ class Bootstrapper:
         self.neighbors_config = self.load_neighbors(config_file)
     	
     def send_control_message_tcp(self, socket, control_message):
-        header = b'\x01'
-        socket.sendall(header + control_message.SerializeToString())
+        send_message(socket, CONTROL_MESSAGE, control_message)
 
     def send_flooding_message_tcp(self, socket, flooding_message):
-        header = b'\x02' 
-        socket.sendall(header + flooding_message.SerializeToString())
+        send_message(socket, FLOODING_MESSAGE, flooding_message)
     
     def send_control_message_udp(self, socket, address, control_message):
         header = b'\x01'  # Header para ControlMessage
@@ -47,8 +46,7 @@ class Bootstrapper:
 
     def handle_client(self, conn):
         try:
-            header = conn.recv(1)  # Lê o primeiro byte 
-            data = conn.recv(1024)
+            header, data = read_message(conn)  # Lê uma mensagem enquadrada
             
             if header == b'\x01':
                 if data:
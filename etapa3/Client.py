@@ -5,9 +5,19 @@ import socket, threading, sys, traceback, os
 
 from control_protocol_pb2 import ControlMessage
 from control_protocol_pb2 import FloodingMessage
+from ControlChannel import CONTROL_MESSAGE, FLOODING_MESSAGE, send_message, read_message
+from WorkerPool import WorkerPool, datagram_priority
+from DatagramIO import ReceiveRing, CONTROL_DATAGRAM_SIZE
+from LinkProbe import LinkProbe
+from RouteIndex import SWITCH_OVERLAP
+from RoutePolicy import RoutePolicy
 import time
 from VideoSession import VideoSession
+from Records import NeighborEntry, Status
+from ReceptionReports import REPORT_INTERVAL
+from Renditions import RenditionSelector
 
+RENDITION_SWITCH_DELAY = 1.0  # Segundos entre ativar a rota da nova variante e pedi-la por RTSP
 
 class Client:
     INIT = 0
@@ -24,7 +34,11 @@ class Client:
     def __init__(self, master, rtp_port, filename, client_id, client_ip, bootstrapper_host='localhost', bootstrapper_port=5000):
         self.master = master
         self.rtp_port = int(rtp_port)
-        self.filename = filename
+        self.movie = filename
+        self.filename = filename  # Variante do filme que está a ser pedida
+
+        # Variante escolhida a partir da perda e da entrega medidas na sessão
+        self.renditions = RenditionSelector(filename)
 
         # Client details
         self.client_id = client_id
@@ -34,6 +48,8 @@ class Client:
         self.dest_lock = threading.Lock()
         self.destination_ip = None
         self.destination_rtsp_port = None
+        self.backup_route = None  # PoP de reserva pré-calculado para comutação rápida
+        self.policy = RoutePolicy()  # Histerese e tempo mínimo antes de trocar de PoP
         
         # Bootstrapper configuration
         self.bootstrapper = (bootstrapper_host, bootstrapper_port)
@@ -49,16 +65,21 @@ class Client:
 
         self.video_session = None
 
+        # Pool limitado que processa as mensagens UDP recebidas dos PoP's
+        self.datagram_pool = WorkerPool(f"Client {self.client_id} data", workers=2)
+
+        # Sondas UDP para detetar em menos de um segundo a falha do PoP ativo
+        self.probe = LinkProbe(targets=self.probe_targets, on_link_down=self.handle_link_down,
+                               idle_targets=self.idle_probe_targets, on_link_up=self.handle_link_up)
+
         # Connect to server and perform background work
         self.background()  # Register with the bootstrapper and start background tasks
         
     def send_control_message_tcp(self, socket, control_message):
-        header = b'\x01'
-        socket.sendall(header + control_message.SerializeToString())
+        send_message(socket, CONTROL_MESSAGE, control_message)
 
     def send_flooding_message_tcp(self, socket, flooding_message):
-        header = b'\x02' 
-        socket.sendall(header + flooding_message.SerializeToString())
+        send_message(socket, FLOODING_MESSAGE, flooding_message)
     
     def send_control_message_udp(self, socket, address, control_message):
         header = b'\x01'  # Header para ControlMessage
@@ -89,8 +110,7 @@ class Client:
             self.send_control_message_tcp(s, control_message)
             
             # Recebe e processa a resposta
-            header = s.recv(1)  # Lê o primeiro byte
-            data = s.recv(1024)  # Lê o restante da mensagem
+            header, data = read_message(s)
             
             if header == b'\x01':  # ControlMessage
                 response_message = ControlMessage()
@@ -101,17 +121,9 @@ class Client:
                     self.neighbors.clear()  # Limpa vizinhos antigos em caso de reativação
                     for neighbor in response_message.neighbors:
                         with self.neighbors_lock: 
-                            self.neighbors[neighbor.node_ip] = {
-                                "node_ip": neighbor.node_ip,
-                                "node_id": neighbor.node_id,
-                                "control_port": neighbor.control_port,
-                                "data_port": neighbor.data_port,
-                                "node_type": neighbor.node_type,
-                                "rtsp_port": neighbor.rtsp_port,
-                                "status": "active",
-                                "stream": "inactive",
-                                "failed-attempts": 0
-                            }
+                            self.neighbors[neighbor.node_ip] = NeighborEntry(
+                                neighbor.node_ip, neighbor.node_id, neighbor.node_type,
+                                neighbor.control_port, neighbor.data_port, neighbor.rtsp_port)
                     print(f"Client {self.client_id} Pop's: {self.neighbors}")
                     # Após o registro, notifica os vizinhos sobre o registro
                     self.notify_neighbors_registration()
@@ -138,79 +150,144 @@ class Client:
                     notify_message.node_type = self.node_type
 
                     #Envia para o vizinho
-                    neighbor_address = (neighbor_ip, neighbor_info['data_port'])
+                    neighbor_address = (neighbor_ip, neighbor_info.data_port)
                     self.send_control_message_udp(s, neighbor_address, notify_message)
-                    print(f"Notified neighbor {neighbor_info['node_id']} of registration.")
+                    print(f"Notified neighbor {neighbor_info.node_id} of registration.")
 
             except Exception as e:
-                print(f"Failed to notify neighbor {neighbor_info['node_id']} via UDP: {e}")
+                print(f"Failed to notify neighbor {neighbor_info.node_id} via UDP: {e}")
                 
     def background(self):
         """
         Função principal do cliente que inicia a solicitação de vizinhos.
         """
         self.register_with_bootstrapper()
+        self.probe.start()
         threading.Thread(target=self.data_server).start()     # Inicia o servidor de dados em uma thread separada
         threading.Thread(target=self.send_ack_to_neighbors).start()  # Enviar PING aos vizinhos
+        threading.Thread(target=self.send_receiver_reports, daemon=True).start()  # Qualidade de receção para o PoP
         threading.Thread(target=self.start_new_session).start()  # Thread da sessão de vídeo           
 
     def start_new_session(self):
         while True:
             best_route = self.activate_best_route(self.filename)
             if best_route:
-                new_ip = best_route["node_ip"]
-                new_rtsp_port = best_route["rtsp_port"]
-
-                # Atualiza as informações de destino dentro de um bloco protegido
-                with self.dest_lock:
-                    dest_ip = self.destination_ip
-                    dest_rtspport = self.destination_rtsp_port
-
-                    # Verifica se a nova rota é a mesma que a atual
-                    if dest_ip == new_ip and dest_rtspport == new_rtsp_port:
-                        print("A rota não mudou. Sessão existente mantida.")
-                    else:
-                        # Atualiza as informações de destino
-                        self.destination_ip = new_ip
-                        self.destination_rtsp_port = new_rtsp_port
-
-                        dest_ip = new_ip
-                        dest_rtspport = new_rtsp_port
-
-                        # Atualiza ou cria a sessão de vídeo
-                        if hasattr(self, 'session_window') and self.session_window.winfo_exists():
-                            print(f"Rota atualizada para o nó {best_route['node_id']}.")
-                            if self.video_session:
-                                self.video_session.update_route(dest_ip, dest_rtspport)
-                                self.video_session.connectToNeighbor()
-                        else:
-                            # Cria uma nova janela para a sessão
-                            print("Iniciando nova sessão de vídeo...")
-                            self.session_window = Toplevel(self.master)
-                            self.sessions_frame = Frame(self.master)
-                            self.sessions_frame.pack()
-
-                            # Inicia a sessão de vídeo
-                            self.video_session = VideoSession(
-                                self.session_window,
-                                self.client_ip,
-                                dest_ip,
-                                dest_rtspport,
-                                self.rtp_port,
-                                self.filename
-                            )
-
-                            # Adiciona botão para fechar a sessão
-                            self.close_button = Button(
-                                self.sessions_frame, 
-                                text=f'Fechar Sessão {best_route["node_id"]}', 
-                                command=lambda: self.close_session(self.video_session)
-                            )
-                            self.close_button.pack()
+                self.use_route(best_route)
             else:
                 print("Nenhuma rota disponível. Tentando novamente em 10 segundos.")
 
             time.sleep(10)  # Aguarda antes de verificar novamente
+
+    def use_route(self, best_route):
+        """Passa a sessão de vídeo para o PoP indicado (ou cria-a, se ainda não existir)."""
+        new_ip = best_route.node_ip
+        new_rtsp_port = best_route.rtsp_port
+
+        # Atualiza as informações de destino dentro de um bloco protegido
+        with self.dest_lock:
+            dest_ip = self.destination_ip
+            dest_rtspport = self.destination_rtsp_port
+
+            # Verifica se a nova rota é a mesma que a atual
+            if dest_ip == new_ip and dest_rtspport == new_rtsp_port:
+                print("A rota não mudou. Sessão existente mantida.")
+            else:
+                # Atualiza as informações de destino
+                self.destination_ip = new_ip
+                self.destination_rtsp_port = new_rtsp_port
+
+                dest_ip = new_ip
+                dest_rtspport = new_rtsp_port
+
+                # Atualiza ou cria a sessão de vídeo
+                if hasattr(self, 'session_window') and self.session_window.winfo_exists():
+                    print(f"Rota atualizada para o nó {best_route.node_id}.")
+                    if self.video_session:
+                        self.video_session.update_route(dest_ip, dest_rtspport)
+                        self.video_session.connectToNeighbor()
+                        self.video_session.resumeOnRoute()
+                else:
+                    # Cria uma nova janela para a sessão
+                    print("Iniciando nova sessão de vídeo...")
+                    self.session_window = Toplevel(self.master)
+                    self.sessions_frame = Frame(self.master)
+                    self.sessions_frame.pack()
+
+                    # Inicia a sessão de vídeo
+                    self.video_session = VideoSession(
+                        self.session_window,
+                        self.client_ip,
+                        dest_ip,
+                        dest_rtspport,
+                        self.rtp_port,
+                        self.filename
+                    )
+
+                    # Adiciona botão para fechar a sessão
+                    self.close_button = Button(
+                        self.sessions_frame, 
+                        text=f'Fechar Sessão {best_route.node_id}', 
+                        command=lambda: self.close_session(self.video_session)
+                    )
+                    self.close_button.pack()
+
+    def probe_targets(self):
+        """PoP's ativos a sondar."""
+        with self.neighbors_lock:
+            return [ip for ip, info in self.neighbors.items() if info.status is Status.ACTIVE]
+
+    def handle_link_down(self, neighbor_ip):
+        """Chamado pelas sondas quando um PoP deixa de responder: comuta logo para o PoP de reserva."""
+        with self.neighbors_lock:
+            if neighbor_ip not in self.neighbors:
+                return
+            self.neighbors[neighbor_ip].status = Status.INACTIVE
+            self.neighbors[neighbor_ip].stream = Status.INACTIVE
+            print(f"Neighbor {self.neighbors[neighbor_ip].node_id} considered inactive due to lack of probe replies.")
+        self.probe.forget(neighbor_ip)
+
+        with self.dest_lock:
+            current_ip = self.destination_ip
+            backup_ip = self.backup_route
+        if neighbor_ip != current_ip or backup_ip is None:
+            return
+
+        threading.Thread(target=self.switch_route, args=(backup_ip,), daemon=True).start()
+
+    def idle_probe_targets(self):
+        """PoP's inativos, sondados a ritmo lento para detetar a sua recuperação."""
+        with self.neighbors_lock:
+            return [ip for ip, info in self.neighbors.items() if info.status is Status.INACTIVE]
+
+    def handle_link_up(self, neighbor_ip):
+        """Chamado pelas sondas quando um PoP inativo volta a responder: reativa-o e pede-lhe um novo ACK."""
+        with self.neighbors_lock:
+            neighbor_info = self.neighbors.get(neighbor_ip)
+            if neighbor_info is None or neighbor_info.status is not Status.INACTIVE:
+                return
+            neighbor_info.status = Status.ACTIVE
+            neighbor_info.failed_attempts = 0
+            neighbor_info = neighbor_info.copy()
+        print(f"Pop {neighbor_info.node_id} is reachable again.")
+
+        # O ACK atualiza o tempo até ao servidor; a próxima escolha de rota já o considera
+        self.send_ack(neighbor_ip, neighbor_info)
+
+    def switch_route(self, backup_ip):
+        """Ativa o PoP de reserva com um único ACTIVATE_ROUTE e muda a sessão para ele."""
+        with self.neighbors_lock:
+            backup = self.neighbors.get(backup_ip)
+            if backup is None or backup.status is not Status.ACTIVE:
+                return
+            backup.stream = Status.ACTIVE
+            backup = backup.copy()
+
+        print(f"Failover to backup Pop {backup.node_id} at {backup_ip}.")
+        if self.send_route_activation(backup_ip, backup, self.filename):
+            self.policy.record_switch(self.movie, backup_ip)
+            with self.dest_lock:
+                self.backup_route = None
+            self.use_route(backup)
         
     def activate_best_route(self, filename):
         """
@@ -221,51 +298,109 @@ class Client:
         min_time = float('inf')  # Inicia com o maior valor possível
         destination = None
 
-        # Procura a melhor rota na tabela de roteamento com base no menor tempo
+        # Procura a melhor rota na tabela de roteamento com base no menor custo
         with self.neighbors_lock:
             neighbors_snapshot =  self.neighbors.copy()
             
+        costs = {}
         for neighbor_ip, neighbor_info in neighbors_snapshot.items():
             # Ignorar vizinhos sem informações de tempo ou não ativos
-            if "best_time" not in neighbor_info or neighbor_info["status"] != "active":
+            if neighbor_info.best_time == float('inf') or neighbor_info.status is not Status.ACTIVE:
                 continue
+            costs[neighbor_ip] = self.route_cost(neighbor_ip, neighbor_info)
 
-            # Verificar o menor tempo acumulado
-            if neighbor_info["best_time"] < min_time:
-                min_time = neighbor_info["best_time"]
-                best_route = neighbor_info
+            if costs[neighbor_ip] < min_time:
+                min_time = costs[neighbor_ip]
                 destination = neighbor_ip
 
-        if best_route is not None:
-            self.deactivate_bad_routes(destination, filename)
+        # A política só troca de PoP se o novo for claramente melhor do que o atual
+        with self.dest_lock:
+            current = self.destination_ip
+        current_cost = costs.get(current, float('inf'))
+        chosen = self.policy.choose(self.movie, current, current_cost, destination, min_time)
+        if chosen != destination and chosen in costs:
+            print(f"Keeping Pop at {chosen} ({current_cost:.4f}) instead of {destination} ({min_time:.4f}).")
+            destination, min_time = chosen, current_cost
+        if destination is not None:
+            best_route = neighbors_snapshot[destination]
+
+        # O segundo melhor PoP fica como reserva
+        backup = min((ip for ip in costs if ip != destination), key=costs.get, default=None)
+        with self.dest_lock:
+            self.backup_route = backup
 
+        if best_route is not None:
             with self.neighbors_lock:
-                if self.neighbors[destination]['stream'] != "active":
-                    self.neighbors[destination]['stream'] = "active"   
+                self.neighbors[destination].stream = Status.ACTIVE
+                overlap = any(ip != destination and info.stream is Status.ACTIVE for ip, info in self.neighbors.items())
                        
-            print(f"Best route is {best_route['node_id']} at {destination} with {min_time} time.")
-            activate_message = FloodingMessage()
-            activate_message.type = FloodingMessage.ACTIVATE_ROUTE
-            activate_message.stream_ids.append(filename)
-            activate_message.source_ip = self.client_ip
-            activate_message.rtp_port = self.rtp_port
-            
-            # Enviar mensagem de ativação para a melhor rota
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                    address = (destination, best_route['data_port'])
-                    self.send_flooding_message_udp(s, address, activate_message)
-                    print(f"Sent route activation to {best_route['node_id']} at {destination}:{best_route['data_port']}.")
+            print(f"Best route is {best_route.node_id} at {destination} with {min_time:.4f} cost.")
+            if self.send_route_activation(destination, best_route, filename):
+                # Make-before-break: o PoP antigo continua a enviar durante a sobreposição
+                if overlap:
+                    timer = threading.Timer(SWITCH_OVERLAP, self.finish_switch, args=(destination, filename))
+                    timer.daemon = True
+                    timer.start()
+                with self.neighbors_lock:
                     return self.neighbors[destination].copy()
-                
-            except Exception as e:
-                print(f"Failed to activate route to destination {best_route['node_id']}: {e}")
-                return None
+            return None
         
         else:
             print("No active route available to activate.")
             return None
 
+    def route_cost(self, neighbor_ip, neighbor_info):
+        """
+        Custo até ao servidor através de um PoP: tempo acumulado que ele anuncia +
+        custo da ligação (RTT e perda das sondas, carga anunciada no ACK).
+        """
+        srtt, _ = self.probe.estimate(neighbor_ip)
+        # Sem amostras das sondas conta apenas o tempo anunciado pelo PoP
+        link_cost = self.policy.cost(srtt or 0.0, self.probe.loss(neighbor_ip), neighbor_info.load)
+        return neighbor_info.best_time + link_cost
+
+    def finish_switch(self, destination, filename):
+        """Fim da sobreposição: desativa os PoP's antigos se o novo ainda for o destino da sessão."""
+        with self.dest_lock:
+            if self.destination_ip not in (None, destination):
+                return  # Entretanto houve outra troca
+        self.deactivate_bad_routes(destination, filename)
+
+    def send_route_activation(self, destination, route_info, filename):
+        """Envia ACTIVATE_ROUTE ao PoP. Retorna True se a mensagem foi enviada."""
+        activate_message = FloodingMessage()
+        activate_message.type = FloodingMessage.ACTIVATE_ROUTE
+        activate_message.stream_ids.append(filename)
+        activate_message.source_ip = self.client_ip
+        activate_message.rtp_port = self.rtp_port
+        
+        # Enviar mensagem de ativação para a melhor rota
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                address = (destination, route_info.data_port)
+                self.send_flooding_message_udp(s, address, activate_message)
+                print(f"Sent route activation to {route_info.node_id} at {destination}:{route_info.data_port}.")
+                return True
+            
+        except Exception as e:
+            print(f"Failed to activate route to destination {route_info.node_id}: {e}")
+            return False
+
+    def send_route_deactivation(self, route_ip, route_info, filename):
+        """Envia DEACTIVATE_ROUTE do fluxo ao PoP."""
+        deactivate_message = FloodingMessage()
+        deactivate_message.type = FloodingMessage.DEACTIVATE_ROUTE
+        deactivate_message.stream_ids.append(filename)
+        deactivate_message.source_ip = self.client_ip
+
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                address = (route_ip, route_info.data_port)
+                self.send_flooding_message_udp(s, address, deactivate_message)
+                print(f"Sent route deactivation to {route_info.node_id} at {route_ip}:{route_info.data_port}.")
+        except Exception as e:
+            print(f"Failed to deactivate route to destination {route_info.node_id}: {e}")
+
     def deactivate_bad_routes(self, destination, filename):
         # Desativa todas as rotas exceto a rota do destination
         """
@@ -276,25 +411,12 @@ class Client:
             
         # Verificar se o fluxo está presente na tabela de roteamento
         for route_ip, route_info in neighbors_snapshot.items():
-            if route_info["stream"] == "active" and route_ip != destination: 
+            if route_info.stream is Status.ACTIVE and route_ip != destination: 
                 with self.neighbors_lock:
-                    self.neighbors[route_ip]["stream"] = "inactive"
+                    self.neighbors[route_ip].stream = Status.INACTIVE
                 
                 print(f"Deactivated route to {route_ip} for {filename}.")
-                
-                deactivate_message = FloodingMessage()
-                deactivate_message.type = FloodingMessage.DEACTIVATE_ROUTE
-                deactivate_message.stream_ids.append(filename)
-                deactivate_message.source_ip = self.client_ip
-            
-                # Enviar mensagem de desativação
-                try:
-                    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                        address = (route_ip, route_info['data_port'])
-                        self.send_flooding_message_udp(s, address, deactivate_message)
-                        print(f"Sent route deactivation to {route_info['node_id']} at {destination}:{route_info['data_port']}.")
-                except Exception as e:
-                    print(f"Failed to deactivate route to destination {route_info['node_id']}: {e}") 
+                self.send_route_deactivation(route_ip, route_info, filename)
 
     def close_session(self, video_session):
         """
@@ -316,11 +438,14 @@ class Client:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             s.bind(('', self.data_port))
             print(f"Client {self.client_id} listening on data port {self.data_port}")
+            self.datagram_pool.start()
+            ring = ReceiveRing(s, CONTROL_DATAGRAM_SIZE)
             while True:
                 try:
-                    # Recebe dados e o endereço de origem
-                    data, addr = s.recvfrom(1024)
-                    threading.Thread(target=self.handle_data_message, args=(data, addr, s)).start()
+                    # Recebe os datagramas em rajada; cada um é copiado antes de ir para o pool
+                    for buffer, datagram, addr in ring.receive():
+                        data = bytes(datagram)
+                        self.datagram_pool.submit(datagram_priority(data), self.handle_data_message, data, addr, s)
                 except Exception as e:
                     print(f"Error receiving data: {e}")
     
@@ -375,22 +500,13 @@ class Client:
         # Se o vizinho já estiver na lista, atualiza o status
         if neighbor_ip in neighbors_snapshot:
             with self.neighbors_lock:
-                self.neighbors[neighbor_ip]["status"] = "active"
+                self.neighbors[neighbor_ip].status = Status.ACTIVE
             print(f"Updated status of existing neighbor {neighbor_id} to active.")
         else:
             with self.neighbors_lock:
                 # Armazena as informações do vizinho se ele não estiver presente
-                self.neighbors[neighbor_ip] = {
-                    "node_ip": neighbor_ip,
-                    "node_id": neighbor_id,
-                    "control_port": control_port,
-                    "data_port": data_port,
-                    "node_type": node_type,
-                    "rtsp_port": rtsp_port,
-                    "status": "active",  # Define o status como ativo
-                    "stream": "inactive",
-                    "failed-attempts": 0
-                }
+                self.neighbors[neighbor_ip] = NeighborEntry(neighbor_ip, neighbor_id, node_type,
+                                                            control_port, data_port, rtsp_port)
             print(f"Added new neighbor: {neighbor_id}") 
                      
         print(f"Client {self.client_id} neighbors: {self.neighbors}")
@@ -404,33 +520,105 @@ class Client:
                 
             for neighbor_ip, neighbor_info in neighbors_snapshot.items():
                 # Verificar se o vizinho já está marcado como inativo
-                if neighbor_info["status"] == "inactive":
+                if neighbor_info.status is Status.INACTIVE:
                     continue  
 
                 # Verifica o número de tentativas
-                if neighbor_info.get("failed-attempts", 0) >= 2:
-                    print(f"Neighbor {neighbor_info['node_id']} considered inactive due to lack of ACK response.")
+                if neighbor_info.failed_attempts >= 2:
+                    print(f"Neighbor {neighbor_info.node_id} considered inactive due to lack of ACK response.")
                     with self.neighbors_lock: 
-                        self.neighbors[neighbor_ip]["status"] = "inactive"
+                        self.neighbors[neighbor_ip].status = Status.INACTIVE
+                    self.probe.forget(neighbor_ip)  # Volta a ser reativado quando responder às sondas
                     continue  
                 
-                try:
-                    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                        address = (neighbor_ip, neighbor_info['data_port'])
-                        ack_message = ControlMessage()
-                        ack_message.type = ControlMessage.ACK
-                        ack_message.node_ip = self.client_ip
-                        ack_message.node_id = self.client_id
-                        ack_message.data_port = self.data_port  
-                    
-                        self.send_control_message_udp(s, address, ack_message)
-                        print(f"Sent ACK to Pop {neighbor_info['node_id']}")
-                        
-                except Exception as e:
-                    # Incrementa o contador de tentativas falhas
-                    print(f"Failed to send ACK to neighbor {neighbor_info['node_id']}: {e}")
-                    with self.neighbors_lock: 
-                        self.neighbors[neighbor_ip]["failed-attempts"] = neighbor_info.get("failed-attempts", 0) + 1                 
+                self.send_ack(neighbor_ip, neighbor_info)
+
+    def send_ack(self, neighbor_ip, neighbor_info):
+        """Envia um ACK ao PoP, que responde com o tempo acumulado até ao servidor."""
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                address = (neighbor_ip, neighbor_info.data_port)
+                ack_message = ControlMessage()
+                ack_message.type = ControlMessage.ACK
+                ack_message.node_ip = self.client_ip
+                ack_message.node_id = self.client_id
+                ack_message.data_port = self.data_port  
+            
+                self.send_control_message_udp(s, address, ack_message)
+                print(f"Sent ACK to Pop {neighbor_info.node_id}")
+                
+        except Exception as e:
+            # Incrementa o contador de tentativas falhas
+            print(f"Failed to send ACK to neighbor {neighbor_info.node_id}: {e}")
+            with self.neighbors_lock: 
+                self.neighbors[neighbor_ip].failed_attempts = neighbor_info.failed_attempts + 1                 
+
+    def send_receiver_reports(self):
+        """Envia periodicamente ao PoP ativo a perda, o jitter e a latência medidos na sessão de vídeo."""
+        while True:
+            time.sleep(REPORT_INTERVAL)
+
+            video_session = self.video_session
+            with self.dest_lock:
+                destination = self.destination_ip
+            if video_session is None or destination is None:
+                continue
+            with self.neighbors_lock:
+                route_info = self.neighbors.get(destination)
+            if route_info is None:
+                continue
+
+            report_message = ControlMessage()
+            report_message.type = ControlMessage.RECEIVER_REPORT
+            report_message.node_ip = self.client_ip
+            report_message.node_id = self.client_id
+            if not video_session.receptionReport(report_message.reports.add()):
+                continue  # Ainda não chegou nenhum pacote
+
+            report = report_message.reports[0]
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                    self.send_control_message_udp(s, (destination, route_info.data_port), report_message)
+                print(f"Sent receiver report to Pop {route_info.node_id}: {report.fraction_lost:.1%} lost, jitter {report.jitter * 1000:.1f} ms")
+            except Exception as e:
+                print(f"Failed to send receiver report to {route_info.node_id}: {e}")
+
+            self.adapt_rendition(video_session, report, destination, route_info)
+
+    def adapt_rendition(self, video_session, report, destination, route_info):
+        """Escolhe a variante do filme a partir do último relatório de receção e muda para ela se for outra."""
+        if video_session.state != video_session.PLAYING or video_session.switching or video_session.pendingStream is not None:
+            return  # Em pausa ou troca anterior ainda em curso
+        rendition = self.renditions.update(report.fraction_lost, video_session.delivery)
+        if rendition != self.filename:
+            self.switch_rendition(video_session, rendition, destination, route_info)
+
+    def switch_rendition(self, video_session, rendition, destination, route_info):
+        """
+        Make-before-break entre variantes: ativa a rota da nova variante no PoP atual, pede-a
+        na sessão RTSP quando a rota já está montada e só depois desativa a variante anterior.
+        """
+        previous = self.filename
+        print(f"Switching from {previous} to {rendition} ({video_session.delivery or 0.0:.0%} delivered).")
+        if not self.send_route_activation(destination, route_info, rendition):
+            return
+        self.filename = rendition
+
+        change = threading.Timer(RENDITION_SWITCH_DELAY, video_session.changeStream, args=(rendition,))
+        change.daemon = True
+        change.start()
+        finish = threading.Timer(RENDITION_SWITCH_DELAY + SWITCH_OVERLAP, self.finish_rendition_switch, args=(video_session, destination, route_info, previous, rendition))
+        finish.daemon = True
+        finish.start()
+
+    def finish_rendition_switch(self, video_session, destination, route_info, previous, rendition):
+        """Fim da sobreposição: desativa no PoP a variante que deixou de ser usada."""
+        if rendition not in (video_session.fileName, video_session.pendingStream):
+            # A sessão não chegou a mudar (entretanto entrou em pausa): fica a variante anterior
+            self.filename = previous
+            self.renditions.select(previous)
+            previous = rendition
+        self.send_route_deactivation(destination, route_info, previous)
 
     def handle_ack(self, response_message, s, received_time):
         """ Recebe os acks de volta dos PoP's """
@@ -440,9 +628,10 @@ class Client:
 
             # Resetamos as tentativas falhas em caso de resposta
             with self.neighbors_lock: 
-                self.neighbors[response_message.node_ip]["best_time"] = response_message.accumulated_time
-                self.neighbors[response_message.node_ip]["failed-attempts"] = 0
-                self.neighbors[response_message.node_ip]["status"] = "active"
+                self.neighbors[response_message.node_ip].best_time = response_message.accumulated_time
+                self.neighbors[response_message.node_ip].load = response_message.load
+                self.neighbors[response_message.node_ip].failed_attempts = 0
+                self.neighbors[response_message.node_ip].status = Status.ACTIVE
 
         except Exception as e:
             print(f"Error in receiving message: {e}") 
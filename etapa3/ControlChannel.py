@@ -0,0 +1,243 @@
+import asyncio, select, socket, threading
+from collections import deque
+
+CONTROL_MESSAGE = b'\x01'   # Header para ControlMessage
+FLOODING_MESSAGE = b'\x02'  # Header para FloodingMessage
+
+MAX_MESSAGE_SIZE = 1 << 20  # Limite de segurança para o comprimento anunciado
+CONNECT_TIMEOUT = 5         # Segundos para estabelecer ligação / esperar pela resposta
+
+# Formato de cada mensagem no canal TCP de controlo:
+#   header (1 byte) | comprimento do corpo (varint) | corpo (protobuf serializado)
+# O comprimento permite ler exatamente uma mensagem, mesmo que várias cheguem
+# juntas no mesmo segmento TCP ou que uma mensagem grande chegue em vários.
+
+def encode_varint(value):
+    """Codifica um inteiro não negativo em varint (7 bits por byte, como no protobuf)."""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def frame_message(header, message):
+    """Retorna os bytes de uma mensagem protobuf enquadrada para o canal de controlo."""
+    payload = message.SerializeToString()
+    return header + encode_varint(len(payload)) + payload
+
+def send_message(sock, header, message):
+    sock.sendall(frame_message(header, message))
+
+def recv_exact(sock, size):
+    """Lê exatamente size bytes do socket, ou retorna None se a ligação fechar a meio."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        nbytes = sock.recv_into(view[received:])
+        if not nbytes:
+            return None
+        received += nbytes
+    return bytes(buffer)
+
+def read_message(sock):
+    """
+    Lê uma mensagem enquadrada do socket.
+    Retorna (header, corpo) ou (None, None) se a ligação foi fechada.
+    """
+    header = recv_exact(sock, 1)
+    if header is None:
+        return None, None
+
+    length = 0
+    shift = 0
+    while True:
+        byte = recv_exact(sock, 1)
+        if byte is None:
+            return None, None
+        length |= (byte[0] & 0x7F) << shift
+        if not byte[0] & 0x80:
+            break
+        shift += 7
+        if shift > 28:
+            raise ValueError("Comprimento varint inválido")
+
+    if length > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Mensagem de controlo demasiado grande: {length} bytes")
+
+    data = recv_exact(sock, length) if length else b''
+    if data is None:
+        return None, None
+    return header, data
+
+async def read_message_async(reader):
+    """Versão asyncio de read_message para um StreamReader."""
+    try:
+        header = await reader.readexactly(1)
+
+        length = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+            if shift > 28:
+                raise ValueError("Comprimento varint inválido")
+
+        if length > MAX_MESSAGE_SIZE:
+            raise ValueError(f"Mensagem de controlo demasiado grande: {length} bytes")
+
+        data = await reader.readexactly(length) if length else b''
+    except asyncio.IncompleteReadError:
+        return None, None
+    return header, data
+
+class PendingReply:
+    """Resposta esperada por um pedido já escrito numa ligação partilhada."""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+
+class PooledConnection:
+    """
+    Ligação TCP persistente para o servidor de controlo de um vizinho.
+    Todas as mensagens para esse vizinho partilham a ligação. O lock só protege a
+    escrita (cada mensagem é escrita inteira, sem se misturar); as respostas chegam
+    pela ordem dos pedidos e são entregues a quem as espera (pending) por um leitor
+    de cada vez, sem bloquear os envios enquanto um PING espera pelo PONG.
+    """
+    def __init__(self, address, timeout=CONNECT_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        self.pending = deque()  # PendingReply pela ordem em que os pedidos foram escritos
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def is_alive(self):
+        """
+        O vizinho nunca envia dados sem ter sido pedida uma resposta, logo se a
+        ligação estiver legível enquanto está parada é porque foi fechada.
+        """
+        if self.pending:
+            return True  # Os dados legíveis podem ser uma resposta ainda por ler
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return True
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) != b''
+        except OSError:
+            return False
+
+    def close(self, error=None):
+        """Fecha a ligação; os pedidos que esperavam resposta falham com error."""
+        while self.pending:
+            waiter = self.pending.popleft()
+            waiter.error = error or ConnectionError("Ligação fechada antes da resposta")
+            waiter.done = True
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def exchange(self, data, expect_reply):
+        """
+        Envia os bytes da mensagem e, se pedido, espera pela resposta.
+        Só é feita uma segunda tentativa, numa ligação nova, quando a escrita falha numa
+        ligação reutilizada (fechada pelo vizinho entretanto): depois de o pedido estar
+        escrito nunca é reenviado, porque ativações e desativações não são idempotentes.
+        """
+        with self.lock:
+            if self.sock is not None and not self.is_alive():
+                self.close()
+            reused = self.sock is not None
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                if not reused:
+                    raise
+                try:
+                    self.connect()
+                    self.sock.sendall(data)
+                except OSError:
+                    self.close()
+                    raise
+
+            if not expect_reply:
+                return None
+            waiter = PendingReply()
+            self.pending.append(waiter)
+            sock = self.sock
+
+        return self.wait_reply(sock, waiter)
+
+    def wait_reply(self, sock, waiter):
+        """Lê respostas da ligação, pela ordem dos pedidos, até chegar a deste pedido."""
+        with self.read_lock:
+            while not waiter.done:
+                try:
+                    header, reply = read_message(sock)
+                    if header is None:
+                        raise ConnectionError("Ligação fechada antes da resposta")
+                except (OSError, ValueError) as e:
+                    with self.lock:
+                        if self.sock is sock:
+                            self.close(e)
+                    break
+                with self.lock:
+                    if self.sock is not sock or not self.pending:
+                        break  # Ligação substituída entretanto
+                    answered = self.pending.popleft()
+                answered.result = (header, reply)
+                answered.done = True
+
+        if not waiter.done:
+            raise ConnectionError("Ligação fechada antes da resposta")
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.result
+
+class ConnectionPool:
+    """Conjunto de ligações persistentes de controlo, uma por (ip, porta) de vizinho."""
+    def __init__(self, timeout=CONNECT_TIMEOUT):
+        self.timeout = timeout
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, address):
+        with self.lock:
+            connection = self.connections.get(address)
+            if connection is None:
+                connection = self.connections[address] = PooledConnection(address, self.timeout)
+            return connection
+
+    def send(self, address, header, message):
+        """Envia uma mensagem sem resposta (flooding, ativação, notificações)."""
+        self.get(address).exchange(frame_message(header, message), False)
+
+    def request(self, address, header, message):
+        """Envia uma mensagem e retorna a resposta (header, corpo), como no PING/PONG."""
+        return self.get(address).exchange(frame_message(header, message), True)
+
+    def discard(self, address):
+        """Fecha a ligação a um vizinho (por exemplo, quando é dado como inativo)."""
+        with self.lock:
+            connection = self.connections.pop(address, None)
+        if connection is not None:
+            with connection.lock:
+                connection.close()
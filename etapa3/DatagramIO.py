@@ -0,0 +1,136 @@
+import ctypes, ctypes.util, select, socket, sys
+
+RECEIVE_SLOTS = 32          # Buffers pré-alocados de cada anel de receção
+RECEIVE_BURST = 16          # Máximo de datagramas lidos por cada evento de leitura
+CONTROL_DATAGRAM_SIZE = 4096  # Mensagens de controlo/flooding por UDP
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+# sendmmsg(2) através da libc (sem extensões nativas). Fora do Linux, ou sem a função
+# na libc, os envios são feitos com um sendto() por destino.
+def load_sendmmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int)
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+class IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(IoVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+class SockAddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_ubyte * 4), ("sin_zero", ctypes.c_ubyte * 8)]
+
+SENDMMSG = load_sendmmsg()
+
+class FanOut:
+    """
+    Conjunto imutável de destinos UDP para onde o mesmo datagrama é enviado.
+    Com sendmmsg os cabeçalhos (um por destino, todos a apontar para o mesmo buffer)
+    são preparados uma única vez, pelo que cada pacote reencaminhado custa uma
+    chamada ao sistema em vez de uma por destino.
+    """
+    __slots__ = ("addresses", "names", "iov", "messages")
+
+    def __init__(self, addresses):
+        self.addresses = tuple(addresses)
+        self.messages = None
+        if SENDMMSG is None or len(self.addresses) < 2:
+            return
+
+        try:
+            self.names = (SockAddrIn * len(self.addresses))()
+            for name, (ip, port) in zip(self.names, self.addresses):
+                name.sin_family = socket.AF_INET
+                name.sin_port = socket.htons(port)
+                name.sin_addr[:] = socket.inet_aton(ip)
+        except (OSError, OverflowError):
+            return  # Endereço que não é IPv4 literal: fica o caminho com sendto()
+
+        self.iov = IoVec()
+        self.messages = (MMsgHdr * len(self.addresses))()
+        for message, name in zip(self.messages, self.names):
+            message.msg_hdr.msg_name = ctypes.addressof(name)
+            message.msg_hdr.msg_namelen = ctypes.sizeof(SockAddrIn)
+            message.msg_hdr.msg_iov = ctypes.pointer(self.iov)
+            message.msg_hdr.msg_iovlen = 1
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def send(self, sock, buffer, nbytes):
+        """
+        Envia os primeiros nbytes de buffer (bytearray) para todos os destinos.
+        Não é reentrante: cada FanOut é usado apenas pela thread de reencaminhamento.
+        """
+        sent = 0
+        if self.messages is not None:
+            self.iov.iov_base = ctypes.addressof((ctypes.c_char * nbytes).from_buffer(buffer))
+            self.iov.iov_len = nbytes
+            fd = sock.fileno()
+            total = len(self.messages)
+            while sent < total:
+                count = SENDMMSG(fd, ctypes.byref(self.messages, sent * ctypes.sizeof(MMsgHdr)), total - sent, 0)
+                if count <= 0:
+                    break  # O resto segue pelo sendto(), que reporta o erro por destino
+                sent += count
+
+        packet = memoryview(buffer)[:nbytes]
+        for address in self.addresses[sent:]:
+            try:
+                sock.sendto(packet, address)
+            except OSError as e:
+                print(f"Falha ao enviar pacote RTP para {address}: {e}")
+
+class ReceiveRing:
+    """
+    Receção em rajada para um socket UDP.
+    Os datagramas são lidos com recvfrom_into para um anel de bytearray pré-alocados,
+    sem criar um objeto bytes por pacote. Cada chamada a receive() espera pelo primeiro
+    datagrama e depois drena, sem bloquear, os que já estão na fila do socket.
+    Os buffers são reutilizados nas rajadas seguintes: quem precisar de guardar um
+    datagrama para além do seu processamento tem de o copiar.
+    O socket tem de estar em modo bloqueante (sem timeout); o timeout é dado a receive().
+    """
+    def __init__(self, sock, size, slots=RECEIVE_SLOTS, burst=RECEIVE_BURST):
+        self.sock = sock
+        self.buffers = [bytearray(size) for _ in range(slots)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.next = 0
+        # Sem MSG_DONTWAIT não é possível drenar sem bloquear: um datagrama por chamada
+        self.burst = min(burst, slots) if MSG_DONTWAIT else 1
+
+    def receive(self, timeout=None):
+        """
+        Retorna a lista de (buffer, datagrama, endereço) da rajada; datagrama é uma
+        memoryview sobre buffer. Retorna uma lista vazia se passarem timeout segundos sem dados.
+        """
+        if timeout is not None and not select.select((self.sock,), (), (), timeout)[0]:
+            return []
+
+        batch = []
+        flags = 0
+        for _ in range(self.burst):
+            index = self.next
+            try:
+                nbytes, address = self.sock.recvfrom_into(self.buffers[index], 0, flags)
+            except BlockingIOError:
+                break  # Fila do socket vazia
+            self.next = (index + 1) % len(self.buffers)
+            batch.append((self.buffers[index], self.views[index][:nbytes], address))
+            flags = MSG_DONTWAIT
+        return batch
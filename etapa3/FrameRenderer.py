@@ -0,0 +1,90 @@
+import io, threading
+from collections import deque
+from PIL import Image, ImageTk
+
+DECODE_QUEUE_SIZE = 4  # Frames JPEG à espera de descodificação
+READY_QUEUE_SIZE = 2   # Imagens descodificadas à espera de serem mostradas
+RENDER_INTERVAL = 5    # Milissegundos entre verificações do loop do Tk
+
+class FrameRenderer:
+    """
+    Pipeline de apresentação dos frames de uma sessão de vídeo, sem ficheiros em disco.
+    A thread de receção só entrega os bytes do JPEG (submit); uma thread própria
+    descodifica-os a partir de memória e o loop do Tk, com after(), converte a imagem
+    mais recente em PhotoImage e atualiza o label. Os widgets só são tocados pela
+    thread do Tk e as duas filas são limitadas: se a apresentação se atrasar, os
+    frames mais antigos são descartados em vez de acumular latência.
+    """
+    def __init__(self, master, label, height=288):
+        self.master = master
+        self.label = label
+        self.height = height
+
+        self.pending = deque(maxlen=DECODE_QUEUE_SIZE)  # bytes JPEG
+        self.ready = deque(maxlen=READY_QUEUE_SIZE)     # Imagens PIL já descodificadas
+        self.condition = threading.Condition()
+        self.running = False
+        self.dropped = 0
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self.decode_loop, daemon=True).start()
+        self.master.after(RENDER_INTERVAL, self.render)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.pending.clear()
+            self.condition.notify()
+
+    def submit(self, frame):
+        """Entrega um frame JPEG completo para descodificação (chamado pela thread de receção)."""
+        with self.condition:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(frame)
+            self.condition.notify()
+
+    def decode_loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame = self.pending.popleft()
+
+            try:
+                image = Image.open(io.BytesIO(frame))
+                image.load()  # Descodifica já, fora da thread do Tk
+            except Exception as e:
+                print(f"Frame JPEG inválido: {e}")
+                continue
+
+            with self.condition:
+                if len(self.ready) == self.ready.maxlen:
+                    self.dropped += 1
+                self.ready.append(image)
+
+    def render(self):
+        """Corre no loop do Tk: mostra a imagem mais recente e volta a agendar-se."""
+        with self.condition:
+            if not self.running:
+                return
+            image = self.ready.pop() if self.ready else None
+            self.dropped += len(self.ready)
+            self.ready.clear()
+
+        if image is not None:
+            try:
+                photo = ImageTk.PhotoImage(image)
+                self.label.configure(image=photo, height=self.height)
+                self.label.image = photo  # Mantém a referência para o Tk não a descartar
+            except Exception as e:
+                print(f"Falha ao mostrar o frame: {e}")
+                return  # Janela destruída
+
+        self.master.after(RENDER_INTERVAL, self.render)
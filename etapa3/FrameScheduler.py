@@ -0,0 +1,67 @@
+import heapq, itertools, threading, time
+
+DEFAULT_FPS = 20  # Ritmo usado quando o vídeo não indica o seu FPS
+
+class FrameScheduler:
+    """
+    Relógio único que marca o ritmo de envio de todos os fluxos ativos do servidor.
+    Cada fluxo tem um instante inicial e o frame k deve sair em inicio + k / fps
+    (relógio monotónico), pelo que o tempo gasto a enviar não se acumula.
+    Se o envio se atrasar mais do que um frame, os frames em atraso são saltados
+    para o vídeo continuar em tempo real.
+    """
+    def __init__(self):
+        self.streams = {}  # worker -> {"start", "frames", "interval", "generation"}
+        self.heap = []     # (deadline, ordem, generation, worker)
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def add(self, worker, fps):
+        """Começa a marcar o ritmo de um fluxo (não faz nada se já estiver ativo)."""
+        interval = 1.0 / (fps if fps and fps > 0 else DEFAULT_FPS)
+        with self.condition:
+            if worker in self.streams:
+                return
+            now = time.monotonic()
+            generation = next(self.counter)
+            self.streams[worker] = {"start": now, "frames": 0, "interval": interval, "generation": generation}
+            heapq.heappush(self.heap, (now, next(self.counter), generation, worker))
+            self.condition.notify()
+
+    def remove(self, worker):
+        """Deixa de marcar o ritmo de um fluxo (a entrada no heap é descartada quando sair)."""
+        with self.condition:
+            self.streams.pop(worker, None)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                deadline, _, generation, worker = self.heap[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self.condition.wait(deadline - now)
+                    continue
+                heapq.heappop(self.heap)
+
+                entry = self.streams.get(worker)
+                if entry is None or entry["generation"] != generation:
+                    continue
+
+                # Índice do frame que deve estar a ser mostrado agora
+                due = int((now - entry["start"]) / entry["interval"])
+                skipped = max(0, due - entry["frames"])
+                entry["frames"] = max(due, entry["frames"]) + 1
+                next_deadline = entry["start"] + entry["frames"] * entry["interval"]
+                heapq.heappush(self.heap, (next_deadline, next(self.counter), generation, worker))
+
+            try:
+                worker.sendFrame(skipped)
+            except Exception as e:
+                print(f"Erro ao enviar frame: {e}")
@@ -0,0 +1,101 @@
+import cv2
+import mmap, os, struct, threading
+from array import array
+from Renditions import split_variant, encoding
+
+INDEX_MAGIC = b'ESRF'
+INDEX_HEADER = struct.Struct('<4sdI')  # magic, fps, número de frames
+DATA_EXT = ".frames"
+INDEX_EXT = ".frames.idx"
+
+class FrameStore:
+    """
+    Frames JPEG de um filme codificados uma única vez para um ficheiro em disco.
+    O ficheiro de dados é mapeado em memória e um índice de offsets permite obter
+    qualquer frame com um simples slice, sem voltar a descodificar/codificar o vídeo.
+    Cada variante (Renditions) de um filme tem os seus próprios ficheiros, gerados a partir
+    do mesmo vídeo com a qualidade JPEG e a resolução da variante.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.filename, _ = split_variant(name)  # Vídeo de origem
+        self.quality, self.scale = encoding(name)
+        self.data_path = name + DATA_EXT
+        self.index_path = name + INDEX_EXT
+
+        if self.is_stale():
+            self.build()
+        self.load()
+
+    def is_stale(self):
+        """Verifica se é preciso (re)gerar o ficheiro de frames."""
+        if not os.path.exists(self.data_path) or not os.path.exists(self.index_path):
+            return True
+        if not os.path.exists(self.filename):
+            return False
+        return os.path.getmtime(self.index_path) < os.path.getmtime(self.filename)
+
+    def build(self):
+        """Descodifica o vídeo e grava todos os frames em JPEG, seguidos do índice de offsets."""
+        cap = cv2.VideoCapture(self.filename)
+        if not cap.isOpened():
+            raise IOError(f"Não foi possível abrir o arquivo de vídeo {self.filename}")
+
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        offsets = array('Q', [0])
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality] if self.quality is not None else []
+        print(f"A pré-codificar os frames de {self.name}...")
+
+        # Escreve em ficheiros temporários para nunca deixar um índice parcial
+        with open(self.data_path + ".tmp", "wb") as data_file:
+            while True:
+                success, frame = cap.read()
+                if not success:
+                    break
+                if self.scale != 1.0:
+                    frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+                _, encoded_frame = cv2.imencode('.jpg', frame, params)
+                data_file.write(encoded_frame.tobytes())
+                offsets.append(data_file.tell())
+        cap.release()
+
+        with open(self.index_path + ".tmp", "wb") as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, fps, len(offsets) - 1))
+            offsets.tofile(index_file)
+
+        os.replace(self.data_path + ".tmp", self.data_path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        print(f"{len(offsets) - 1} frames de {self.name} guardados em {self.data_path}")
+
+    def load(self):
+        """Mapeia o ficheiro de dados em memória e carrega o índice."""
+        with open(self.index_path, "rb") as index_file:
+            magic, self.fps, count = INDEX_HEADER.unpack(index_file.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC:
+                raise IOError(f"Índice de frames inválido: {self.index_path}")
+            self.offsets = array('Q')
+            self.offsets.fromfile(index_file, count + 1)
+
+        if count == 0:
+            raise IOError(f"O vídeo {self.name} não tem frames")
+
+        with open(self.data_path, "rb") as data_file:
+            self.data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def frame(self, index):
+        """Retorna o frame JPEG com o índice dado (0..len-1)."""
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+stores = {}
+stores_lock = threading.Lock()
+
+def open_store(name):
+    """Retorna o FrameStore partilhado de um filme (ou variante), criando-o na primeira utilização."""
+    with stores_lock:
+        store = stores.get(name)
+        if store is None:
+            store = stores[name] = FrameStore(name)
+        return store
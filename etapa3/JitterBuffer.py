@@ -0,0 +1,174 @@
+import heapq, threading, time
+
+MIN_DELAY = 0.04       # Atraso mínimo de reprodução (segundos)
+MAX_DELAY = 0.5        # Atraso máximo: limita a latência mesmo com muito jitter
+JITTER_FACTOR = 3      # Atraso alvo = 3 x jitter entre chegadas (RFC 3550)
+ADAPT_GAIN = 0.05      # Fração do erro entre o atraso real e o alvo corrigida a cada frame
+JITTER_GAIN = 1 / 16   # Peso de cada amostra no jitter (RFC 3550, 6.4.1)
+FRAME_RATE_GUESS = 20  # Unidades de timestamp por segundo assumidas antes de haver estimativa
+RATE_WINDOW = 1.0      # Segundos de frames antes de estimar o ritmo dos timestamps
+MAX_GAP = 2.0          # Saltos de timestamp maiores do que isto (em segundos) são descontinuidades
+CAPACITY = 64          # Máximo de frames à espera de reprodução
+
+class JitterBuffer:
+    """
+    Buffer de reprodução dos frames recebidos por RTP.
+    Cada frame tem um instante de reprodução dado pelo seu timestamp: base + (ts - ts_base) / ritmo,
+    pelo que os frames saem ao ritmo da origem, qualquer que seja o atraso de cada caminho.
+    O atraso alvo acompanha o jitter entre chegadas (entre MIN_DELAY e MAX_DELAY) e a base é
+    corrigida aos poucos para que o atraso real convirja para o alvo, sem crescer sem limite.
+    Frames que chegam depois do seu instante, ou que já foram ultrapassados por um mais recente,
+    são descartados.
+
+    Os timestamps (32 bits) são estendidos em relação ao último frame, por isso as voltas do
+    contador não alteram a ordem. Quando um frame chega em ordem (número de sequência estendido
+    maior) com um timestamp anterior ou muito à frente do último (o vídeo recomeçou), a linha
+    temporal continua a partir do último frame.
+
+    clock_rate: unidades de timestamp por segundo; se for None é estimado a partir das chegadas.
+    output: chamada com os bytes de cada frame no seu instante de reprodução.
+    """
+    def __init__(self, output, clock_rate=None, min_delay=MIN_DELAY, max_delay=MAX_DELAY, capacity=CAPACITY):
+        self.output = output
+        self.clock_rate = clock_rate
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.capacity = capacity
+
+        self.condition = threading.Condition()
+        self.running = False
+        self.late = 0  # Frames descartados por atraso ou falta de espaço
+        self.reset()
+
+    def reset(self):
+        """Esquece a linha temporal (novo PLAY ou numeração recomeçada)."""
+        with self.condition:
+            self.heap = []         # (timestamp estendido, seq estendido, frame)
+            self.rate = self.clock_rate or FRAME_RATE_GUESS
+            self.anchor = None     # (timestamp estendido, chegada) do primeiro frame, para estimar o ritmo
+            self.base = None       # (timestamp estendido, instante de reprodução) de referência
+            self.last = None       # (seq estendido, timestamp estendido, timestamp recebido) do último frame em ordem
+            self.step = 0          # Intervalo de timestamp entre os dois últimos frames em ordem
+            self.transit = None
+            self.jitter = 0.0
+            self.target = self.min_delay
+            self.played = None     # Timestamp estendido do último frame reproduzido
+            self.condition.notify()
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def push(self, seq, timestamp, frame, arrival=None):
+        """
+        Acrescenta um frame completo. seq é o número de sequência estendido de um dos seus
+        pacotes e timestamp o timestamp RTP. Retorna False se o frame foi descartado por atraso.
+        """
+        if arrival is None:
+            arrival = time.monotonic()
+
+        with self.condition:
+            ts = self.extend(seq, timestamp)
+            if self.base is None:
+                self.anchor = (ts, arrival)
+                self.base = (ts, arrival + self.target)
+            else:
+                self.estimate_rate(ts, arrival)
+            self.update_jitter(ts, arrival)
+
+            # Aproxima o atraso real deste frame do atraso alvo
+            due = self.playout_time(ts)
+            correction = ADAPT_GAIN * (self.target - (due - arrival))
+            self.base = (self.base[0], self.base[1] + correction)
+            due += correction
+
+            if due < arrival or (self.played is not None and ts <= self.played):
+                self.late += 1
+                return False
+
+            if len(self.heap) >= self.capacity:
+                heapq.heappop(self.heap)
+                self.late += 1
+            heapq.heappush(self.heap, (ts, seq, frame))
+            self.condition.notify()
+            return True
+
+    def extend(self, seq, timestamp):
+        """Timestamp estendido (monotónico ao longo do fluxo) do frame."""
+        if self.last is None:
+            self.last = (seq, timestamp, timestamp)
+            return timestamp
+
+        last_seq, last_ts, last_raw = self.last
+        delta = ((timestamp - last_raw + 0x80000000) & 0xFFFFFFFF) - 0x80000000  # Diferença com sinal, módulo 2^32
+        ts = last_ts + delta
+        if seq > last_seq:
+            if delta <= 0 or delta > self.rate * MAX_GAP:
+                # Descontinuidade (o vídeo recomeçou): continua a linha temporal logo após o último frame
+                ts = last_ts + (self.step or max(1, round(self.rate / FRAME_RATE_GUESS)))
+                self.transit = None
+            else:
+                self.step = delta
+            self.last = (seq, ts, timestamp)
+        return ts
+
+    def estimate_rate(self, ts, arrival):
+        """Estima o ritmo dos timestamps quando não é conhecido, mantendo a reprodução contínua."""
+        if self.clock_rate is not None:
+            return
+        anchor_ts, anchor_arrival = self.anchor
+        span = arrival - anchor_arrival
+        if span < RATE_WINDOW or ts <= anchor_ts:
+            return
+        playout = self.playout_time(ts)
+        self.rate = (ts - anchor_ts) / span
+        self.base = (ts, playout)
+
+    def update_jitter(self, ts, arrival):
+        """Jitter entre chegadas (RFC 3550), em segundos, e o atraso alvo que dele resulta."""
+        transit = arrival - ts / self.rate
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) * JITTER_GAIN
+        self.transit = transit
+        self.target = min(self.max_delay, max(self.min_delay, JITTER_FACTOR * self.jitter))
+
+    def playout_time(self, ts):
+        base_ts, base_time = self.base
+        return base_time + (ts - base_ts) / self.rate
+
+    def delay(self):
+        """Atraso alvo atual, em segundos."""
+        with self.condition:
+            return self.target
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                ts, seq, frame = self.heap[0]
+                now = time.monotonic()
+                due = self.playout_time(ts)
+                if due > now:
+                    self.condition.wait(due - now)
+                    continue
+
+                heapq.heappop(self.heap)
+                if self.heap and self.playout_time(self.heap[0][0]) <= now:
+                    self.late += 1  # Já há um frame mais recente para mostrar
+                    continue
+                self.played = ts
+
+            self.output(frame)
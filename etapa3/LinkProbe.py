@@ -0,0 +1,173 @@
+import socket, struct, threading, time
+
+PROBE_PORT = 50053      # Porta UDP padrão das sondas de latência
+PROBE_INTERVAL = 0.2    # Segundos entre sondas para cada vizinho
+LINK_DOWN_PROBES = 4    # Intervalos de sondagem seguidos sem resposta para dar a ligação como em baixo (~0.8 s)
+IDLE_PROBE_INTERVAL = 2.0  # Segundos entre sondas para vizinhos inativos (deteção da recuperação)
+
+PROBE_REQUEST = 1
+PROBE_REPLY = 2
+PROBE_FORMAT = struct.Struct('!BId')  # tipo, número de sequência, instante de envio (relógio monotónico do emissor)
+
+# Constantes do RFC 6298
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+LOSS_ALPHA = 1 / 16  # Peso de cada intervalo de sondagem na média da perda
+
+class LinkEstimate:
+    """Estimativa suavizada (RFC 6298) do RTT e da sua variação para um vizinho."""
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.last_reply = None  # Instante (monotónico) da última resposta recebida
+        self.down = False
+        self.loss = 0.0         # Fração (suavizada) de intervalos de sondagem sem resposta
+        self.replies = 0        # Respostas recebidas desde a última verificação
+        self.misses = 0         # Intervalos de sondagem seguidos sem resposta
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.last_reply = time.monotonic()
+        self.replies += 1
+
+class LinkProbe:
+    """
+    Mede a latência para os vizinhos com sondas UDP pequenas enviadas por um único
+    socket persistente. Cada sonda leva o instante de envio, que o vizinho devolve
+    intacto, pelo que o RTT não inclui estabelecimento de ligações nem estado no recetor.
+    Também responde às sondas dos vizinhos.
+
+    targets: função sem argumentos que retorna os IPs a sondar.
+    on_update: chamada com (ip, srtt, rttvar) sempre que chega uma nova amostra.
+    on_link_down: chamada com (ip) quando um vizinho que respondia deixa de responder
+    durante down_probes intervalos de sondagem seguidos (deteção em menos de um segundo);
+    sondas perdidas isoladas numa ligação carregada não derrubam o vizinho.
+    idle_targets: função sem argumentos que retorna os IPs inativos, sondados a cada
+    IDLE_PROBE_INTERVAL segundos.
+    on_link_up: chamada com (ip) quando responde um vizinho cuja ligação estava em baixo.
+    """
+    def __init__(self, port=PROBE_PORT, targets=None, on_update=None, on_link_down=None,
+                 interval=PROBE_INTERVAL, down_probes=LINK_DOWN_PROBES, idle_targets=None, on_link_up=None):
+        self.port = port
+        self.targets = targets
+        self.idle_targets = idle_targets
+        self.on_update = on_update
+        self.on_link_down = on_link_down
+        self.on_link_up = on_link_up
+        self.interval = interval
+        self.down_probes = down_probes
+        self.last_idle_probe = 0.0
+
+        self.links = {}  # ip -> LinkEstimate
+        self.links_lock = threading.Lock()
+        self.seq = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', self.port))
+
+    def start(self):
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+        if self.targets is not None:
+            threading.Thread(target=self.send_loop, daemon=True).start()
+
+    def send_loop(self):
+        while True:
+            targets = list(self.targets())
+            now = time.monotonic()
+            if self.idle_targets is not None and now - self.last_idle_probe >= IDLE_PROBE_INTERVAL:
+                self.last_idle_probe = now
+                targets.extend(self.idle_targets())
+
+            for ip in targets:
+                self.send_probe(ip)
+            self.check_links()
+            time.sleep(self.interval)
+
+    def send_probe(self, ip):
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        try:
+            self.socket.sendto(PROBE_FORMAT.pack(PROBE_REQUEST, self.seq, time.monotonic()), (ip, self.port))
+        except OSError as e:
+            print(f"Falha ao enviar sonda para {ip}: {e}")
+
+    def check_links(self):
+        """Atualiza a perda de cada ligação e deteta os vizinhos que deixaram de responder às sondas."""
+        failed = []
+        with self.links_lock:
+            for ip, link in self.links.items():
+                sample = 0.0 if link.replies else 1.0
+                link.loss = (1 - LOSS_ALPHA) * link.loss + LOSS_ALPHA * sample
+                link.misses = 0 if link.replies else link.misses + 1
+                link.replies = 0
+                if not link.down and link.last_reply is not None and link.misses >= self.down_probes:
+                    link.down = True
+                    failed.append(ip)
+
+        for ip in failed:
+            print(f"Ligação para {ip} sem resposta a {self.down_probes} sondas seguidas")
+            if self.on_link_down is not None:
+                self.on_link_down(ip)
+
+    def receive_loop(self):
+        buffer = bytearray(PROBE_FORMAT.size)
+        while True:
+            try:
+                nbytes, addr = self.socket.recvfrom_into(buffer)
+                if nbytes != PROBE_FORMAT.size:
+                    continue
+                kind, seq, sent_at = PROBE_FORMAT.unpack(buffer)
+
+                if kind == PROBE_REQUEST:
+                    # Devolve a sonda com o instante original do emissor
+                    self.socket.sendto(PROBE_FORMAT.pack(PROBE_REPLY, seq, sent_at), addr)
+                elif kind == PROBE_REPLY:
+                    self.record(addr[0], time.monotonic() - sent_at)
+            except OSError as e:
+                print(f"Erro ao receber sonda: {e}")
+
+    def record(self, ip, rtt):
+        with self.links_lock:
+            link = self.links.get(ip)
+            if link is None:
+                link = self.links[ip] = LinkEstimate()
+            recovered = link.down
+            if recovered:
+                link.loss = 0.0  # A perda acumulada enquanto esteve em baixo não conta
+            link.update(rtt)
+            link.down = False
+            srtt, rttvar = link.srtt, link.rttvar
+
+        if recovered:
+            print(f"Ligação para {ip} voltou a responder às sondas")
+            if self.on_link_up is not None:
+                self.on_link_up(ip)
+        if self.on_update is not None:
+            self.on_update(ip, srtt, rttvar)
+
+    def estimate(self, ip):
+        """Retorna (srtt, rttvar) do vizinho, ou (None, None) se ainda não há amostras."""
+        with self.links_lock:
+            link = self.links.get(ip)
+            if link is None:
+                return None, None
+            return link.srtt, link.rttvar
+
+    def loss(self, ip):
+        """Retorna a perda estimada (0 a 1) da ligação ao vizinho, ou 0 se ainda não há amostras."""
+        with self.links_lock:
+            link = self.links.get(ip)
+            return link.loss if link is not None else 0.0
+
+    def forget(self, ip):
+        """
+        Descarta a estimativa de um vizinho (por exemplo, quando fica inativo). A ligação
+        fica em baixo até à próxima resposta, que é comunicada a on_link_up.
+        """
+        with self.links_lock:
+            link = self.links[ip] = LinkEstimate()
+            link.down = True
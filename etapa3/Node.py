@@ -2,12 +2,31 @@ import socket
 import threading
 from control_protocol_pb2 import ControlMessage
 from control_protocol_pb2 import FloodingMessage
-from RtpPacket import RtpPacket
+from control_protocol_pb2 import ReceptionReport
+from RtpForwarder import RtpForwarder
+from ControlChannel import CONTROL_MESSAGE, FLOODING_MESSAGE, ConnectionPool, send_message, read_message
+from WorkerPool import WorkerPool, datagram_priority
+from DatagramIO import ReceiveRing, CONTROL_DATAGRAM_SIZE
+from LinkProbe import LinkProbe, PROBE_PORT
+from RouteIndex import RouteIndex, SWITCH_OVERLAP
+from RoutePolicy import RoutePolicy
+from StateStore import StateStore
+from Records import NeighborEntry, RouteEntry, SessionEntry, Status, Request
+from ReceptionReports import ReportTable, REPORT_INTERVAL
+from RtspRequests import RequestBuffer
 import time
 import sys
+import weakref
+
+RTSP_TIMEOUT = 5.0  # Segundos à espera da ligação ou da resposta de um upstream RTSP
+SERVER_ACTIVE_DELAY = 2.0  # Segundos entre ativar a rota até ao servidor e pedir-lhe o fluxo (ACTIVE)
+
+def sequence_newer(a, b):
+    """Compara números de sequência de 32 bits com wraparound (aritmética serial, RFC 1982)."""
+    return 0 < ((a - b) & 0xFFFFFFFF) < 0x80000000
 
 class Node:
-    def __init__(self, node_ip, rtsp_port, rtp_port, node_id, node_type, control_port=50051, data_port=50052, bootstrapper_host='localhost', bootstrapper_port=5000):
+    def __init__(self, node_ip, rtsp_port, rtp_port, node_id, node_type, control_port=50051, data_port=50052, bootstrapper_host='localhost', bootstrapper_port=5000, probe_port=PROBE_PORT):
         self.node_ip = node_ip
         self.rtsp_port = rtsp_port
         self.rtp_port = rtp_port
@@ -18,35 +37,57 @@ class Node:
         self.data_port = data_port
         self.bootstrapper = (bootstrapper_host, bootstrapper_port)
         
-        self.neighbors = {}  # Dicionário para armazenar informações dos vizinhos
-        self.neighbors_lock = threading.Lock()
-        
-        self.routing_table = {}
-        self.routing_lock = threading.Lock()  # Lock para sincronizar o acesso aos vizinhos
-        
-        self.sessions = {} # Vizinhos armazenados por sessões
-        self.sessions_lock = threading.Lock()
+        # Vizinhos, rotas e sessões (por fluxo) e ligações RTSP aos upstreams, em snapshots copy-on-write:
+        # as leituras não usam locks e as escritas nunca bloqueiam o reencaminhamento
+        self.state = StateStore()
         
-        self.neighbors_rtsp = {}  # Para comunicar com os seus vizinhos até ao servidor
-        self.neighbors_rtsp_lock = threading.Lock()
+        self.route_index = RouteIndex()  # Melhor upstream e upstream ativo por fluxo, atualizado incrementalmente
+        self.policy = RoutePolicy()  # Histerese e tempo mínimo antes de trocar de upstream
+        self.adverts = {}  # Último anúncio aceite por origem (origin_id -> FloodingMessage com a métrica deste node)
+        self.routing_lock = threading.Lock()  # Protege só o índice de rotas, os anúncios e a tabela de fluxos (plano de controlo)
+
+        # Tabela de interning dos fluxos anunciada pelo servidor no FLOODING_UPDATE.
+        # As sessões e a tabela de rotas são indexadas pelo id numérico do fluxo.
+        self.stream_table = {}  # nome do fluxo -> id numérico
+        self.stream_names = []  # id numérico -> nome do fluxo
 
         # Criação do socket RTSP (TCP)
         self.rtsp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.rtsp_socket.bind((self.node_ip, self.rtsp_port))
         self.rtsp_socket.listen(5)
         print(f"Node RTSP escutando em {self.node_ip}:{self.rtsp_port}")
+
+        # Um pedido de cada vez em cada ligação RTSP persistente, para as respostas não se trocarem;
+        # um lock por ligação, para que um upstream parado não atrase os pedidos aos outros
+        self.rtsp_locks = weakref.WeakKeyDictionary()  # socket -> Lock
+        self.rtsp_locks_lock = threading.Lock()
         
         # Criação do socket RTP (UDP)
         self.rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.rtp_socket.bind((self.node_ip, self.rtp_port))
+
+        # Motor de fan-out dos pacotes RTP recebidos
+        self.forwarder = RtpForwarder(self.rtp_socket, self.node_ip)
+
+        # Ligações TCP persistentes aos servidores de controlo dos vizinhos
+        self.control_pool = ConnectionPool()
+
+        # Pool limitado que processa as mensagens UDP dos clientes (PoP)
+        self.datagram_pool = WorkerPool(f"Node {self.node_id} data")
+
+        # Relatórios de receção dos vizinhos a jusante, agregados e enviados ao upstream ativo de cada fluxo
+        self.reports = ReportTable()
+
+        # Sondas UDP que medem o RTT suavizado (best_time) e o jitter para cada vizinho
+        self.probe = LinkProbe(probe_port, targets=self.probe_targets, on_update=self.update_link_estimate,
+                               on_link_down=self.handle_link_down, idle_targets=self.idle_probe_targets,
+                               on_link_up=self.handle_link_up)
       
     def send_control_message_tcp(self, socket, control_message):
-        header = b'\x01'
-        socket.sendall(header + control_message.SerializeToString())
+        send_message(socket, CONTROL_MESSAGE, control_message)
 
     def send_flooding_message_tcp(self, socket, flooding_message):
-        header = b'\x02' 
-        socket.sendall(header + flooding_message.SerializeToString())
+        send_message(socket, FLOODING_MESSAGE, flooding_message)
     
     def send_control_message_udp(self, socket, address, control_message):
         header = b'\x01'  # Header para ControlMessage
@@ -78,8 +119,7 @@ class Node:
             self.send_control_message_tcp(s, control_message)
             
             # Recebe e processa a resposta
-            header = s.recv(1)  # Lê o primeiro byte
-            data = s.recv(1024)  # Lê o restante da mensagem
+            header, data = read_message(s)
             
             if header == b'\x01':  # ControlMessage
                 response_message = ControlMessage()
@@ -87,21 +127,13 @@ class Node:
                 
                 if response_message.type == ControlMessage.REGISTER_RESPONSE:
                     print(f"Node {self.node_id} registered")
-                    with self.neighbors_lock:
-                        self.neighbors.clear()  # Limpa vizinhos antigos para o caso de ser uma reativação
-                        for neighbor in response_message.neighbors:
-                            self.neighbors[neighbor.node_ip] = {
-                                "node_id": neighbor.node_id,
-                                "control_port": neighbor.control_port,
-                                "data_port": neighbor.data_port,
-                                "node_type": neighbor.node_type,
-                                "status": "active",
-                                "failed-attempts": 0,
-                                "accumulated_time": float('inf'),
-                                "rtsp_port": neighbor.rtsp_port
-                            }
+                    neighbors = {}  # Substitui os vizinhos antigos para o caso de ser uma reativação
+                    for neighbor in response_message.neighbors:
+                        neighbors[neighbor.node_ip] = NeighborEntry(neighbor.node_ip, neighbor.node_id, neighbor.node_type,
+                                                                    neighbor.control_port, neighbor.data_port, neighbor.rtsp_port)
+                    self.state.neighbors.replace(neighbors)
                         
-                    print(f"Node {self.node_id} neighbors: {self.neighbors}")
+                    print(f"Node {self.node_id} neighbors: {neighbors}")
                     # Após o registro, notifica os vizinhos sobre o registro
                     self.notify_neighbors_registration()
                    
@@ -112,13 +144,10 @@ class Node:
         """
         Notifica os vizinhos que o nó está registrado e que pode haver atualizações.
         """
-        with self.neighbors_lock:
-            neighbors_snapshot =  self.neighbors.copy()
-            
-        for neighbor_ip, neighbor_info in neighbors_snapshot.items():
+        for neighbor_ip, neighbor_info in self.state.neighbors.items():
             try:
                 #Enviar em udp para clientes
-                if neighbor_info["node_id"].startswith("client"):
+                if neighbor_info.is_client():
                     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
                         notify_message = ControlMessage()
                         notify_message.type = ControlMessage.UPDATE_NEIGHBORS
@@ -129,28 +158,33 @@ class Node:
                         notify_message.node_type = self.node_type
                         notify_message.rtsp_port = self.rtsp_port
                         
-                        address = (neighbor_ip, neighbor_info['data_port'])
+                        address = (neighbor_ip, neighbor_info.data_port)
                         self.send_control_message_udp(s, address, notify_message)
-                        print(f"Notified client {neighbor_info['node_id']} of registration.")
+                        print(f"Notified client {neighbor_info.node_id} of registration.")
                     
                 #Enviar em tcp para clientes
                 else:
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                        s.connect((neighbor_ip, neighbor_info['control_port']))
-                        notify_message = ControlMessage()
-                        notify_message.type = ControlMessage.UPDATE_NEIGHBORS
-                        notify_message.node_id = self.node_id
-                        notify_message.node_ip = self.node_ip
-                        notify_message.control_port = self.control_port
-                        notify_message.data_port = self.data_port
-                        notify_message.node_type = self.node_type
-                        notify_message.rtsp_port = self.rtsp_port
-                        
-                        self.send_control_message_tcp(s,notify_message)
-                        print(f"Notified neighbor {neighbor_info['node_id']} of registration.")
+                    self.notify_neighbor(neighbor_ip, neighbor_info)
+                    print(f"Notified neighbor {neighbor_info.node_id} of registration.")
 
             except Exception as e:
-                print(f"Failed to notify neighbor {neighbor_info['node_id']}: {e}")
+                print(f"Failed to notify neighbor {neighbor_info.node_id}: {e}")
+
+    def notify_neighbor(self, neighbor_ip, neighbor_info):
+        """
+        Envia UPDATE_NEIGHBORS a um node ou servidor por TCP. O vizinho marca-nos como
+        ativo e responde com as rotas que conhece (anúncio dos fluxos, no servidor).
+        """
+        notify_message = ControlMessage()
+        notify_message.type = ControlMessage.UPDATE_NEIGHBORS
+        notify_message.node_id = self.node_id
+        notify_message.node_ip = self.node_ip
+        notify_message.control_port = self.control_port
+        notify_message.data_port = self.data_port
+        notify_message.node_type = self.node_type
+        notify_message.rtsp_port = self.rtsp_port
+
+        self.control_pool.send((neighbor_ip, neighbor_info.control_port), CONTROL_MESSAGE, notify_message)
 
     def start(self):
         """
@@ -159,11 +193,13 @@ class Node:
         """
         
         self.register_with_bootstrapper()
+        self.probe.start()
         threading.Thread(target=self.accept_connections).start()
         threading.Thread(target=self.control_server).start()  # Inicia o servidor de controle em uma thread separada
         if self.node_type == "pop":
             threading.Thread(target=self.data_server).start()     # Inicia o servidor de dados em uma thread separada
         threading.Thread(target=self.send_ping_to_neighbors).start()  # Enviar PING aos vizinhos
+        threading.Thread(target=self.send_receiver_reports, daemon=True).start()  # Relatórios de receção para montante
         
     def control_server(self):
         """
@@ -181,59 +217,66 @@ class Node:
     def handle_control_connection(self, conn, addr):
         print(f"Connection from {addr} established.")
         with conn:
-            while True:
-                # Lê o header para determinar o tipo de mensagem
-                header = conn.recv(1)  # Lê o primeiro byte
-                if not header:
-                    break  # Conexão fechada pelo cliente
-                
-                data = conn.recv(1024)  # Lê o restante da mensagem
-                if not data:
-                    break
+            try:
+                while True:
+                    # Lê uma mensagem enquadrada (header + comprimento + corpo)
+                    header, data = read_message(conn)
+                    if header is None:
+                        break  # Conexão fechada pelo vizinho
+
+                    self.handle_control_message(header, data, conn)
+            except (OSError, ValueError) as e:
+                print(f"Control connection from {addr} closed: {e}")
+
+    def handle_control_message(self, header, data, conn):
+        """Processa uma mensagem recebida no canal de controlo (conn é usado para responder)."""
+        if header == b'\x01':  # ControlMessage
+            control_message = ControlMessage()
+            try:
+                control_message.ParseFromString(data)
+                if control_message.type == ControlMessage.UPDATE_NEIGHBORS:
+                    self.handle_update_neighbors(control_message)
+                elif control_message.type == ControlMessage.PING:
+                    self.handle_ping(control_message, conn)
+                elif control_message.type == ControlMessage.RECEIVER_REPORT:
+                    self.handle_receiver_report(control_message)
+                else:
+                    raise ValueError(f"Unknown ControlMessage type: {control_message.type}")
+            except Exception as e:
+                print(f"Failed to parse as ControlMessage: {e}")
                 
-                if header == b'\x01':  # ControlMessage
-                    control_message = ControlMessage()
-                    try:
-                        control_message.ParseFromString(data)
-                        if control_message.type == ControlMessage.UPDATE_NEIGHBORS:
-                            self.handle_update_neighbors(control_message)
-                        elif control_message.type == ControlMessage.PING:
-                            self.handle_ping(control_message, conn)
-                        else:
-                            raise ValueError(f"Unknown ControlMessage type: {control_message.type}")
-                    except Exception as e:
-                        print(f"Failed to parse as ControlMessage: {e}")
+        elif header == b'\x02':  # FloodingMessage
+            flooding_message = FloodingMessage()
+            try:
+                flooding_message.ParseFromString(data)
+                if flooding_message.type == FloodingMessage.FLOODING_UPDATE:
+                    self.handle_flooding_message(flooding_message)
+                    
+                elif flooding_message.type == FloodingMessage.ACTIVATE_ROUTE:
+                    self.activate_best_route(flooding_message, "node")
+                    self.handle_rtp_forwarding()
+                    
+                elif flooding_message.type == FloodingMessage.DEACTIVATE_ROUTE:
+                    self.handle_deactivate_route(flooding_message)
                         
-                elif header == b'\x02':  # FloodingMessage
-                    flooding_message = FloodingMessage()
-                    try:
-                        flooding_message.ParseFromString(data)
-                        if flooding_message.type == FloodingMessage.FLOODING_UPDATE:
-                            self.handle_flooding_message(flooding_message)
-                            
-                        elif flooding_message.type == FloodingMessage.ACTIVATE_ROUTE:
-                            self.activate_best_route(flooding_message, "node")
-                            self.handle_rtp_forwarding()
-                            
-                        elif flooding_message.type == FloodingMessage.DEACTIVATE_ROUTE:
-                            filename = flooding_message.stream_ids[0]
-                            with self.sessions_lock:
-                                del self.sessions[filename][flooding_message.source_ip]  # Desativa o envio de pacotes para a rota de onde veio a mensagem
-                                sessions_snapshot = self.sessions[filename].copy()
-
-                            print(f"DESATIVAÇÃO DA SESSÃO PARA {flooding_message.source_ip}")
-                            
-                            # Se o node não estiver a enviar dados para mais nenhuma rota, chama a função fornecida
-                            if len(sessions_snapshot) == 0:
-                                self.deactivate_routes(flooding_message.source_ip, filename)
-                                
-                        else:
-                            raise ValueError(f"Unknown FloodingMessage type: {flooding_message.type}")
-                    except Exception as e:
-                        print(f"Failed to parse as FloodingMessage: {e}")
                 else:
-                    print("Unknown message header received. Ignoring.")
-                    continue
+                    raise ValueError(f"Unknown FloodingMessage type: {flooding_message.type}")
+            except Exception as e:
+                print(f"Failed to parse as FloodingMessage: {e}")
+        else:
+            print("Unknown message header received. Ignoring.")
+
+    def handle_deactivate_route(self, flooding_message):
+        stream_id = self.lookup_stream(flooding_message.stream_ids[0])
+        sessions = self.state.sessions(stream_id)
+        session = sessions.remove(flooding_message.source_ip)  # Desativa o envio de pacotes para a rota de onde veio a mensagem
+
+        print(f"DESATIVAÇÃO DA SESSÃO PARA {flooding_message.source_ip}")
+        self.refresh_forwarding(stream_id)
+        
+        # Se o node não estiver a enviar dados para mais nenhuma rota, reencaminha para o seu sucessor
+        if len(sessions) == 0:
+            self.deactivate_routes(flooding_message.source_ip, stream_id)
 
     def handle_update_neighbors(self, control_message):
         print(f"Updating neighbors with {control_message.node_id}")
@@ -244,143 +287,230 @@ class Node:
         node_type = control_message.node_type
         rtsp_port = control_message.rtsp_port
     
-        with self.neighbors_lock:
-            neighbors_snapshot =  self.neighbors.copy()
-            
         # Se o vizinho já estiver na lista, atualiza o status
-        if neighbor_ip in neighbors_snapshot:
-            with self.neighbors_lock:
-                self.neighbors[neighbor_ip]["status"] = "active"
+        neighbor_info = self.state.neighbors.update(neighbor_ip, status=Status.ACTIVE, failed_attempts=0)
+        if neighbor_info is not None:
             print(f"Updated status of existing neighbor {neighbor_id} to active.")
         else:
-            with self.neighbors_lock:
-                # Armazena as informações do vizinho se ele não estiver presente
-                self.neighbors[neighbor_ip] = {
-                    "node_id": neighbor_id,
-                    "control_port": control_port,
-                    "data_port": data_port,
-                    "node_type": node_type,
-                    "failed-attempts": 0,
-                    "status": "active",  # Define o status como ativo
-                    "best_time": float('inf'),
-                    "accumulated_time": float('inf'),
-                    "rtsp_port": rtsp_port
-                }
+            # Armazena as informações do vizinho se ele não estiver presente (ativo)
+            neighbor_info = NeighborEntry(neighbor_ip, neighbor_id, node_type, control_port, data_port, rtsp_port)
+            self.state.neighbors.put(neighbor_ip, neighbor_info)
             print(f"Added new neighbor: {neighbor_id}")
       
-        print(f"Node {self.node_id} neighbors: {self.neighbors}")
+        print(f"Node {self.node_id} neighbors: {dict(self.state.neighbors.items())}")
+
+        # O vizinho (re)registou-se sem estado: envia-lhe as rotas conhecidas
+        if not neighbor_id.startswith("client"):
+            self.send_adverts(neighbor_ip, neighbor_info)
         
     def send_ping_to_neighbors(self):
         """Inicia uma thread para gerenciar o PING para cada vizinho ativo."""
         while True:
-            with self.neighbors_lock:
-                neighbors_snapshot =  self.neighbors.copy()
-                
-            for neighbor_ip, neighbor_info in neighbors_snapshot.items():
-                # Ignora vizinhos inativos ou clientes
-                if neighbor_info.get("status") == "inactive" or neighbor_info["node_id"].startswith("client"):
-                    continue
-
-                # Verifica se o vizinho já atingiu o limite de tentativas falhas
-                if neighbor_info.get("failed-attempts", 0) >= 2:
-                    print(f"Neighbor {neighbor_info['node_id']} considered inactive due to lack of PONG response.")
-                    with self.neighbors_lock:
-                        self.neighbors[neighbor_ip]["status"] = "inactive"
-                        self.neighbors[neighbor_ip]["accumulated_time"] = float('inf')
-                        
-                    # Remover vizinho da tabela de routing
-                    with self.routing_lock:
-                        for destination, streams in list(self.routing_table.items()):
-                            if destination == neighbor_ip:
-                                print(f"Neighbor {neighbor_ip} removido da tabela de routing ")
-                                del self.routing_table[destination]
-
-                    # Remover vizinho das sessões
-                    with self.sessions_lock:
-                        for filename, session_data in list(self.sessions.items()):
-                            if neighbor_ip in session_data:
-                                print(f"Sessão {filename} removida para {neighbor_ip} ")
-                                del self.sessions[filename][neighbor_ip]
-                                                        
-                            # Se o node nao tiver a enviar dados para mais nenhuma rota, reencaminha para o seu sucessor
-                            if len(self.sessions[filename]) == 0:   
-                                self.deactivate_routes(neighbor_ip, filename)
-
-                    continue
-
-                # Cria uma thread para gerenciar o PING/PONG para o vizinho
-                neighbor_thread = threading.Thread(
-                    target=self.manage_neighbor_communication,
-                    args=(neighbor_ip, neighbor_info),
-                    daemon=True
-                )
-                neighbor_thread.start()
+            self.ping_neighbors(self.start_ping_thread)
             time.sleep(15)
 
+    def neighbor_failed(self, neighbor_ip, neighbor_info):
+        """
+        Marca o vizinho como inativo, remove-o das rotas e sessões e comuta
+        os fluxos que dele recebíamos para o upstream de reserva.
+        """
+        self.state.neighbors.update(neighbor_ip, status=Status.INACTIVE, accumulated_time=float('inf'), best_time=float('inf'))
+        self.control_pool.discard((neighbor_ip, neighbor_info.control_port))
+        self.probe.forget(neighbor_ip)
+
+        # Remover vizinho da tabela de routing, guardando antes os fluxos que dele
+        # recebíamos e os respetivos upstreams de reserva pré-calculados
+        with self.routing_lock:
+            switches = [(stream_id, self.route_index.backup(stream_id)) for stream_id in self.route_index.active_streams(neighbor_ip)]
+            if self.state.remove_upstream(neighbor_ip):
+                print(f"Neighbor {neighbor_ip} removido da tabela de routing ")
+            self.route_index.remove_upstream(neighbor_ip)
+
+        # Remover vizinho das sessões
+        empty_streams = []
+        affected_streams = list(self.state.session_shards)
+        for stream_id in affected_streams:
+            sessions = self.state.sessions(stream_id)
+            if sessions.remove(neighbor_ip) is not None:
+                print(f"Sessão {self.stream_name(stream_id)} removida para {neighbor_ip} ")
+
+            if len(sessions) == 0:   
+                empty_streams.append(stream_id)
+
+        # Se o node nao tiver a enviar dados para mais nenhuma rota, reencaminha para o seu sucessor
+        for stream_id in empty_streams:
+            self.deactivate_routes(neighbor_ip, stream_id)
+
+        for stream_id in affected_streams:
+            self.refresh_forwarding(stream_id)
+
+        # Comuta os fluxos que vinham deste vizinho para o upstream de reserva
+        for stream_id, backup_ip in switches:
+            if backup_ip is not None:
+                self.switch_upstream(stream_id, backup_ip)
+
+    def handle_link_down(self, neighbor_ip):
+        """Chamado pelas sondas quando um vizinho deixa de responder (deteção em menos de um segundo)."""
+        self.schedule(0, self.fail_over, neighbor_ip)
+
+    def fail_over(self, neighbor_ip):
+        neighbor_info = self.state.neighbors.get(neighbor_ip)
+        if neighbor_info is None or neighbor_info.status is not Status.ACTIVE:
+            return
+
+        print(f"Neighbor {neighbor_info.node_id} considered inactive due to lack of probe replies.")
+        self.neighbor_failed(neighbor_ip, neighbor_info)
+
+    def handle_link_up(self, neighbor_ip):
+        """Chamado pelas sondas quando um vizinho inativo volta a responder."""
+        self.schedule(0, self.recover_neighbor, neighbor_ip)
+
+    def recover_neighbor(self, neighbor_ip):
+        """
+        Reativa um vizinho que voltou a responder e troca rotas com ele: envia-lhe as
+        rotas conhecidas e pede-lhe as suas, que tinham sido retiradas em neighbor_failed.
+        """
+        neighbor_info = self.state.neighbors.get(neighbor_ip)
+        if neighbor_info is None or neighbor_info.status is Status.ACTIVE or neighbor_info.is_client():
+            return
+
+        neighbor_info = self.state.neighbors.update(neighbor_ip, status=Status.ACTIVE, failed_attempts=0)
+        if neighbor_info is None:
+            return
+        print(f"Neighbor {neighbor_info.node_id} is reachable again, exchanging routes.")
+        self.send_adverts(neighbor_ip, neighbor_info)
+        try:
+            self.notify_neighbor(neighbor_ip, neighbor_info)
+        except Exception as e:
+            print(f"Failed to request routes from {neighbor_info.node_id}: {e}")
+
+    def switch_upstream(self, stream_id, backup_ip):
+        """Passa a receber o fluxo do upstream de reserva com uma única ativação, sem novo flooding."""
+        if not len(self.state.sessions(stream_id)):
+            return  # Ninguém a jusante precisa do fluxo
+
+        with self.routing_lock:
+            route_info = self.state.routes(stream_id).update(backup_ip, stream=Status.ACTIVE, flow=Status.ACTIVE)
+            if route_info is None:
+                return
+            self.route_index.set_active(stream_id, backup_ip)
+        self.policy.record_switch(stream_id, backup_ip)
+
+        filename = self.stream_name(stream_id)
+        print(f"Failover of stream {filename} to backup route {route_info.source_id} at {backup_ip}.")
+        self.refresh_forwarding(stream_id)
+        self.send_route_activation(backup_ip, route_info, filename)
+        if route_info.source_id.startswith("server"):
+            self.send_server_active(backup_ip, route_info, filename)
+
+    def start_ping_thread(self, neighbor_ip, neighbor_info):
+        # Cria uma thread para gerenciar o PING/PONG para o vizinho
+        neighbor_thread = threading.Thread(
+            target=self.manage_neighbor_communication,
+            args=(neighbor_ip, neighbor_info),
+            daemon=True
+        )
+        neighbor_thread.start()
+
+    def ping_neighbors(self, launch):
+        """
+        Faz uma ronda de PING: trata os vizinhos que deixaram de responder e
+        lança (através de launch) a troca PING/PONG com cada vizinho ativo.
+        """
+        for neighbor_ip, neighbor_info in self.state.neighbors.items():
+            # Ignora vizinhos inativos ou clientes
+            if neighbor_info.status is Status.INACTIVE or neighbor_info.is_client():
+                continue
+
+            # Verifica se o vizinho já atingiu o limite de tentativas falhas
+            if neighbor_info.failed_attempts >= 2:
+                print(f"Neighbor {neighbor_info.node_id} considered inactive due to lack of PONG response.")
+                self.neighbor_failed(neighbor_ip, neighbor_info)
+                continue
+
+            launch(neighbor_ip, neighbor_info)
+
+    def probe_targets(self):
+        """Vizinhos (nodes e servidor) ativos para onde são enviadas sondas de latência."""
+        return [ip for ip, info in self.state.neighbors.items()
+                if info.status is Status.ACTIVE and not info.is_client()]
+
+    def idle_probe_targets(self):
+        """Vizinhos (nodes e servidor) inativos, sondados a ritmo lento para detetar a sua recuperação."""
+        return [ip for ip, info in self.state.neighbors.items()
+                if info.status is Status.INACTIVE and not info.is_client()]
+
+    def update_link_estimate(self, neighbor_ip, srtt, rttvar):
+        """Publica as estimativas suavizadas das sondas na tabela de vizinhos."""
+        self.state.neighbors.update(neighbor_ip, best_time=srtt, jitter=rttvar, loss=self.probe.loss(neighbor_ip))
+        self.reindex_neighbor(neighbor_ip)
+
+    def reindex_neighbor(self, neighbor_ip):
+        """Propaga o custo atual do vizinho para o índice de rotas de todos os fluxos que ele anuncia."""
+        neighbor_info = self.state.neighbors.get(neighbor_ip)
+        cost = self.route_cost(neighbor_info) if neighbor_info else float('inf')
+        with self.routing_lock:
+            self.route_index.update_cost(neighbor_ip, cost)
+
+    def route_cost(self, neighbor_info):
+        """
+        Custo até ao servidor através de um vizinho: tempo acumulado que ele anuncia +
+        custo da ligação (RTT, perda e carga do vizinho, combinados pela política).
+        """
+        link_cost = self.policy.cost(neighbor_info.best_time, neighbor_info.loss, neighbor_info.load)
+        return neighbor_info.accumulated_time + link_cost
+
+    def session_load(self):
+        """Número de sessões a jusante servidas por este nó, anunciado aos vizinhos como carga."""
+        return self.state.session_count()
+
     def manage_neighbor_communication(self, neighbor_ip, neighbor_info):
         """Envia PING, recebe PONG e atualiza informações do vizinho."""
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((neighbor_ip, neighbor_info['control_port']))
-
-                # Prepara mensagem de PING
-                ping_message = ControlMessage()
-                ping_message.type = ControlMessage.PING
-                ping_message.node_ip = self.node_ip
-                ping_message.node_id = self.node_id
-
-                # Calcula o menor RTT local e soma ao menor tempo acumulado recebido
-                rtt_vizinho = neighbor_info.get("best_time", float('inf'))
-                print(f"Melhor rtt para os vizinhos: {rtt_vizinho:.4f}")
-                
-                best_received_neighbor = None
-                best_received_accumulated_time = float('inf')
+            # Prepara mensagem de PING
+            ping_message = ControlMessage()
+            ping_message.type = ControlMessage.PING
+            ping_message.node_ip = self.node_ip
+            ping_message.node_id = self.node_id
 
-                with self.neighbors_lock:
-                    neighbors_snapshot =  self.neighbors.copy()
-                    
-                for n_ip, n_info in neighbors_snapshot.items():
-                    accumulated_time = n_info.get("accumulated_time", float('inf'))
-                    if accumulated_time < best_received_accumulated_time:
-                        best_received_accumulated_time = accumulated_time
-                        best_received_neighbor = n_info["node_id"]
-
-                if best_received_neighbor is not None:
-                    print(f"Melhor tempo acumulado até ao servidor: {best_received_accumulated_time:.4f} é do vizinho {best_received_neighbor}")
-                else:
-                    print("Nenhum tempo acumulado válido encontrado nos vizinhos.")
-
-                new_accumulated_time = best_received_accumulated_time + rtt_vizinho
-                # Envia o tempo acumulado calculado
-                send_time = time.time()
-                ping_message.timestamp = send_time
-                ping_message.accumulated_time = new_accumulated_time
-                self.send_control_message_tcp(s, ping_message)
-                print(f"Sent PING to {neighbor_info['node_id']} with accumulated time: {new_accumulated_time:.4f}")
-
-                # Espera pelo PONG
-                header = s.recv(1)  # Lê o primeiro byte
-                data = s.recv(1024)  # Lê o restante da mensagem
-                if data:
-                    if header == b'\x01':  # ControlMessage
-                        response_message = ControlMessage()
-                        response_message.ParseFromString(data)
-                        if response_message.type == ControlMessage.PONG:
-                            print(f"Received PONG from {response_message.node_id}")
-                            receive_time = time.time()
-
-                            # Calcula o RTT
-                            rtt = receive_time - send_time
-                            with self.neighbors_lock:
-                                self.neighbors[neighbor_ip]["best_time"] = rtt
-                                self.neighbors[neighbor_ip]["failed-attempts"] = 0
-                                self.neighbors[neighbor_ip]["status"] = "active"
+            # Anuncia o menor custo até ao servidor (tempo acumulado do vizinho + RTT suavizado da ligação);
+            # o vizinho soma-lhe o RTT que ele próprio mede para este nó
+            best_received_neighbor = None
+            new_accumulated_time = float('inf')
+
+            for n_ip, n_info in self.state.neighbors.items():
+                cost = self.route_cost(n_info)
+                if cost < new_accumulated_time:
+                    new_accumulated_time = cost
+                    best_received_neighbor = n_info.node_id
+
+            if best_received_neighbor is not None:
+                print(f"Melhor tempo acumulado até ao servidor: {new_accumulated_time:.4f} através do vizinho {best_received_neighbor}")
+            else:
+                print("Nenhum tempo acumulado válido encontrado nos vizinhos.")
+
+            # Envia o tempo acumulado calculado
+            send_time = time.time()
+            ping_message.timestamp = send_time
+            ping_message.accumulated_time = new_accumulated_time
+            ping_message.load = self.session_load()
+            # Envia o PING na ligação persistente ao vizinho e espera pelo PONG
+            header, data = self.control_pool.request((neighbor_ip, neighbor_info.control_port), CONTROL_MESSAGE, ping_message)
+            print(f"Sent PING to {neighbor_info.node_id} with accumulated time: {new_accumulated_time:.4f}")
+
+            if data:
+                if header == b'\x01':  # ControlMessage
+                    response_message = ControlMessage()
+                    response_message.ParseFromString(data)
+                    if response_message.type == ControlMessage.PONG:
+                        print(f"Received PONG from {response_message.node_id}")
+                        # O RTT da ligação vem das sondas UDP (update_link_estimate), o PONG só confirma que o vizinho está vivo
+                        self.state.neighbors.update(neighbor_ip, status=Status.ACTIVE, failed_attempts=0)
 
         except Exception as e:
             # Incrementa contador de falhas
-            print(f"Failed to communicate with {neighbor_info['node_id']}: {e}")
-            with self.neighbors_lock:
-                self.neighbors[neighbor_ip]["failed-attempts"] = neighbor_info.get("failed-attempts", 0) + 1
+            print(f"Failed to communicate with {neighbor_info.node_id}: {e}")
+            self.state.neighbors.update(neighbor_ip, failed_attempts=neighbor_info.failed_attempts + 1)
              
     def handle_ping(self, control_message, conn):
         # Processa PING recebido
@@ -389,13 +519,9 @@ class Node:
         # Atualiza tempo acumulado recebido
         received_accumulated_time = control_message.accumulated_time
 
-        with self.neighbors_lock:
-            neighbors_snapshot =  self.neighbors.copy()
-            
-        if control_message.node_ip in neighbors_snapshot:
-            # Atualiza o tempo acumulado vindo do vizinho
-            with self.neighbors_lock:
-                self.neighbors[control_message.node_ip]["accumulated_time"] = received_accumulated_time
+        # Atualiza o tempo acumulado vindo do vizinho
+        if self.state.neighbors.update(control_message.node_ip, accumulated_time=received_accumulated_time, load=control_message.load):
+            self.reindex_neighbor(control_message.node_ip)
 
         # Responde com PONG
         pong_message = ControlMessage()
@@ -405,165 +531,261 @@ class Node:
         print(f"Sent PONG to {control_message.node_id}")
                     
     def handle_flooding_message(self, flooding_message):
-        print(f"Received flooding message from {flooding_message.source_ip}")
+        print(f"Received flooding message from {flooding_message.source_ip} (seq {flooding_message.sequence}, metric {flooding_message.metric})")
+        sender_ip = flooding_message.source_ip
 
-        # Atualiza a tabela de rotas
+        # A rota através do remetente é sempre registada (com a sua métrica)
         self.update_route_table(flooding_message)
-        
-        with self.neighbors_lock:
-            neighbors_snapshot =  self.neighbors.copy()
+
+        # Só é reencaminhado o que é novo: um número de sequência mais recente da origem,
+        # ou o mesmo anúncio por um caminho mais curto. Duplicados ficam por aqui.
+        origin = flooding_message.origin_id or flooding_message.source_id
+        metric = flooding_message.metric + 1
+        with self.routing_lock:
+            advert = self.adverts.get(origin)
+            if advert is not None and not sequence_newer(flooding_message.sequence, advert.sequence):
+                if flooding_message.sequence != advert.sequence or metric >= advert.metric:
+                    print(f"Duplicate flooding message from {origin} (seq {flooding_message.sequence}) suppressed")
+                    return
+
+            update = FloodingMessage()
+            update.CopyFrom(flooding_message)
+            update.origin_id = origin
+            update.source_ip = self.node_ip
+            update.source_id = self.node_id
+            update.control_port = self.control_port
+            update.rtsp_port = self.rtsp_port
+            update.metric = metric
+
+            # Guarda o anúncio acumulado da origem, para o enviar a vizinhos que apareçam mais tarde
+            merged = FloodingMessage()
+            merged.CopyFrom(update)
+            if advert is not None:
+                for stream in advert.streams:
+                    if stream.name not in update.stream_ids:
+                        merged.stream_ids.append(stream.name)
+                        merged.streams.add().CopyFrom(stream)
+            self.adverts[origin] = merged
+        upstreams = self.state.upstreams()
             
-        # Reencaminha a mensagem para todos os vizinhos, exceto o remetente com a atualização da métrica
-        for neighbor_ip, neighbor_info in neighbors_snapshot.items():
-            if neighbor_ip != flooding_message.source_ip and neighbor_ip not in self.routing_table and neighbor_info["status"] == "active":  # Não reencaminhe de volta para quem enviou
-                if not neighbor_info["node_id"].startswith("client"): # nao enviar flooding para cliente
+        # Reencaminha a atualização para os vizinhos, exceto o remetente e quem já nos anuncia rotas (split horizon)
+        for neighbor_ip, neighbor_info in self.state.neighbors.items():
+            if neighbor_ip != sender_ip and neighbor_ip not in upstreams and neighbor_info.status is Status.ACTIVE:
+                if not neighbor_info.is_client(): # nao enviar flooding para cliente
                     try:
-                        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                            s.connect((neighbor_ip, neighbor_info['control_port']))
-                            flooding_message.source_ip = self.node_ip
-                            flooding_message.source_id = self.node_id
-                            flooding_message.control_port = self.control_port
-                            flooding_message.rtsp_port = self.rtsp_port
-                            self.send_flooding_message_tcp(s,flooding_message)
-                            print(f"Re-sent flooding message to {neighbor_info['node_id']}")
+                        self.control_pool.send((neighbor_ip, neighbor_info.control_port), FLOODING_MESSAGE, update)
+                        print(f"Re-sent flooding message to {neighbor_info.node_id}")
                     except Exception as e:
-                        print(f"Failed to re-send flooding message to {neighbor_info['node_id']}: {e}")
+                        print(f"Failed to re-send flooding message to {neighbor_info.node_id}: {e}")
+
+    def send_adverts(self, neighbor_ip, neighbor_info):
+        """Atualização despoletada: envia a um vizinho que (re)apareceu as rotas já conhecidas."""
+        if neighbor_ip in self.state.upstreams():
+            return  # O vizinho já nos anuncia rotas (split horizon)
+        with self.routing_lock:
+            adverts = list(self.adverts.values())
+
+        for advert in adverts:
+            try:
+                self.control_pool.send((neighbor_ip, neighbor_info.control_port), FLOODING_MESSAGE, advert)
+                print(f"Sent known routes from {advert.origin_id} to {neighbor_info.node_id}")
+            except Exception as e:
+                print(f"Failed to send routes to {neighbor_info.node_id}: {e}")
                     
+    def register_streams(self, flooding_message):
+        """Atualiza a tabela de interning com o mapeamento nome -> id anunciado pelo servidor."""
+        with self.routing_lock:
+            for stream in flooding_message.streams:
+                self.stream_table[stream.name] = stream.stream_id
+                if stream.stream_id >= len(self.stream_names):
+                    self.stream_names.extend([None] * (stream.stream_id + 1 - len(self.stream_names)))
+                self.stream_names[stream.stream_id] = stream.name
+
+    def lookup_stream(self, name):
+        """Retorna o id numérico do fluxo, ou None se ainda não foi anunciado."""
+        return self.stream_table.get(name)
+
+    def lookup_streams(self, names):
+        return [self.stream_table[name] for name in names if name in self.stream_table]
+
+    def stream_name(self, stream_id):
+        """Retorna o nome do fluxo associado ao id numérico."""
+        return self.stream_names[stream_id]
+
     def update_route_table(self, flooding_message):
         """
         Atualiza a tabela de rotas com base na mensagem de flooding recebida,
         agora levando em consideração múltiplos fluxos de vídeo.
         """
         destination = flooding_message.source_ip
+        self.register_streams(flooding_message)
+
+        neighbor_info = self.state.neighbors.get(destination)
+        cost = self.route_cost(neighbor_info) if neighbor_info else float('inf')
+        metric = flooding_message.metric + 1  # Saltos até à origem através deste vizinho
                 
-        # Iterar sobre os fluxos de vídeo (stream_ids) recebidos
-        for stream_id in flooding_message.stream_ids:
+        # Iterar sobre os fluxos de vídeo (ids numéricos) recebidos
+        for stream_id in self.lookup_streams(flooding_message.stream_ids):
+            routes = self.state.routes(stream_id)
             with self.routing_lock:
-                if destination not in self.routing_table:
-                    self.routing_table[destination] = {}
+                self.route_index.add_candidate(stream_id, destination, cost, metric)
             
                 # Se a rota para o destino e o fluxo não existirem
-                if (stream_id not in self.routing_table[destination]):
-                    self.routing_table[destination][stream_id] = {
-                        "source_ip": flooding_message.source_ip,
-                        "source_id": flooding_message.source_id,
-                        "status": flooding_message.route_state,
-                        "control_port": flooding_message.control_port,
-                        "rtsp_port": flooding_message.rtsp_port,
-                        "stream": "inactive", #Se pode receber stream ou nao
-                        "flow": "inactive" #Se está a receber stream ou nao
-                    }        
+                route_info = routes.insert(destination, RouteEntry(flooding_message.source_ip, flooding_message.source_id,
+                                                                   flooding_message.route_state, flooding_message.control_port,
+                                                                   flooding_message.rtsp_port, metric))
+                if route_info.metric != metric:
+                    routes.update(destination, metric=metric)
         print(f"Routing table is updated for streams: {list(flooding_message.stream_ids)}")  
                     
     def activate_best_route(self, flooding_message, sender): # Sender diz se é uma ativação do cliente ou se é do node
         """
         Ativa a melhor rota disponível na tabela de rotas com base no tempo
-        para um fluxo específico (filename) contido na mensagem de flooding.
+        para um fluxo específico contido na mensagem de flooding.
         """
         best_route = None
         min_time = float('inf')  # Define o maior valor possível para comparar
         destination = None  
-        filename = None
+        best_stream = None
         forward_activation = False 
+        previous = None  # Upstream ativo antes da troca, mantido durante a sobreposição
 
-        # Acessa os stream_ids da mensagem de flooding
-        stream_ids = flooding_message.stream_ids
+        # Converte os nomes dos fluxos da mensagem nos ids numéricos
+        stream_ids = self.lookup_streams(flooding_message.stream_ids)
 
-        # Procura a melhor rota na tabela de roteamento com base no tempo
+        # Consulta no índice o melhor upstream de cada fluxo (menor tempo acumulado + RTT da ligação)
         with self.routing_lock:
-            routing_snapshot =  self.routing_table.copy()
-            
-        for dest, route_info in routing_snapshot.items():
             for stream_id in stream_ids:
-                if stream_id in route_info:
-                    # Verificar o menor tempo acumulado
-                    with self.neighbors_lock:
-                        if self.neighbors[dest]["accumulated_time"] < min_time:
-                            min_time = self.neighbors[dest]["accumulated_time"]
-                            best_route = route_info[stream_id]
-                            filename = stream_id
-                            destination = dest
-                            
-        if best_route is not None:
-            with self.routing_lock:
-                if self.routing_table[destination][filename]['stream'] == "active":
-                    print(f"Route {best_route['source_id']} at {destination} with {min_time:.4f} time, already active.")
+                dest, cost = self.route_index.best(stream_id)
+                route_info = self.state.route(stream_id, dest) if dest is not None else None
+                if route_info is not None and cost < min_time:
+                    min_time = cost
+                    best_route = route_info
+                    best_stream = stream_id
+                    destination = dest
+
+            if best_route is not None:
+                # A política só troca o upstream ativo se o novo for claramente melhor
+                active = self.route_index.active(best_stream)
+                active_cost = self.route_index.cost(best_stream, active)
+                chosen = self.policy.choose(best_stream, active, active_cost, destination, min_time)
+                kept_route = self.state.route(best_stream, chosen) if chosen != destination else None
+                if kept_route is not None:
+                    print(f"Keeping route through {chosen} ({active_cost:.4f}) instead of {destination} ({min_time:.4f}).")
+                    destination, min_time, best_route = chosen, active_cost, kept_route
+
+                if best_route.stream is Status.ACTIVE:
+                    print(f"Route {best_route.source_id} at {destination} with {min_time:.4f} time, already active.")
                 
                 else:   
                     # Ativar a nova melhor rota para este fluxo
-                    self.routing_table[destination][filename]['stream'] = "active"
-                    self.routing_table[destination][filename]['flow'] = "active"
+                    previous = self.route_index.active(best_stream)
+                    best_route = self.state.routes(best_stream).update(destination, stream=Status.ACTIVE, flow=Status.ACTIVE)
+                    self.route_index.set_active(best_stream, destination)
                     forward_activation = True
-            
-            with self.sessions_lock:
-                # Ativa a sessão para a rota
-                self.sessions.setdefault(filename, {}).setdefault(flooding_message.source_ip, {
-                    'rtp_port': flooding_message.rtp_port,
-                })
-                if sender == "client" and 'flow' not in self.sessions[filename][flooding_message.source_ip]:
-                    self.sessions[filename][flooding_message.source_ip]['flow'] = "deactive"
-
-                # Adiciona o 'rtsp_port' apenas se for fornecido
-                if flooding_message.rtsp_port:
-                    self.sessions[filename][flooding_message.source_ip]['rtsp_port'] = flooding_message.rtsp_port
+                            
+        if best_route is not None:
+            # Ativa a sessão para a rota
+            sessions = self.state.sessions(best_stream)
+            # Sessões de clientes só recebem depois do PLAY; as ativadas por outro node recebem logo
+            session = sessions.insert(flooding_message.source_ip, SessionEntry(
+                flooding_message.rtp_port, Status.INACTIVE if sender == "client" else None))
+
+            # Adiciona o 'rtsp_port' apenas se for fornecido
+            if flooding_message.rtsp_port and session.rtsp_port != flooding_message.rtsp_port:
+                sessions.update(flooding_message.source_ip, rtsp_port=flooding_message.rtsp_port)
                       
-            self.deactivate_routes(destination, filename)
+            # Make-before-break: a rota antiga só é desativada depois de a nova estar a entregar o fluxo
+            if previous is None or previous == destination:
+                self.deactivate_routes(destination, best_stream)
+            self.refresh_forwarding(best_stream)
                 
+            filename = self.stream_name(best_stream)
             if forward_activation:
-                print(f"Activating best route to {best_route['source_id']} at {destination} with {min_time:.4f} time.")
-                # Enviar mensagem de ativação para a melhor rota
-                activate_message = FloodingMessage()  # Criação de uma nova mensagem de ativação
-                activate_message.type = FloodingMessage.ACTIVATE_ROUTE
-                activate_message.stream_ids.append(filename)
-                activate_message.source_ip = self.node_ip
-                activate_message.rtp_port = self.rtp_port
-                activate_message.rtsp_port = self.rtsp_port
-                    
-                try:
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                        s.connect((destination, best_route['control_port']))
-                        self.send_flooding_message_tcp(s, activate_message)
-                        print(f"Sent route activation to destination {best_route['source_id']} for stream {filename}.")
-                            
-                except Exception as e:
-                    print(f"Failed to activate route to destination {best_route['source_id']}: {e}")
+                print(f"Activating best route to {best_route.source_id} at {destination} with {min_time:.4f} time.")
+                self.send_route_activation(destination, best_route, filename)
             
-            if best_route["source_id"].startswith("server"):
-                time.sleep(2)
-                rtsp_socket = self.create_rtsp_connection(filename, destination, best_route['rtsp_port']) # Para se conectar ao servidor 
-                request = f"ACTIVE {filename}\nIP {self.node_ip}\nRTP_PORT {self.rtp_port}\n"
-                rtsp_socket.send(request.encode())
-                print("ACTIVE ENVIDADO AO SERVIDOR")
+            if best_route.source_id.startswith("server"):
+                # Sem bloquear o handler à espera que a ativação chegue ao servidor
+                self.schedule(SERVER_ACTIVE_DELAY, self.send_server_active, destination, best_route, filename)
+
+            if previous is not None and previous != destination:
+                print(f"Receiving stream {filename} from {previous} and {destination} for {SWITCH_OVERLAP}s before switching.")
+                self.schedule(SWITCH_OVERLAP, self.finish_switch, destination, best_stream)
                 
         else:
             print("No active route available to activate.")
+
+    def finish_switch(self, destination, stream_id):
+        """Fim da sobreposição: desativa as rotas antigas se a nova ainda for a ativa."""
+        with self.routing_lock:
+            if self.route_index.active(stream_id) != destination:
+                return  # Entretanto houve outra troca, que trata da desativação
+        self.deactivate_routes(destination, stream_id)
+        self.refresh_forwarding(stream_id)
+
+    def send_route_activation(self, destination, route_info, filename):
+        """Envia ACTIVATE_ROUTE ao upstream para que passe a enviar o fluxo a este node."""
+        activate_message = FloodingMessage()  # Criação de uma nova mensagem de ativação
+        activate_message.type = FloodingMessage.ACTIVATE_ROUTE
+        activate_message.stream_ids.append(filename)
+        activate_message.source_ip = self.node_ip
+        activate_message.rtp_port = self.rtp_port
+        activate_message.rtsp_port = self.rtsp_port
+            
+        try:
+            self.control_pool.send((destination, route_info.control_port), FLOODING_MESSAGE, activate_message)
+            print(f"Sent route activation to destination {route_info.source_id} for stream {filename}.")
+                    
+        except Exception as e:
+            print(f"Failed to activate route to destination {route_info.source_id}: {e}")
+
+    def schedule(self, delay, function, *args):
+        """Corre function(*args) daqui a delay segundos, sem bloquear quem a agenda."""
+        timer = threading.Timer(delay, function, args=args)
+        timer.daemon = True
+        timer.start()
+
+    def send_server_active(self, destination, route_info, filename):
+        """Pede diretamente ao servidor (por RTSP) que envie o fluxo a este node."""
+        rtsp_socket = self.create_rtsp_connection(destination, route_info.rtsp_port) # Para se conectar ao servidor 
+        if rtsp_socket is None:
+            return
+        request = f"ACTIVE {filename}\nIP {self.node_ip}\nRTP_PORT {self.rtp_port}\n"
+        try:
+            with self.rtsp_exchange_lock(rtsp_socket):
+                rtsp_socket.send(request.encode())
+            print("ACTIVE ENVIDADO AO SERVIDOR")
+        except OSError as e:
+            print(f"Falha ao enviar ACTIVE ao servidor: {e}")
+            self.drop_rtsp_connection(rtsp_socket)
         
-    def deactivate_routes(self, dest_ip, filename):
+    def deactivate_routes(self, dest_ip, stream_id):
         """
-        Desativa todas as rotas associadas a um fluxo específico identificado por filename,
+        Desativa todas as rotas associadas a um fluxo específico identificado por stream_id,
         exceto a rota do dest_ip.
         """
-        with self.routing_lock:
-            routing_snapshot = self.routing_table.copy()
+        filename = self.stream_name(stream_id)
+        # Apenas as rotas deste fluxo (shard do fluxo), em vez de toda a tabela de rotas
+        routes = self.state.routes(stream_id)
             
-        for route_ip, route_info in routing_snapshot.items():
-            if route_ip != dest_ip and filename in route_info:
+        for route_ip, route_info in routes.items():
+            if route_ip != dest_ip:
                 # Verifica se a rota está ativa
-                if route_info[filename]["stream"] == "active" or route_info[filename]["flow"] == "active":
+                if route_info.stream is Status.ACTIVE or route_info.flow is Status.ACTIVE:
                     # Atualiza a rota para inativa
                     with self.routing_lock:
-                        self.routing_table[route_ip][filename]["stream"] = "inactive"
-                        self.routing_table[route_ip][filename]["flow"] = "inactive"
-                        
-                    with self.neighbors_rtsp_lock:
-                        with self.sessions_lock:
-                            sessions_snapshot = self.sessions[filename].copy()
-                        if len(sessions_snapshot) == 0:
-                            self.neighbors_rtsp[route_ip]['rtsp_socket'].close()
-                            del self.neighbors_rtsp[route_ip]['rtsp_socket']
+                        routes.update(route_ip, stream=Status.INACTIVE, flow=Status.INACTIVE)
+                        self.route_index.clear_active(stream_id, route_ip)
                         
+                    if len(self.state.sessions(stream_id)) == 0:
+                        rtsp_socket = self.state.rtsp.remove(route_ip)
+                        if rtsp_socket is not None:
+                            rtsp_socket.close()
+
 
                     print(f"Deactivated route to {route_ip} for stream {filename}.")
+                    self.refresh_forwarding(stream_id)
 
                     deactivate_message = FloodingMessage()  # Criação de uma nova mensagem de desativação
                     deactivate_message.type = FloodingMessage.DEACTIVATE_ROUTE
@@ -573,12 +795,10 @@ class Node:
                     deactivate_message.rtsp_port = self.rtsp_port
 
                     try:
-                        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                            s.connect((route_ip, route_info[filename]["control_port"]))
-                            self.send_flooding_message_tcp(s, deactivate_message)
-                            print(f"Sent route deactivation to {route_info[filename]['source_id']} for stream {filename}.")
+                        self.control_pool.send((route_ip, route_info.control_port), FLOODING_MESSAGE, deactivate_message)
+                        print(f"Sent route deactivation to {route_info.source_id} for stream {filename}.")
                     except Exception as e:
-                        print(f"Failed to deactivate route to {route_info[filename]['source_id']}: {e}")
+                        print(f"Failed to deactivate route to {route_info.source_id}: {e}")
 
     def accept_connections(self):
         # Recebe pedidos do vizinho
@@ -604,104 +824,103 @@ class Node:
                 updated_request.append(f"IP: {new_ip}")
             else:
                 updated_request.append(line)
-        return "\n".join(updated_request)
+        return "\n".join(updated_request) + "\n"
 
     def handle_neighbor(self, neighbor_socket, neighbor_address):
         """Função principal para lidar com as mensagens do vizinho."""
-        filename = None
-        dest = None
+        requests = RequestBuffer()  # A ligação é persistente: os pedidos podem chegar juntos ou divididos
         while True:
             try:
-                request = neighbor_socket.recv(1024).decode()
-                if not request:
+                data = neighbor_socket.recv(1024)
+                if not data:
                     break
-                print(f"Requisição recebida do vizinho {neighbor_address}:\n{request}\n")
+                for request in requests.feed(data):
+                    if self.handle_rtsp_request(request, neighbor_socket, neighbor_address) is False:
+                        return
+            except Exception as e:
+                print(f"Ocorreu um erro: {e}")
+                break
+
+    def handle_rtsp_request(self, request, neighbor_socket, neighbor_address):
+        """
+        Processa um pedido RTSP de um vizinho. neighbor_socket é usado para responder.
+        Retorna False quando a ligação com o vizinho deve ser terminada.
+        """
+        print(f"Requisição recebida do vizinho {neighbor_address}:\n{request}\n")
 
-                # Retira as informações necessárias da requisição
-                lines = request.splitlines()
-                line1 = lines[0].split(' ')
-                filename = line1[1]
-                request_ip = self.get_client_ip_from_request(request)                 
+        # Retira as informações necessárias da requisição
+        lines = request.splitlines()
+        line1 = lines[0].split(' ')
+        filename = line1[1]
+        stream_id = self.lookup_stream(filename)
+        request_ip = self.get_client_ip_from_request(request)                 
+        
+        # Preparação para a receção de pacotes do video requisitado
+        if "SETUP" in request:  
+            if self.route_with_SETUP(stream_id) or self.at_least_one_receiving_rtp(stream_id, None): # Caso já tenha recebido algum setup ou já esteja a enviar dados a alguem
+                seq = lines[1].split(' ')[1]
+                self.replyRtsp(seq, filename, neighbor_socket) # Responde logo ao node com a confirmação
                 
-                # Preparação para a receção de pacotes do video requisitado
-                if "SETUP" in request:  
-                    if self.route_with_SETUP(filename) or self.at_least_one_receiving_rtp(filename, None): # Caso já tenha recebido algum setup ou já esteja a enviar dados a alguem
-                        seq = lines[1].split(' ')[1]
-                        self.replyRtsp(seq, filename, neighbor_socket) # Responde logo ao node com a confirmação
-                        
-                    else: # Caso contrário
-                        modified_request = self.replace_client_ip_in_request(request, self.node_ip)     
-                        dest = self.forward_request(filename, modified_request, neighbor_socket) 
-                        with self.routing_lock: 
-                            self.routing_table[dest][filename]['flow'] = "active"
-                            self.routing_table[dest][filename]['request'] = "SETUP"
-                    
-                # Inicialização da receção dos pacotes do video requisitos      
-                elif "PLAY" in request:      
-                    with self.sessions_lock:
-                        if request_ip not in self.sessions[filename]:
-                            return
-                        self.sessions[filename][request_ip]["flow"] = "active" 
+            else: # Caso contrário
+                modified_request = self.replace_client_ip_in_request(request, self.node_ip)     
+                dest = self.forward_request(stream_id, modified_request, neighbor_socket) 
+                self.state.routes(stream_id).update(dest, flow=Status.ACTIVE, request=Request.SETUP)
+                self.refresh_forwarding(stream_id)
+            
+        # Inicialização da receção dos pacotes do video requisitos      
+        elif "PLAY" in request:      
+            if self.state.sessions(stream_id).update(request_ip, flow=Status.ACTIVE) is None:
+                return False
+            self.refresh_forwarding(stream_id)
  
-                    if self.at_least_one_receiving_rtp(filename, request_ip): # Se o node está a receber dados e já estou a enviar a pelo menos um vizinho
-                        seq = lines[1].split()[1]
-                        self.replyRtsp(seq, filename, neighbor_socket) # Responde ao node com a confirmação
-                
-                    else:  
-                        modified_request = self.replace_client_ip_in_request(request, self.node_ip)
-                        dest = self.forward_request(filename, modified_request, neighbor_socket)
-                        with self.routing_lock:
-                            self.routing_table[dest][filename]['request'] = "PLAY"
-
-                # Interrupção da receção dos pacotes do video requisitado   
-                elif "PAUSE" in request: 
-                    with self.sessions_lock:
-                        if request_ip not in self.sessions[filename]:
-                            return
-                        self.sessions[filename][request_ip]["flow"] = "deactive"    
-                            
-                    if self.at_least_two_receiving_rtp(filename) : # Caso onde há mais que 1 vizinho a receber dados
-                        seq = lines[1].split(' ')[1]
-                        self.replyRtsp(seq, filename, neighbor_socket) # Responde ao node com a confirmação
-                                        
-                    else:  # Caso contrário  
-                        modified_request = self.replace_client_ip_in_request(request, self.node_ip)
-                        dest = self.forward_request(filename, modified_request, neighbor_socket)     
-                        with self.routing_lock: 
-                            self.routing_table[dest][filename]['request'] = "PAUSE"          
-                                  
-                # Encerrar a comunicação com o node que fez a requisição do video
-                elif "TEARDOWN" in request:   
-                    self.remove_connection(filename, request_ip, request, neighbor_socket)
+            if self.at_least_one_receiving_rtp(stream_id, request_ip): # Se o node está a receber dados e já estou a enviar a pelo menos um vizinho
+                seq = lines[1].split()[1]
+                self.replyRtsp(seq, filename, neighbor_socket) # Responde ao node com a confirmação
+        
+            else:  
+                modified_request = self.replace_client_ip_in_request(request, self.node_ip)
+                dest = self.forward_request(stream_id, modified_request, neighbor_socket)
+                self.state.routes(stream_id).update(dest, request=Request.PLAY)
+                self.refresh_forwarding(stream_id)
+
+        # Interrupção da receção dos pacotes do video requisitado   
+        elif "PAUSE" in request: 
+            if self.state.sessions(stream_id).update(request_ip, flow=Status.INACTIVE) is None:
+                return False
+            self.refresh_forwarding(stream_id)
                     
-            except Exception as e:
-                print(f"Ocorreu um erro: {e}")
-                break
+            if self.at_least_two_receiving_rtp(stream_id) : # Caso onde há mais que 1 vizinho a receber dados
+                seq = lines[1].split(' ')[1]
+                self.replyRtsp(seq, filename, neighbor_socket) # Responde ao node com a confirmação
+                                
+            else:  # Caso contrário  
+                modified_request = self.replace_client_ip_in_request(request, self.node_ip)
+                dest = self.forward_request(stream_id, modified_request, neighbor_socket)     
+                self.state.routes(stream_id).update(dest, request=Request.PAUSE)
+                self.refresh_forwarding(stream_id)
+                          
+        # Encerrar a comunicação com o node que fez a requisição do video
+        elif "TEARDOWN" in request:   
+            self.remove_connection(stream_id, request_ip, request, neighbor_socket)
             
-    def forward_request(self, filename, request, neighbor_socket):
-        active_route = self.get_active_route(filename)
-        rtsp_port = active_route['route_info']['rtsp_port']
+    def forward_request(self, stream_id, request, neighbor_socket):
+        active_route = self.get_active_route(stream_id)
+        rtsp_port = active_route['route_info'].rtsp_port
         dest = active_route['destination']
-        rtsp_socket = self.create_rtsp_connection(filename, dest, rtsp_port) # Conecta se com o vizinho ativo
+        rtsp_socket = self.create_rtsp_connection(dest, rtsp_port) # Conecta se com o vizinho ativo
         self.send_rtsp_request(rtsp_socket, request, neighbor_socket)  # Reencaminha lhe o pedido 
         return dest 
                 
-    def at_least_one_receiving_rtp(self, filename, sender_ip):
-        with self.sessions_lock:
-            sessions_snapshot =  self.sessions[filename].copy()
-            
-        for client_ip, client_info in sessions_snapshot.items():
-            if client_info.get('flow') == "active" and client_ip != sender_ip:
+    def at_least_one_receiving_rtp(self, stream_id, sender_ip):
+        for client_ip, client_info in self.state.sessions(stream_id).items():
+            if client_info.flow is Status.ACTIVE and client_ip != sender_ip:
                 return True
         return False
     
-    def at_least_two_receiving_rtp(self, filename):
+    def at_least_two_receiving_rtp(self, stream_id):
         count = 1 # O que enviou o pause conta como 1 na receção de rtp
-        with self.sessions_lock:
-            sessions_snapshot =  self.sessions[filename].copy()
-            
-        for client_ip, client_info in sessions_snapshot.items():
-                if client_info.get('flow') == "active":
+        for client_ip, client_info in self.state.sessions(stream_id).items():
+                if client_info.flow is Status.ACTIVE:
                     count += 1
                 if count > 1:
                     return True
@@ -713,15 +932,14 @@ class Node:
         e retorna a rota se encontrada.
         """
         with self.routing_lock:
-            routing_snapshot =  self.routing_table.copy()
-            
-        for route_ip, route_info in routing_snapshot.items():
-            # Verifica se a stream_id existe na rota e está ativa
-            if stream_id in route_info and route_info[stream_id]['stream'] == "active":
-                return {
-                    "destination": route_ip,
-                    "route_info": route_info[stream_id]
-                }
+            route_ip = self.route_index.active(stream_id)
+        route_info = self.state.route(stream_id, route_ip)
+
+        if route_info is not None and route_info.stream is Status.ACTIVE:
+            return {
+                "destination": route_ip,
+                "route_info": route_info
+            }
         return None
     
     def route_with_SETUP(self, stream_id):
@@ -729,122 +947,110 @@ class Node:
         Verifica se há uma rota ativa para o fluxo (stream_id) na tabela de roteamento
         e retorna a rota se encontrada.
         """
-        with self.routing_lock:
-            routing_snapshot =  self.routing_table.copy()
-            
-        for route_ip, route_info in routing_snapshot.items():
-            # Verifica se a stream_id existe na rota e está ativa
-            if stream_id in route_info and 'request' in route_info[stream_id]:
-                if route_info[stream_id]['request'] == "SETUP":
-                    return True
+        for route_ip, route_info in self.state.routes(stream_id).items():
+            # Verifica se a rota do fluxo ficou no SETUP
+            if route_info.request is Request.SETUP:
+                return True
         return False
     
-    def create_rtsp_connection(self, filename, destination_ip, rtsp_port):
+    def create_rtsp_connection(self, destination_ip, rtsp_port):
         """Verifica se uma conexão RTSP persistente existe, e a cria se não existir.""" 
-        with self.neighbors_lock:
-            self.neighbors_rtsp.setdefault(destination_ip, {}) 
-            try:
-                rtsp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                rtsp_socket.connect((destination_ip, rtsp_port))
-                self.neighbors_rtsp[destination_ip]['rtsp_socket'] = rtsp_socket
-                print(f"Conexão RTSP persistente criada para {destination_ip}:{rtsp_port}")
-                return self.neighbors_rtsp[destination_ip]['rtsp_socket']
-            except Exception as e:
-                print(f"Erro ao criar conexão RTSP para {destination_ip}:{rtsp_port}: {e}")
-                return None
+        rtsp_socket = self.state.rtsp.get(destination_ip)
+        if rtsp_socket is not None and rtsp_socket.fileno() != -1:
+            return rtsp_socket
+
+        # A ligação é estabelecida fora de qualquer lock; só a publicação é serializada
+        try:
+            # O timeout também limita a espera pelas respostas (send_rtsp_request)
+            rtsp_socket = socket.create_connection((destination_ip, rtsp_port), timeout=RTSP_TIMEOUT)
+            self.state.rtsp.put(destination_ip, rtsp_socket)
+            print(f"Conexão RTSP persistente criada para {destination_ip}:{rtsp_port}")
+            return rtsp_socket
+        except Exception as e:
+            print(f"Erro ao criar conexão RTSP para {destination_ip}:{rtsp_port}: {e}")
+            return None
+
+    def rtsp_exchange_lock(self, rtsp_socket):
+        """Lock que serializa os pedidos numa ligação RTSP persistente."""
+        with self.rtsp_locks_lock:
+            lock = self.rtsp_locks.get(rtsp_socket)
+            if lock is None:
+                lock = self.rtsp_locks[rtsp_socket] = threading.Lock()
+            return lock
 
     def send_rtsp_request(self, rtsp_socket, request, neighbor_socket):
-        """Envia a requisição RTSP e encaminha a resposta ao vizinho."""
+        """Envia a requisição RTSP e encaminha a resposta ao vizinho (espera no máximo RTSP_TIMEOUT)."""
+        if rtsp_socket is None:
+            return
         try:
-            rtsp_socket.send(request.encode())
-            print(f"Requisição RTSP enviada")
+            with self.rtsp_exchange_lock(rtsp_socket):
+                rtsp_socket.send(request.encode())
+                print(f"Requisição RTSP enviada")
 
-            # Receber a resposta do vizinho RTSP
-            response = rtsp_socket.recv(1024).decode()
+                # Receber a resposta do vizinho RTSP
+                response = rtsp_socket.recv(1024).decode()
             if response:
                 print(f"RECEBEU A RESPOSTA DO VIZINHO:\n{response}")
                 
                 # Enviar a resposta de volta ao vizinho
                 neighbor_socket.send(response.encode())
                 print(f"Reencaminhou a resposta recebida")
+            else:
+                self.drop_rtsp_connection(rtsp_socket)  # Ligação persistente fechada pelo upstream
                            
         except Exception as e:
             print(f"Falha ao enviar requisição RTSP: {e}")
+            self.drop_rtsp_connection(rtsp_socket)
+
+    def drop_rtsp_connection(self, rtsp_socket):
+        """Retira e fecha uma ligação RTSP persistente que deixou de funcionar (é recriada no próximo pedido)."""
+        for destination_ip, current in self.state.rtsp.items():
+            if current is rtsp_socket:
+                self.state.rtsp.remove(destination_ip)
+        rtsp_socket.close()
 
     def handle_rtp_forwarding(self):
         """Inicia o encaminhamento dos pacotes RTP para o vizinho após a requisição SETUP."""
-        threading.Thread(target=self.forward_rtp, args=()).start()
+        self.forwarder.start()
 
-    def forward_rtp(self):               
-        while True:
-            data, addr = self.rtp_socket.recvfrom(20480)
-            if data:
-                rtp_packet = RtpPacket()
-                stream_id, sender_ip = rtp_packet.decode(data) # Extrai o nome do video do pacote recebido para saber para quem tem que o reencaminhar
-                rtp_packet.updateSenderIp(data, self.node_ip) # Atualiza o sender_ip do pacote
-                
-                with self.sessions_lock:
-                    session_info =  self.sessions[stream_id].copy()
-                                
-                for neighbor_ip, neighbor_info in session_info.items():
-                    # Inicializa o socket RTP, se necessário
-                    if "rtpSocket" not in neighbor_info:
-                        with self.sessions_lock:
-                            self.sessions[stream_id][neighbor_ip]["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    
-                    # Verifica condições para encaminhar o pacote
-                    if "rtpSocket" in neighbor_info and "rtp_port" in neighbor_info:
-                        with self.routing_lock:
-                            routing_info =  self.routing_table[sender_ip][stream_id].copy()
-                        
-                        if routing_info['flow'] == "active":
-                            if 'flow' not in neighbor_info:
-                                with self.sessions_lock:
-                                    self.sessions[stream_id][neighbor_ip]['flow'] = "active"
-                                    
-                            with self.sessions_lock:
-                                session_info =  self.sessions[stream_id][neighbor_ip].copy()
-                                
-                            if session_info['flow'] == "active":
-                                if "request" not in routing_info or routing_info['request'] == "PLAY":
-                                    print(f"Pacote {rtp_packet.seqNum()} - {stream_id} recebido de {sender_ip}, enviando a {neighbor_ip}")
-                                    updated_data = rtp_packet.getPacket()
-                                    session_info["rtpSocket"].sendto(updated_data, (neighbor_ip, session_info['rtp_port']))                     
+    def refresh_forwarding(self, stream_id):
+        """
+        Recalcula a tabela de reencaminhamento do fluxo a partir das rotas e sessões
+        e publica-a no motor de fan-out.
+        """
+        upstreams = []
+        for route_ip, route_info in self.state.routes(stream_id).items():
+            if route_info.flow is Status.ACTIVE and route_info.request in (None, Request.PLAY):
+                upstreams.append(route_ip)
+
+        destinations = []
+        for neighbor_ip, neighbor_info in self.state.sessions(stream_id).items():
+            # Sessões ativadas por outro node não têm flow (None) e recebem logo os pacotes
+            if neighbor_info.flow is Status.INACTIVE:
+                continue
+            destinations.append((neighbor_ip, neighbor_info.rtp_port))
+
+        self.forwarder.update_stream(stream_id, upstreams, destinations)
              
-    def remove_connection(self, filename, neighbor_address, request, neighbor_socket): 
+    def remove_connection(self, stream_id, neighbor_address, request, neighbor_socket): 
         # Como o node nao tem mais clientes para enviar, avisa o vizinho que o está a enviar pacotes para parar de o fazer
-        active_route = self.get_active_route(filename)
-        rtsp_port = active_route['route_info']['rtsp_port']
+        active_route = self.get_active_route(stream_id)
+        rtsp_port = active_route['route_info'].rtsp_port
         dest = active_route['destination']
-        rtsp_socket = self.create_rtsp_connection(filename, dest, rtsp_port) # Conecta se com o vizinho ativo
+        rtsp_socket = self.create_rtsp_connection(dest, rtsp_port) # Conecta se com o vizinho ativo
         # Reencaminha lhe o pedido 
-        self.send_rtsp_request(rtsp_socket, request, neighbor_socket, filename)     
+        self.send_rtsp_request(rtsp_socket, request, neighbor_socket)     
                     
-        # Verifique se o filename e o cliente existem na sessão
-        with self.sessions_lock: 
-            sessions_snapshot =  self.sessions.copy()
-            
-        if filename in sessions_snapshot and neighbor_address in sessions_snapshot[filename]:
-            # Fecha o socket RTP se ele existir
-            if "rtpSocket" in sessions_snapshot[filename][neighbor_address]:
-                try:
-                    with self.sessions_lock: 
-                        self.sessions[filename][neighbor_address]["rtpSocket"].close()
-                    print(f"RTP socket para {neighbor_address} fechado.")
-                except Exception as e:
-                    print(f"Erro ao fechar RTP socket para {neighbor_address}: {e}")
-            
-            with self.sessions_lock: 
-                # Remove o cliente do dicionário
-                self.sessions[filename].pop(neighbor_address)
-                print(f"Cliente {neighbor_address} removido de {filename}")
-
-                # Se o dicionário do filename está vazio, remova também
-                if not self.sessions[filename]:  # Verifica se não há mais clientes
-                    self.sessions.pop(filename)    
-                    print(f"Removido {filename} do dicionário pois não há mais clientes.")
+        # Remove o cliente das sessões do fluxo, se existir
+        sessions = self.state.sessions(stream_id)
+        session = sessions.remove(neighbor_address)
+        if session is not None:
+            print(f"Cliente {neighbor_address} removido de {self.stream_name(stream_id)}")
+            if len(sessions) == 0:  # Verifica se não há mais clientes
+                print(f"Não há mais clientes para {self.stream_name(stream_id)}.")
+            self.refresh_forwarding(stream_id)
         else:
-            print(f"Cliente {neighbor_address} não encontrado em {filename}")
+            print(f"Cliente {neighbor_address} não encontrado em {self.stream_name(stream_id)}")
            
     def replyRtsp(self, seq, session, neighbor_socket):
         """Send RTSP reply to the client."""
@@ -859,9 +1065,12 @@ class Node:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             s.bind(('', self.data_port))
             print(f"Node {self.node_id} listening on data port {self.data_port}")
+            self.datagram_pool.start()
+            ring = ReceiveRing(s, CONTROL_DATAGRAM_SIZE)
             while True:
-                data, addr = s.recvfrom(1024)
-                threading.Thread(target=self.handle_data_message, args=(data, addr, s)).start()
+                for buffer, datagram, addr in ring.receive():
+                    data = bytes(datagram)  # Copiado: o buffer do anel é reutilizado antes de o pool o tratar
+                    self.datagram_pool.submit(datagram_priority(data), self.handle_data_message, data, addr, s)
 
     def handle_data_message(self, data, addr, socket):
         """
@@ -892,6 +1101,9 @@ class Node:
                     
                 elif control_message.type == ControlMessage.ACK:
                     self.handle_ack(socket, control_message)
+
+                elif control_message.type == ControlMessage.RECEIVER_REPORT:
+                    self.handle_receiver_report(control_message)
                     
                 else:
                     print(f"Unknown ControlMessage type: {control_message.type}")
@@ -908,15 +1120,7 @@ class Node:
                     self.handle_flooding_message(flooding_message)
                     
                 elif flooding_message.type == FloodingMessage.DEACTIVATE_ROUTE:
-                    filename = flooding_message.stream_ids[0]
-                    with self.sessions_lock:
-                        del self.sessions[filename][flooding_message.source_ip] # desativa o envio de pacotes para a rota de onde veio a mensagem de desativação
-                        sessions_snapshot = self.sessions[filename].copy()
-                        
-                    print(f"DESATIVAÇÃO DA SESSÃO PARA {flooding_message.source_ip}")
-                    # Se o node nao tiver a enviar dados para mais nenhuma rota, reencaminha para o seu sucessor
-                    if len(sessions_snapshot) == 0:   
-                        self.deactivate_routes(flooding_message.source_ip, filename)
+                    self.handle_deactivate_route(flooding_message)
                         
                 else:
                     print(f"Unknown FloodingMessage type: {flooding_message.type}")
@@ -927,18 +1131,52 @@ class Node:
         except Exception as e:
             print(f"Failed to process message: {e}")
             
+    def handle_receiver_report(self, control_message):
+        """Guarda os relatórios de receção de um vizinho a jusante (cliente ou node)."""
+        self.reports.update(control_message.node_ip, control_message.reports)
+        print(f"Receiver report from {control_message.node_id} for {len(control_message.reports)} stream(s)")
+
+    def send_receiver_reports(self):
+        while True:
+            time.sleep(REPORT_INTERVAL)
+            self.report_upstream()
+
+    def report_upstream(self):
+        """
+        Envia a cada upstream ativo um único RECEIVER_REPORT com o resumo (pior caso) dos
+        relatórios recebidos dos vizinhos a jusante, para cada fluxo que dele recebe.
+        """
+        by_upstream = {}
+        for filename, report in self.reports.aggregate(ReceptionReport).items():
+            stream_id = self.lookup_stream(filename)
+            active_route = self.get_active_route(stream_id) if stream_id is not None else None
+            if active_route is None:
+                continue
+            upstream = by_upstream.setdefault(active_route['destination'], (active_route['route_info'], []))
+            upstream[1].append(report)
+
+        for upstream_ip, (route_info, reports) in by_upstream.items():
+            report_message = ControlMessage()
+            report_message.type = ControlMessage.RECEIVER_REPORT
+            report_message.node_ip = self.node_ip
+            report_message.node_id = self.node_id
+            report_message.reports.extend(reports)
+            try:
+                self.control_pool.send((upstream_ip, route_info.control_port), CONTROL_MESSAGE, report_message)
+                print(f"Sent receiver report to {route_info.source_id} for {len(reports)} stream(s)")
+            except Exception as e:
+                print(f"Failed to send receiver report to {route_info.source_id}: {e}")
+
     def handle_ack(self, s, control_message):
         """ Escuta mensagens dos clientes e responde com ACK """
         try:
-            with self.neighbors_lock:
-                neighbors_snapshot =  self.neighbors.copy()
-                
-            best_time = min([n.get("accumulated_time", float('inf')) for n in neighbors_snapshot.values()])
+            best_time = min([self.route_cost(n) for _, n in self.state.neighbors.items()], default=float('inf'))
             ack_message = ControlMessage()
             ack_message.type = ControlMessage.ACK
             ack_message.node_ip = self.node_ip
             ack_message.node_id = self.node_id
             ack_message.accumulated_time = best_time  
+            ack_message.load = self.session_load()
                          
             # Enviar ACK de volta para o cliente
             address = (control_message.node_ip, control_message.data_port)
@@ -950,8 +1188,8 @@ class Node:
     
 def main():
     
-    if len(sys.argv) != 5:
-        print("Usage: python Node.py <bootstrapper_ip> <node_id> <node_ip> <node_type>")
+    if len(sys.argv) not in (5, 6) or (len(sys.argv) == 6 and sys.argv[5] != "async"):
+        print("Usage: python Node.py <bootstrapper_ip> <node_id> <node_ip> <node_type> [async]")
         sys.exit(1)
         
     bootstrapper = sys.argv[1] # 10.0.1.10
@@ -961,7 +1199,12 @@ def main():
     control_port = 50051  # Porta de controle padrão
     data_port = 50052     # Porta de dados padrão
 
-    node = Node(node_ip, 30001, 25001, node_id, node_type, control_port, data_port, bootstrapper)
+    if len(sys.argv) == 6:
+        # Modo event loop (asyncio) em vez de uma thread por ligação
+        from AsyncNode import AsyncNode
+        node = AsyncNode(node_ip, 30001, 25001, node_id, node_type, control_port, data_port, bootstrapper)
+    else:
+        node = Node(node_ip, 30001, 25001, node_id, node_type, control_port, data_port, bootstrapper)
     node.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+import threading, time
+
+REPORT_INTERVAL = 5.0  # Segundos entre relatórios de receção
+REPORT_TIMEOUT = 3 * REPORT_INTERVAL  # Relatórios mais antigos do que isto já não contam
+JITTER_GAIN = 1 / 16  # RFC 3550, A.8
+
+class ReceptionStats:
+    """
+    Estatísticas de receção de um fluxo num cliente (RFC 3550, A.3 e A.8): pacotes
+    esperados e perdidos a partir dos números de sequência estendidos e jitter entre
+    chegadas a partir dos timestamps RTP.
+    """
+    def __init__(self, sequence, clock_rate):
+        self.sequence = sequence  # SequenceTracker partilhado com a receção
+        self.clock_rate = clock_rate
+        self.expected_prior = 0
+        self.received_prior = 0
+        self.transit = None
+        self.jitter = 0.0  # Em unidades de timestamp
+
+    def packet_received(self, timestamp, arrival=None):
+        """Atualiza o jitter com um pacote de media (chamado depois de SequenceTracker.update)."""
+        if arrival is None:
+            arrival = time.monotonic()
+        transit = int(arrival * self.clock_rate) - timestamp
+        if self.transit is not None:
+            delta = abs(((transit - self.transit + 0x80000000) & 0xFFFFFFFF) - 0x80000000)
+            self.jitter += (delta - self.jitter) * JITTER_GAIN
+        self.transit = transit
+
+    def report(self, report, latency=None):
+        """
+        Preenche um ReceptionReport (protobuf) e começa um novo intervalo.
+        Retorna False se ainda não foi recebido nenhum pacote.
+        """
+        sequence = self.sequence
+        if sequence.max_seq is None:
+            return False
+
+        expected = sequence.expected()
+        received = sequence.received
+        if expected < self.expected_prior:
+            # Numeração recomeçada: o intervalo começa de novo
+            self.expected_prior = self.received_prior = 0
+
+        expected_interval = expected - self.expected_prior
+        lost_interval = expected_interval - (received - self.received_prior)
+        self.expected_prior = expected
+        self.received_prior = received
+
+        report.fraction_lost = lost_interval / expected_interval if expected_interval > 0 and lost_interval > 0 else 0.0
+        report.cumulative_lost = max(0, expected - received)
+        report.highest_sequence = sequence.extendedMax() & 0xFFFFFFFF
+        report.jitter = self.jitter / self.clock_rate
+        report.receivers = 1
+        report.latency = latency or 0.0
+        return True
+
+class ReportTable:
+    """
+    Últimos relatórios de receção recebidos dos vizinhos a jusante, por fluxo.
+    aggregate() resume-os num único relatório por fluxo com o pior caso de cada
+    medida (perda, jitter, latência, sequência menos avançada) e o total de recetores,
+    que é o que o node envia para montante.
+    """
+    def __init__(self, timeout=REPORT_TIMEOUT):
+        self.timeout = timeout
+        self.reports = {}  # fluxo -> {ip do vizinho: (ReceptionReport, instante)}
+        self.lock = threading.Lock()
+
+    def update(self, reporter_ip, reports):
+        now = time.monotonic()
+        with self.lock:
+            for report in reports:
+                self.reports.setdefault(report.stream, {})[reporter_ip] = (report, now)
+
+    def forget(self, reporter_ip):
+        with self.lock:
+            for reporters in self.reports.values():
+                reporters.pop(reporter_ip, None)
+
+    def aggregate(self, report_factory):
+        """Retorna {fluxo: relatório agregado}, criando cada relatório com report_factory()."""
+        now = time.monotonic()
+        aggregated = {}
+        with self.lock:
+            for stream, reporters in self.reports.items():
+                for reporter_ip in [ip for ip, (_, received) in reporters.items() if now - received > self.timeout]:
+                    del reporters[reporter_ip]
+                if not reporters:
+                    continue
+
+                merged = aggregated[stream] = report_factory()
+                merged.stream = stream
+                merged.highest_sequence = min(report.highest_sequence for report, _ in reporters.values())
+                for report, _ in reporters.values():
+                    merged.fraction_lost = max(merged.fraction_lost, report.fraction_lost)
+                    merged.cumulative_lost = max(merged.cumulative_lost, report.cumulative_lost)
+                    merged.jitter = max(merged.jitter, report.jitter)
+                    merged.latency = max(merged.latency, report.latency)
+                    merged.receivers += max(1, report.receivers)
+        return aggregated
@@ -0,0 +1,85 @@
+from enum import Enum
+
+class Status(Enum):
+    """Estado de um vizinho, de uma rota (pode receber / está a receber o fluxo) ou de uma sessão."""
+    ACTIVE = "active"
+    INACTIVE = "inactive"
+
+class Request(Enum):
+    """Último pedido RTSP reencaminhado através de uma rota."""
+    SETUP = "SETUP"
+    PLAY = "PLAY"
+    PAUSE = "PAUSE"
+
+class Record:
+    """
+    Base dos registos de estado: campos fixos em __slots__ (sem dicionário por instância).
+    Nos snapshots copy-on-write do StateStore os registos publicados não são alterados;
+    replace() cria a cópia com os campos novos.
+    """
+    __slots__ = ()
+
+    def copy(self):
+        record = object.__new__(type(self))
+        for field in self.__slots__:
+            setattr(record, field, getattr(self, field))
+        return record
+
+    def replace(self, **fields):
+        record = self.copy()
+        for field, value in fields.items():
+            setattr(record, field, value)
+        return record
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+class NeighborEntry(Record):
+    """Vizinho direto (node, servidor, cliente ou PoP)."""
+    __slots__ = ("node_ip", "node_id", "node_type", "control_port", "data_port", "rtsp_port", "rtp_port",
+                 "status", "stream", "failed_attempts", "accumulated_time", "best_time", "jitter", "loss", "load")
+
+    def __init__(self, node_ip, node_id, node_type, control_port, data_port, rtsp_port):
+        self.node_ip = node_ip
+        self.node_id = node_id
+        self.node_type = node_type
+        self.control_port = control_port
+        self.data_port = data_port
+        self.rtsp_port = rtsp_port
+        self.rtp_port = None                  # Porta RTP anunciada na ativação (servidor)
+        self.status = Status.ACTIVE
+        self.stream = Status.INACTIVE         # Se o fluxo é pedido a este PoP (cliente)
+        self.failed_attempts = 0
+        self.accumulated_time = float('inf')  # Custo até ao servidor anunciado pelo vizinho
+        self.best_time = float('inf')         # RTT suavizado da ligação
+        self.jitter = 0.0
+        self.loss = 0.0
+        self.load = 0
+
+    def is_client(self):
+        return self.node_id.startswith("client")
+
+class RouteEntry(Record):
+    """Rota para um fluxo através de um upstream, aprendida por flooding."""
+    __slots__ = ("source_ip", "source_id", "state", "control_port", "rtsp_port", "stream", "flow", "metric", "request")
+
+    def __init__(self, source_ip, source_id, state, control_port, rtsp_port, metric=0):
+        self.source_ip = source_ip
+        self.source_id = source_id
+        self.state = state                # Estado anunciado pela origem (route_state)
+        self.control_port = control_port
+        self.rtsp_port = rtsp_port
+        self.stream = Status.INACTIVE     # Se pode receber o fluxo por esta rota
+        self.flow = Status.INACTIVE       # Se está a receber o fluxo por esta rota
+        self.metric = metric
+        self.request = None               # Último pedido RTSP (Request) reencaminhado
+
+class SessionEntry(Record):
+    """Vizinho a jusante que recebe um fluxo deste node."""
+    __slots__ = ("rtp_port", "rtsp_port", "flow")
+
+    def __init__(self, rtp_port, flow=Status.ACTIVE):
+        self.rtp_port = rtp_port
+        self.rtsp_port = None
+        self.flow = flow  # Sessões de clientes só recebem depois do PLAY
@@ -0,0 +1,74 @@
+RENDITION_SEPARATOR = "@"
+
+# Escada de qualidade de cada filme, da melhor para a pior: (nome, qualidade JPEG, escala da resolução).
+# A primeira variante mantém o nome do filme (e os frames já pré-codificados com a qualidade por omissão do OpenCV).
+RENDITIONS = (
+    ("high", None, 1.0),
+    ("medium", 70, 0.75),
+    ("low", 40, 0.5),
+)
+
+LOSS_DOWN = 0.05      # Perda a partir da qual se desce de variante
+LOSS_UP = 0.01        # Perda abaixo da qual se pode subir de variante
+DELIVERY_DOWN = 0.8   # Fração dos bytes enviados que chega em frames completos abaixo da qual se desce
+DELIVERY_UP = 0.95
+UP_HOLD = 3           # Relatórios seguidos com boa qualidade antes de subir
+
+def variant_name(movie, rendition):
+    """Nome do fluxo de uma variante do filme."""
+    if rendition == RENDITIONS[0][0]:
+        return movie
+    return f"{movie}{RENDITION_SEPARATOR}{rendition}"
+
+def split_variant(name):
+    """Retorna (filme, variante) de um nome de fluxo."""
+    movie, separator, rendition = name.rpartition(RENDITION_SEPARATOR)
+    if separator and any(rendition == known for known, _, _ in RENDITIONS):
+        return movie, rendition
+    return name, RENDITIONS[0][0]
+
+def encoding(name):
+    """Retorna (qualidade JPEG ou None, escala) da variante de um nome de fluxo."""
+    _, rendition = split_variant(name)
+    for known, quality, scale in RENDITIONS:
+        if known == rendition:
+            return quality, scale
+
+def variants(movie):
+    """Nomes de todas as variantes do filme, da melhor para a pior."""
+    return [variant_name(movie, rendition) for rendition, _, _ in RENDITIONS]
+
+class RenditionSelector:
+    """
+    Escolhe a variante a pedir a partir dos relatórios de receção do cliente.
+    Desce logo um nível quando a perda ou a entrega de frames completos pioram e só
+    sobe um nível depois de UP_HOLD relatórios seguidos com boa qualidade, para não
+    oscilar entre variantes.
+    """
+    def __init__(self, movie):
+        self.names = variants(movie)
+        self.level = 0  # Índice na escada (0 = melhor)
+        self.good = 0
+
+    def current(self):
+        return self.names[self.level]
+
+    def select(self, name):
+        """Volta a uma variante (por exemplo, quando a troca não se concretizou)."""
+        if name in self.names:
+            self.level = self.names.index(name)
+            self.good = 0
+
+    def update(self, fraction_lost, delivery=None):
+        """Atualiza com um relatório e retorna o nome da variante a usar."""
+        if fraction_lost > LOSS_DOWN or (delivery is not None and delivery < DELIVERY_DOWN):
+            self.good = 0
+            self.level = min(self.level + 1, len(self.names) - 1)
+        elif fraction_lost < LOSS_UP and (delivery is None or delivery > DELIVERY_UP):
+            self.good += 1
+            if self.good >= UP_HOLD and self.level > 0:
+                self.good = 0
+                self.level -= 1
+        else:
+            self.good = 0
+        return self.current()
@@ -0,0 +1,151 @@
+import heapq
+
+SWITCH_OVERLAP = 3.0  # Segundos em que a rota antiga continua ativa depois de a nova ser ativada
+
+class StreamRoutes:
+    """
+    Candidatos de um fluxo: heap ordenada por (custo, métrica), custo e métrica atuais
+    de cada upstream e o upstream ativo. A métrica (saltos até à origem) desempata
+    rotas com o mesmo custo, incluindo as que ainda não têm RTT medido.
+    """
+    __slots__ = ("heap", "costs", "metrics", "active")
+
+    def __init__(self):
+        self.heap = []     # (custo, métrica, upstream_ip); entradas desatualizadas são descartadas ao consultar
+        self.costs = {}    # upstream_ip -> custo atual
+        self.metrics = {}  # upstream_ip -> métrica anunciada
+        self.active = None
+
+    def push(self, upstream_ip, cost, metric):
+        self.costs[upstream_ip] = cost
+        self.metrics[upstream_ip] = metric
+        heapq.heappush(self.heap, (cost, metric, upstream_ip))
+        # Compacta quando as entradas desatualizadas dominam a heap
+        if len(self.heap) > 4 * len(self.costs) + 8:
+            self.heap = [(c, self.metrics[ip], ip) for ip, c in self.costs.items()]
+            heapq.heapify(self.heap)
+
+    def discard(self, upstream_ip):
+        self.costs.pop(upstream_ip, None)
+        self.metrics.pop(upstream_ip, None)
+        if self.active == upstream_ip:
+            self.active = None
+
+    def valid(self, entry):
+        cost, metric, upstream_ip = entry
+        return self.costs.get(upstream_ip) == cost and self.metrics.get(upstream_ip) == metric
+
+    def best(self):
+        heap = self.heap
+        while heap:
+            if self.valid(heap[0]):
+                cost, _, upstream_ip = heap[0]
+                return upstream_ip, cost
+            heapq.heappop(heap)
+        return None, float('inf')
+
+    def backup(self):
+        """
+        Upstream de reserva: o de menor (custo, métrica) finito, exceto o ativo.
+        Retira temporariamente da heap a entrada do ativo (só existe uma válida) para
+        chegar à seguinte, descartando pelo caminho as desatualizadas e as repetidas.
+        """
+        if self.active is None:
+            return None
+        heap = self.heap
+        held = None  # Entrada do ativo retirada da heap
+        backup = None
+        while heap:
+            entry = heap[0]
+            if not self.valid(entry) or (held is not None and entry == held):
+                heapq.heappop(heap)
+                continue
+            if entry[2] == self.active:
+                held = heapq.heappop(heap)
+                continue
+            if entry[0] != float('inf'):
+                backup = entry[2]
+            break
+        if held is not None:
+            heapq.heappush(heap, held)
+        return backup
+
+class RouteIndex:
+    """
+    Índice incremental das rotas do node.
+    Para cada fluxo guarda uma heap dos upstreams candidatos ordenada pelo custo até
+    ao servidor (e pela métrica do anúncio) e o upstream ativo, pelo que atualizar um
+    custo e obter a melhor rota ou a de reserva é O(log n) amortizado e o upstream
+    ativo O(1), sem percorrer a tabela de rotas inteira.
+    Os custos são atualizados quando chegam PINGs, sondas ou floods.
+    Não tem lock próprio: é sempre usado sob o routing_lock do Node.
+    """
+    def __init__(self):
+        self.streams = {}       # stream_id -> StreamRoutes
+        self.by_upstream = {}   # upstream_ip -> set(stream_id)
+        self.upstream_costs = {}  # upstream_ip -> custo atual
+
+    def add_candidate(self, stream_id, upstream_ip, cost, metric=0):
+        """Regista (ou atualiza a métrica de) o upstream como candidato para o fluxo."""
+        self.upstream_costs[upstream_ip] = cost
+        self.by_upstream.setdefault(upstream_ip, set()).add(stream_id)
+        routes = self.streams.setdefault(stream_id, StreamRoutes())
+        if routes.costs.get(upstream_ip) != cost or routes.metrics.get(upstream_ip) != metric:
+            routes.push(upstream_ip, cost, metric)
+
+    def update_cost(self, upstream_ip, cost):
+        """Atualiza o custo de um upstream em todos os fluxos que ele anuncia."""
+        if self.upstream_costs.get(upstream_ip) == cost:
+            return
+        self.upstream_costs[upstream_ip] = cost
+        for stream_id in self.by_upstream.get(upstream_ip, ()):
+            routes = self.streams[stream_id]
+            routes.push(upstream_ip, cost, routes.metrics[upstream_ip])
+
+    def remove_upstream(self, upstream_ip):
+        """Remove o upstream de todos os fluxos (vizinho inativo)."""
+        self.upstream_costs.pop(upstream_ip, None)
+        for stream_id in self.by_upstream.pop(upstream_ip, ()):
+            self.streams[stream_id].discard(upstream_ip)
+
+    def best(self, stream_id):
+        """Retorna (upstream_ip, custo) do melhor candidato do fluxo, ou (None, inf)."""
+        routes = self.streams.get(stream_id)
+        if routes is None:
+            return None, float('inf')
+        return routes.best()
+
+    def cost(self, stream_id, upstream_ip):
+        """Custo atual do upstream para o fluxo, ou inf se não for candidato."""
+        routes = self.streams.get(stream_id)
+        if routes is None:
+            return float('inf')
+        return routes.costs.get(upstream_ip, float('inf'))
+
+    def upstreams(self, stream_id):
+        """Upstreams candidatos do fluxo."""
+        routes = self.streams.get(stream_id)
+        return list(routes.costs) if routes is not None else []
+
+    def active(self, stream_id):
+        routes = self.streams.get(stream_id)
+        return routes.active if routes is not None else None
+
+    def set_active(self, stream_id, upstream_ip):
+        routes = self.streams.setdefault(stream_id, StreamRoutes())
+        routes.active = upstream_ip
+
+    def clear_active(self, stream_id, upstream_ip):
+        routes = self.streams.get(stream_id)
+        if routes is not None and routes.active == upstream_ip:
+            routes.active = None
+
+    def backup(self, stream_id):
+        """Upstream de reserva do fluxo ativo, ou None."""
+        routes = self.streams.get(stream_id)
+        return routes.backup() if routes is not None else None
+
+    def active_streams(self, upstream_ip):
+        """Fluxos que estão a ser recebidos através do upstream."""
+        return [stream_id for stream_id in self.by_upstream.get(upstream_ip, ())
+                if self.streams[stream_id].active == upstream_ip]
@@ -0,0 +1,68 @@
+import threading, time
+
+HYSTERESIS = 0.15        # A nova rota tem de ser pelo menos 15% mais barata do que a atual...
+MIN_IMPROVEMENT = 0.002  # ... e pelo menos 2 ms mais barata (ruído das medições em ligações rápidas)
+MIN_HOLD_TIME = 10.0     # Segundos mínimos numa rota antes de uma troca voluntária
+LOSS_WEIGHT = 0.5        # Segundos de custo por unidade de perda (10% de perda = +50 ms)
+LOAD_WEIGHT = 0.001      # Segundos de custo por sessão já servida pelo vizinho
+
+class RoutePolicy:
+    """
+    Política de seleção de rotas partilhada pelo Node e pelo Client.
+    O custo de uma ligação combina o RTT suavizado, a perda medida pelas sondas e a
+    carga anunciada pelo vizinho. Uma rota ativa só é trocada por outra se esta for
+    claramente melhor (histerese relativa e absoluta) e se a atual já estiver em uso
+    há pelo menos hold_time segundos, para que amostras ruidosas não provoquem trocas
+    sucessivas de ACTIVATE/DEACTIVATE. Se a rota atual deixar de estar disponível
+    (custo infinito) a troca é imediata.
+    """
+    def __init__(self, hysteresis=HYSTERESIS, min_improvement=MIN_IMPROVEMENT, hold_time=MIN_HOLD_TIME,
+                 loss_weight=LOSS_WEIGHT, load_weight=LOAD_WEIGHT):
+        self.hysteresis = hysteresis
+        self.min_improvement = min_improvement
+        self.hold_time = hold_time
+        self.loss_weight = loss_weight
+        self.load_weight = load_weight
+
+        self.selected = {}  # chave (fluxo) -> (upstream escolhido, instante da escolha)
+        self.lock = threading.Lock()
+
+    def cost(self, rtt, loss=0.0, load=0):
+        """Custo combinado de uma ligação, em segundos."""
+        if rtt is None:
+            return float('inf')
+        return rtt + self.loss_weight * loss + self.load_weight * load
+
+    def choose(self, key, current, current_cost, candidate, candidate_cost):
+        """
+        Decide entre manter o upstream atual e passar para o candidato (o mais barato).
+        Retorna o upstream a usar e regista o instante sempre que a escolha muda.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if candidate is None:
+                return current
+
+            if current is None or current == candidate or current_cost == float('inf'):
+                chosen = candidate
+            else:
+                selected = self.selected.get(key)
+                held = now - selected[1] if selected is not None and selected[0] == current else self.hold_time
+                gain = current_cost - candidate_cost
+                if held >= self.hold_time and gain > max(self.min_improvement, self.hysteresis * current_cost):
+                    chosen = candidate
+                else:
+                    chosen = current
+
+            if self.selected.get(key, (None,))[0] != chosen:
+                self.selected[key] = (chosen, now)
+            return chosen
+
+    def record_switch(self, key, upstream):
+        """Regista uma troca feita fora da política (por exemplo, failover), reiniciando o tempo mínimo."""
+        with self.lock:
+            self.selected[key] = (upstream, time.monotonic())
+
+    def forget(self, key):
+        with self.lock:
+            self.selected.pop(key, None)
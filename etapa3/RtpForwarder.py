@@ -0,0 +1,85 @@
+import socket, threading
+from DatagramIO import FanOut, ReceiveRing
+from RtpPacket import PACKET_HEADER_SIZE, MAX_DATAGRAM_SIZE, SequenceWindow, readSeqNum, readStreamId, readSenderIp, patchSenderIp
+
+class RtpForwarder:
+    """
+    Motor de fan-out RTP de um node.
+    Mantém, por fluxo, uma tabela imutável com as rotas de onde aceita pacotes
+    e os destinos (FanOut) para onde os reencaminha, indexada pelo id numérico do fluxo.
+    Todos os pacotes saem pelo socket RTP do node (o mesmo que os recebe), com sendto()
+    ou, havendo vários destinos, com um único sendmmsg.
+    As tabelas são substituídas por inteiro (troca atómica) sempre que as sessões
+    mudam, pelo que o ciclo de reencaminhamento nunca precisa de locks.
+    Enquanto um fluxo é aceite de mais do que um upstream (troca de rota sem corte),
+    a tabela leva uma janela de números de sequência que descarta as cópias repetidas.
+    """
+    def __init__(self, rtp_socket, node_ip):
+        self.rtp_socket = rtp_socket
+        self.node_ip = node_ip
+        self.packed_ip = socket.inet_aton(node_ip)
+
+        self.streams = ()  # streams[stream_id] = (frozenset(upstreams empacotados), FanOut, SequenceWindow ou None) ou None
+        self.update_lock = threading.Lock()  # Serializa apenas os escritores
+
+        self.running = False
+
+    def update_stream(self, stream_id, upstreams, destinations):
+        """Publica uma nova tabela de reencaminhamento para o fluxo (destinations: endereços (ip, porta))."""
+        with self.update_lock:
+            streams = list(self.streams)
+            if stream_id >= len(streams):
+                streams.extend([None] * (stream_id + 1 - len(streams)))
+            if upstreams and destinations:
+                packed = frozenset(socket.inet_aton(ip) for ip in upstreams)
+                window = None
+                if len(packed) > 1:
+                    # Mantém a janela se a sobreposição já estava em curso
+                    previous = streams[stream_id]
+                    window = previous[2] if previous is not None and previous[2] is not None else SequenceWindow()
+                streams[stream_id] = (packed, FanOut(destinations), window)
+            else:
+                streams[stream_id] = None
+            self.streams = tuple(streams)  # Troca atómica da referência
+
+    def start(self):
+        """Inicia a thread de reencaminhamento (apenas uma por node)."""
+        with self.update_lock:
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        ring = ReceiveRing(self.rtp_socket, MAX_DATAGRAM_SIZE)
+        while True:
+            try:
+                # Cada pacote é reencaminhado antes de o seu buffer voltar a ser usado
+                for buffer, packet, addr in ring.receive():
+                    if len(packet):
+                        self.forward(buffer, packet)
+            except Exception as e:
+                print(f"Erro no reencaminhamento RTP: {e}")
+
+    def forward(self, buffer, packet):
+        """Lê os campos fixos da extensão, reescreve o sender_ip no próprio buffer e envia para todos os destinos."""
+        if len(packet) < PACKET_HEADER_SIZE:
+            return
+
+        streams = self.streams
+        stream_id = readStreamId(buffer)
+        if stream_id >= len(streams):
+            return
+
+        entry = streams[stream_id]
+        if entry is None:
+            return
+
+        upstreams, destinations, window = entry
+        if readSenderIp(buffer) not in upstreams:
+            return
+        if window is not None and not window.accept(readSeqNum(buffer)):
+            return  # Cópia já reencaminhada pelo outro caminho
+
+        patchSenderIp(buffer, self.packed_ip)
+        destinations.send(self.rtp_socket, buffer, len(packet))
@@ -0,0 +1,90 @@
+from RtpPacket import RtpPacket, PACKET_HEADER_SIZE, SENDER_REPORT_PT, SENDER_REPORT_FORMAT, toNtp, timestampDelta
+
+DEFAULT_MTU = 1500
+IP_UDP_HEADER_SIZE = 28
+
+class JpegPacketizer:
+    """
+    Divide cada frame JPEG em pacotes RTP que cabem no MTU (ao estilo do RFC 2435).
+    Todos os fragmentos de um frame partilham o timestamp, o offset de cada um vai
+    na extensão do cabeçalho e o último fragmento leva o marker bit.
+    """
+    def __init__(self, stream_id, sender_ip, mtu=DEFAULT_MTU):
+        self.stream_id = stream_id
+        self.sender_ip = sender_ip
+        self.max_payload = mtu - IP_UDP_HEADER_SIZE - PACKET_HEADER_SIZE
+        self.seqnum = 0
+        self.packets = 0  # Pacotes e octetos de payload enviados (para os relatórios do emissor)
+        self.octets = 0
+
+    def packetize(self, frame, timestamp):
+        """Retorna a lista de pacotes RTP de um frame."""
+        packets = []
+        frame_size = len(frame)
+        offset = 0
+        while offset < frame_size:
+            payload = frame[offset:offset + self.max_payload]
+            marker = 1 if offset + len(payload) >= frame_size else 0
+            self.seqnum = (self.seqnum + 1) & 0xFFFF
+
+            rtpPacket = RtpPacket()
+            rtpPacket.encode(2, 0, 1, 0, self.seqnum, marker, 26, 0, payload, self.stream_id, self.sender_ip, timestamp, offset)
+            packets.append(rtpPacket.getPacket())
+            offset += len(payload)
+        self.packets += len(packets)
+        self.octets += frame_size
+        return packets
+
+    def senderReport(self, timestamp, wallclock):
+        """
+        Relatório do emissor que associa o timestamp RTP ao relógio de parede (wallclock, tempo Unix).
+        Usa a mesma numeração dos pacotes de media, para passar pela mesma deteção de duplicados.
+        """
+        self.seqnum = (self.seqnum + 1) & 0xFFFF
+        ntpSeconds, ntpFraction = toNtp(wallclock)
+        report = SENDER_REPORT_FORMAT.pack(ntpSeconds, ntpFraction, timestamp & 0xFFFFFFFF, self.packets & 0xFFFFFFFF, self.octets & 0xFFFFFFFF)
+        rtpPacket = RtpPacket()
+        rtpPacket.encode(2, 0, 1, 0, self.seqnum, 1, SENDER_REPORT_PT, 0, report, self.stream_id, self.sender_ip, timestamp)
+        return rtpPacket.getPacket()
+
+class JpegReassembler:
+    """
+    Reconstrói os frames JPEG a partir dos fragmentos RTP recebidos.
+    Os fragmentos são agrupados pelo timestamp e colocados pelo offset, pelo que
+    podem chegar fora de ordem ou duplicados. Frames incompletos mais antigos do
+    que o último frame entregue são descartados.
+    """
+    def __init__(self, max_pending=8):
+        self.max_pending = max_pending
+        self.pending = {}  # timestamp -> {"fragments": {offset: payload}, "received": bytes, "size": total ou None}
+
+    def push(self, rtpPacket):
+        """Adiciona um fragmento. Retorna (timestamp, frame) quando o frame fica completo, senão None."""
+        timestamp = rtpPacket.timestamp()
+        offset = rtpPacket.fragmentOffset()
+        payload = rtpPacket.getPayload()
+
+        frame = self.pending.get(timestamp)
+        if frame is None:
+            if len(self.pending) >= self.max_pending:
+                oldest = min(self.pending, key=lambda ts: timestampDelta(ts, timestamp))
+                del self.pending[oldest]  # Descarta o frame incompleto mais antigo
+            frame = self.pending[timestamp] = {"fragments": {}, "received": 0, "size": None}
+
+        if offset in frame["fragments"]:
+            return None  # Fragmento duplicado
+        frame["fragments"][offset] = bytes(payload)  # O payload pode ser uma vista sobre um buffer reutilizado
+        frame["received"] += len(payload)
+        if rtpPacket.marker():
+            frame["size"] = offset + len(payload)
+
+        if frame["size"] is None or frame["received"] < frame["size"]:
+            return None
+
+        del self.pending[timestamp]
+        # Frames anteriores que ainda não estão completos já não serão mostrados
+        for stale in [ts for ts in self.pending if timestampDelta(ts, timestamp) < 0]:
+            del self.pending[stale]
+
+        fragments = frame["fragments"]
+        return timestamp, b''.join(fragments[key] for key in sorted(fragments))
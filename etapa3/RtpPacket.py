@@ -1,6 +1,165 @@
-import sys
+import sys, socket, struct
 from time import time
 HEADER_SIZE = 12
+MAX_DATAGRAM_SIZE = 65535
+
+# Extensão de cabeçalho RTP (RFC 3550, secção 5.3.1) com campos de largura fixa:
+# | profile (16) | length (16) | stream_id (32) | sender_ip (32) | fragment_offset (32) |
+# O fragment_offset é a posição, em bytes, do payload dentro do frame JPEG (RFC 2435)
+EXTENSION_PROFILE = 0x4553
+EXTENSION_WORDS = 3
+EXTENSION_SIZE = 4 + EXTENSION_WORDS * 4
+PACKET_HEADER_SIZE = HEADER_SIZE + EXTENSION_SIZE
+STREAM_ID_OFFSET = HEADER_SIZE + 4
+SENDER_IP_OFFSET = HEADER_SIZE + 8
+FRAGMENT_OFFSET_OFFSET = HEADER_SIZE + 12
+
+SEQUENCE_WINDOW = 64       # Números de sequência recentes lembrados para detetar duplicados
+SEQUENCE_RESET_GAP = 0x1000  # Recuos maiores do que isto são tratados como reinício do fluxo
+MAX_DROPOUT = 3000   # Avanço máximo aceite como perda de pacotes (RFC 3550, A.1)
+MAX_MISORDER = 100   # Recuo máximo aceite como pacote fora de ordem
+
+RTP_CLOCK_RATE = 90000  # Relógio de media dos timestamps de vídeo (RFC 3551)
+
+# Relatório do emissor (como o SR do RTCP), enviado no próprio fluxo RTP para seguir o mesmo
+# caminho pelos nodes: marker + payload type 72 dão o segundo byte 200, o tipo SR do RTCP.
+# Payload: | NTP segundos (32) | NTP fração (32) | timestamp RTP (32) | pacotes (32) | octetos (32) |
+SENDER_REPORT_TYPE = 200
+SENDER_REPORT_PT = SENDER_REPORT_TYPE & 0x7F
+SENDER_REPORT_FORMAT = struct.Struct('!IIIII')
+NTP_EPOCH_OFFSET = 2208988800  # Segundos entre 1900 (NTP) e 1970 (Unix)
+
+def readSeqNum(buffer):
+	"""Read the RTP sequence number straight from a packet buffer."""
+	return struct.unpack_from('!H', buffer, 2)[0]
+
+class SequenceWindow:
+	"""
+	Janela deslizante dos números de sequência RTP já vistos (como a janela anti-replay do IPsec).
+	Durante uma troca de rota o mesmo fluxo chega pelos dois caminhos; accept() só deixa passar
+	a primeira cópia de cada pacote, com aritmética módulo 2^16.
+	"""
+	def __init__(self, size=SEQUENCE_WINDOW):
+		self.size = size
+		self.full = (1 << size) - 1
+		self.highest = None
+		self.mask = 0  # bit i = pacote highest - i já visto
+
+	def accept(self, seq):
+		"""Return True the first time seq is seen, False for duplicates or packets too old for the window."""
+		if self.highest is None:
+			self.highest = seq
+			self.mask = 1
+			return True
+
+		delta = (seq - self.highest) & 0xFFFF
+		if delta == 0:
+			return False
+		if delta < 0x8000:
+			# Pacote mais recente: avança a janela
+			self.mask = ((self.mask << delta) | 1) & self.full if delta < self.size else 1
+			self.highest = seq
+			return True
+
+		behind = 0x10000 - delta
+		if behind > SEQUENCE_RESET_GAP:
+			# Numeração recomeçada (novo emissor): a janela recomeça também
+			self.highest = seq
+			self.mask = 1
+			return True
+		if behind >= self.size:
+			return False
+		bit = 1 << behind
+		if self.mask & bit:
+			return False
+		self.mask |= bit
+		return True
+
+class SequenceTracker:
+	"""
+	Números de sequência estendidos (RFC 3550, apêndice A.1).
+	Conta as voltas do número de 16 bits, para que a ordem dos pacotes se mantenha
+	depois de 65535 -> 0. Um salto grande só é aceite como reinício da numeração
+	quando o pacote seguinte o confirma; até lá os pacotes são descartados.
+	"""
+	def __init__(self):
+		self.max_seq = None
+		self.restarted = False
+
+	def start(self, seq):
+		self.base = seq        # Primeiro número (estendido) recebido
+		self.max_seq = seq
+		self.cycles = 0        # Voltas completas, em múltiplos de 2^16
+		self.bad_seq = None
+		self.received = 1
+
+	def update(self, seq):
+		"""Return the extended sequence number of seq, or None if the packet must be discarded."""
+		self.restarted = False
+		if self.max_seq is None:
+			self.start(seq)
+			return seq
+
+		delta = (seq - self.max_seq) & 0xFFFF
+		if delta < MAX_DROPOUT:
+			# Em ordem, possivelmente com perdas
+			if seq < self.max_seq:
+				self.cycles += 0x10000
+			self.max_seq = seq
+			self.bad_seq = None
+			self.received += 1
+			return self.cycles + seq
+
+		if delta <= 0x10000 - MAX_MISORDER:
+			# Salto muito grande: reinício só se o pacote seguinte continuar a nova numeração
+			if seq == self.bad_seq:
+				self.start(seq)
+				self.restarted = True
+				return seq
+			self.bad_seq = (seq + 1) & 0xFFFF
+			return None
+
+		# Atrasado ou duplicado, possivelmente ainda da volta anterior
+		self.received += 1
+		cycles = self.cycles - 0x10000 if seq > self.max_seq else self.cycles
+		return cycles + seq
+
+	def extendedMax(self):
+		"""Highest extended sequence number received."""
+		return self.cycles + self.max_seq if self.max_seq is not None else None
+
+	def expected(self):
+		"""Number of packets expected since the first one (RFC 3550, A.3)."""
+		return self.extendedMax() - self.base + 1 if self.max_seq is not None else 0
+
+def isSenderReport(buffer):
+	"""Tell sender reports apart from media packets on the same RTP flow."""
+	return buffer[1] == SENDER_REPORT_TYPE
+
+def toNtp(wallclock):
+	"""Convert Unix time (seconds) to the 64-bit NTP format as (seconds, fraction)."""
+	seconds = int(wallclock)
+	return (seconds + NTP_EPOCH_OFFSET) & 0xFFFFFFFF, int((wallclock - seconds) * (1 << 32)) & 0xFFFFFFFF
+
+def fromNtp(seconds, fraction):
+	"""Convert an NTP (seconds, fraction) pair back to Unix time."""
+	return seconds - NTP_EPOCH_OFFSET + fraction / (1 << 32)
+
+def timestampDelta(a, b):
+	"""Signed difference a - b between two 32-bit RTP timestamps."""
+	return ((a - b + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def readStreamId(buffer):
+	"""Read the stream ID straight from a packet buffer, without copying the payload."""
+	return struct.unpack_from('!I', buffer, STREAM_ID_OFFSET)[0]
+
+def readSenderIp(buffer):
+	"""Read the packed (4-byte) sender IPv4 from a packet buffer."""
+	return struct.unpack_from('!4s', buffer, SENDER_IP_OFFSET)[0]
+
+def patchSenderIp(buffer, packed_ip):
+	"""Overwrite the sender IPv4 in place on a bytearray/memoryview."""
+	struct.pack_into('!4s', buffer, SENDER_IP_OFFSET, packed_ip)
 
 class RtpPacket:	
 	header = bytearray(HEADER_SIZE)
@@ -8,91 +167,64 @@ class RtpPacket:
 	def __init__(self):
 		pass
 		
-	def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, filename, sender_ip):
-		"""Encode the RTP packet with header fields and payload."""
-		timestamp = int(time())
-		header = bytearray(HEADER_SIZE) 
+	def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, stream_id, sender_ip, timestamp=None, fragment_offset=0):
+		"""Encode the RTP packet with header fields, routing extension and payload."""
+		if timestamp is None:
+			timestamp = int(time() * RTP_CLOCK_RATE)
+		timestamp &= 0xFFFFFFFF
+		header = bytearray(PACKET_HEADER_SIZE if extension else HEADER_SIZE) 
 		header[0] = (header[0] | version << 6) & 0xC0; # 2 bits
 		header[0] = (header[0] | padding << 5); # 1 bit
 		header[0] = (header[0] | extension << 4); # 1 bit
 		header[0] = (header[0] | (cc & 0x0F)); # 4 bits
 		header[1] = (header[1] | marker << 7); # 1 bit
 		header[1] = (header[1] | (pt & 0x7f)); # 7 bits
-		header[2] = (seqnum >> 8); 
+		header[2] = (seqnum >> 8) & 0xFF; 
 		header[3] = (seqnum & 0xFF);
-		header[4] = (timestamp >> 24);
+		header[4] = (timestamp >> 24) & 0xFF;
 		header[5] = (timestamp >> 16) & 0xFF;
 		header[6] = (timestamp >> 8) & 0xFF;
 		header[7] = (timestamp & 0xFF);
-		header[8] = (ssrc >> 24);
+		header[8] = (ssrc >> 24) & 0xFF;
 		header[9] = (ssrc >> 16) & 0xFF;
 		header[10] = (ssrc >> 8) & 0xFF;
 		header[11] = ssrc & 0xFF
+
+		# Incluindo o id do fluxo e o ip de quem envia o pacote na extensão do cabeçalho
+		if extension:
+			struct.pack_into('!HHI4sI', header, HEADER_SIZE, EXTENSION_PROFILE, EXTENSION_WORDS, stream_id, socket.inet_aton(sender_ip), fragment_offset)
+
 		# set header and  payload
 		self.header = header
-		
-		filename_bytes = filename.encode('utf-8')
-		sender_ip_bytes = sender_ip.encode('utf-8')
-		# Incluindo o nome do arquivo e o ip de quem envia o pacote no payload antes do vídeo
-		payload = filename_bytes + b'\0' + sender_ip_bytes + b'\0' + payload  # Adicionando um terminador null para o filename e para o sender_ip
-
 		self.payload = payload
+		self.fragment_offset = fragment_offset
   
 	def decode(self, byteStream):
-		"""Decode the RTP packet and extract filename and sender IP if present."""
-		self.header = bytearray(byteStream[:HEADER_SIZE])
-		self.payload = byteStream[HEADER_SIZE:]
-
-		filename = None
+		"""Decode the RTP packet and extract stream ID and sender IP if present."""
+		stream_id = None
 		sender_ip = None
-		try:
-			# Extract filename by looking for the first null terminator
-			filename_end_index = self.payload.index(0)  # Null byte
-			filename = self.payload[:filename_end_index].decode('utf-8')
-			remaining_payload = self.payload[filename_end_index + 1:]
-
-			# Extract sender IP by looking for the next null terminator
-			sender_ip_end_index = remaining_payload.index(0)
-			sender_ip = remaining_payload[:sender_ip_end_index].decode('utf-8')
-
-			# Update the payload to exclude filename and sender_ip
-			self.payload = remaining_payload[sender_ip_end_index + 1:]
-		except ValueError:
-			# Handle the case where filename or sender_ip is not present
-			pass
-
-		return filename, sender_ip
-
-	def updateSenderIp(self, byteStream, new_sender_ip):
-		"""Update the sender_ip in the RTP packet."""
-		try:
-			self.header = bytearray(byteStream[:HEADER_SIZE])
-			self.payload = byteStream[HEADER_SIZE:]
-   
-			# Extrair o nome do arquivo do início do payload
-			filename_end_index = self.payload.index(0)  # Null byte
-			filename = self.payload[:filename_end_index].decode('utf-8')
-			remaining_payload = self.payload[filename_end_index + 1:]
-
-			# Extrair o sender_ip existente
-			sender_ip_end_index = remaining_payload.index(0)  # Próximo null byte
-			remaining_payload = remaining_payload[sender_ip_end_index + 1:]  # Atualizar para ignorar o sender_ip antigo
-
-			# Codificar o novo sender_ip
-			new_sender_ip_bytes = new_sender_ip.encode('utf-8') 
-
-			# Reconstruir o payload com o novo sender_ip
-			self.payload = filename.encode('utf-8') + b'\0' + new_sender_ip_bytes + b'\0' + remaining_payload
-
-		except ValueError:
-			print("Erro ao atualizar o sender_ip: Payload malformado.")
+		self.fragment_offset = 0
+
+		header_size = HEADER_SIZE
+		if len(byteStream) >= PACKET_HEADER_SIZE and byteStream[0] & 0x10:
+			profile, words = struct.unpack_from('!HH', byteStream, HEADER_SIZE)
+			header_size = HEADER_SIZE + 4 + words * 4
+			if profile == EXTENSION_PROFILE:
+				stream_id = readStreamId(byteStream)
+				sender_ip = socket.inet_ntoa(readSenderIp(byteStream))
+				self.fragment_offset = struct.unpack_from('!I', byteStream, FRAGMENT_OFFSET_OFFSET)[0]
+
+		self.header = bytearray(byteStream[:header_size])
+		self.payload = byteStream[header_size:]
+
+		return stream_id, sender_ip
 	
 	def version(self):
 		"""Return RTP version."""
 		return int(self.header[0] >> 6)
 	
 	def seqNum(self):
-		"""Return sequence (frame) number."""
+		"""Return sequence (packet) number."""
 		seqNum = self.header[2] << 8 | self.header[3]
 		return int(seqNum)
 	
@@ -101,6 +233,14 @@ class RtpPacket:
 		timestamp = self.header[4] << 24 | self.header[5] << 16 | self.header[6] << 8 | self.header[7]
 		return int(timestamp)
 	
+	def marker(self):
+		"""Return marker bit (set on the last fragment of a frame)."""
+		return int(self.header[1] >> 7)
+
+	def fragmentOffset(self):
+		"""Return the byte offset of the payload inside its frame."""
+		return self.fragment_offset
+
 	def payloadType(self):
 		"""Return payload type."""
 		pt = self.header[1] & 127
@@ -114,5 +254,10 @@ class RtpPacket:
 		"""Return RTP packet."""
 		return self.header + self.payload
 
+	def senderReport(self):
+		"""Return (wallclock, rtp timestamp, packet count, octet count) of a sender report."""
+		ntpSeconds, ntpFraction, timestamp, packets, octets = SENDER_REPORT_FORMAT.unpack_from(self.payload)
+		return fromNtp(ntpSeconds, ntpFraction), timestamp, packets, octets
+
 	def printheader(self):
 		print("[RTP Packet] Version: ...")
\ No newline at end of file
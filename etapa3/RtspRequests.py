@@ -0,0 +1,49 @@
+# Pedidos de texto trocados nas ligações RTSP persistentes entre vizinhos.
+# Os pedidos não têm delimitador próprio: cada um começa numa linha com o seu tipo
+# e tem um número fixo de linhas, cada uma terminada por '\n'.
+REQUEST_LINES = {
+    "ACTIVE": 3,    # ACTIVE <fluxo> / IP <ip> / RTP_PORT <porta>
+    "SETUP": 3,     # SETUP <fluxo> RTSP/1.0 / CSeq / IP
+    "PLAY": 4,      # PLAY <fluxo> RTSP/1.0 / CSeq / Session / IP
+    "PAUSE": 4,
+    "TEARDOWN": 4,
+}
+
+def request_type(line):
+    return line.split(' ', 1)[0]
+
+class RequestBuffer:
+    """
+    Separa os pedidos recebidos numa ligação TCP, qualquer que seja a forma como
+    chegam nas leituras: vários pedidos na mesma leitura ou um pedido dividido por
+    várias. Linhas que não pertencem a nenhum pedido conhecido são descartadas.
+    """
+    def __init__(self):
+        self.pending = bytearray()  # Bytes ainda sem '\n'
+        self.lines = []             # Linhas do pedido em curso
+
+    def feed(self, data):
+        """Acrescenta os bytes lidos e retorna a lista dos pedidos completos (texto)."""
+        self.pending += data
+        *complete, rest = self.pending.split(b'\n')
+        self.pending = bytearray(rest)
+
+        requests = []
+        for raw in complete:
+            line = raw.decode("utf-8", errors="replace").rstrip('\r')
+            if not line:
+                continue
+            if request_type(line) in REQUEST_LINES:
+                if self.lines:
+                    print(f"Pedido incompleto descartado: {self.lines[0]}")
+                self.lines = [line]
+            elif self.lines:
+                self.lines.append(line)
+            else:
+                print(f"Linha fora de um pedido descartada: {line}")
+                continue
+
+            if len(self.lines) == REQUEST_LINES[request_type(self.lines[0])]:
+                requests.append("\n".join(self.lines) + "\n")
+                self.lines = []
+        return requests
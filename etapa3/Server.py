@@ -2,10 +2,21 @@ import sys, socket, threading, time
 
 from control_protocol_pb2 import ControlMessage
 from control_protocol_pb2 import FloodingMessage
-from ServerWorker import ServerWorker
+from control_protocol_pb2 import ReceptionReport
+from ServerWorker import ServerWorker, MediaTimeline
+from FrameStore import open_store
+from FrameScheduler import FrameScheduler
+from ControlChannel import CONTROL_MESSAGE, FLOODING_MESSAGE, ConnectionPool, send_message, read_message
+from LinkProbe import LinkProbe, PROBE_PORT
+from Records import NeighborEntry, Status
+from ReceptionReports import ReportTable
+from Renditions import variants, split_variant
+from RtspRequests import RequestBuffer
+
+FLOOD_REFRESH_INTERVAL = 30.0  # Segundos entre anúncios periódicos (além das atualizações despoletadas)
 
 class Server:	
-    def __init__(self,server_ip, server_id, control_port=50051, data_port=50052, server_rtsp_port=30000, bootstrapper_host='localhost', bootstrapper_port=5000):
+    def __init__(self,server_ip, server_id, control_port=50051, data_port=50052, server_rtsp_port=30000, bootstrapper_host='localhost', bootstrapper_port=5000, probe_port=PROBE_PORT):
         self.server_id = server_id
         self.server_ip = server_ip
         self.control_port = control_port
@@ -20,8 +31,21 @@ class Server:
         
         self.active_workers = {}
         self.active_workers_lock = threading.Lock() 
+
+        # Relógio único que marca o ritmo de todos os fluxos
+        self.scheduler = FrameScheduler()
+        
+        # Ligações TCP persistentes aos servidores de controlo dos vizinhos
+        self.control_pool = ConnectionPool()
+
+        # Relatórios de receção agregados pelos vizinhos (qualidade de entrega de cada fluxo)
+        self.reports = ReportTable()
+
+        # Responde às sondas de latência dos vizinhos (o servidor não escolhe rotas)
+        self.probe = LinkProbe(probe_port)
         
-        self.latest_flooding_message = {}
+        # Número de sequência dos anúncios de rotas (incrementado a cada alteração)
+        self.flood_sequence = 0
         self.flooding_lock = threading.Lock()
         
         self.movies = {
@@ -29,6 +53,14 @@ class Server:
             "movie-copy.Mjpeg",
             "output.avi"
         }
+
+        # Cada filme é anunciado como um fluxo por variante de qualidade (Renditions),
+        # todas com o mesmo relógio de media
+        self.streams = {name for movie in self.movies for name in variants(movie)}
+        self.timelines = {movie: MediaTimeline() for movie in self.movies}
+
+        # Ids numéricos compactos atribuídos a cada fluxo e anunciados no FLOODING_UPDATE
+        self.stream_table = {name: stream_id for stream_id, name in enumerate(sorted(self.streams), start=1)}
         
         self.rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.rtspSocket.bind(('', self.server_rtsp_port))
@@ -37,12 +69,10 @@ class Server:
 
 	
     def send_control_message_tcp(self, socket, control_message):
-        header = b'\x01'
-        socket.sendall(header + control_message.SerializeToString())
+        send_message(socket, CONTROL_MESSAGE, control_message)
 
     def send_flooding_message_tcp(self, socket, flooding_message):
-        header = b'\x02' 
-        socket.sendall(header + flooding_message.SerializeToString())
+        send_message(socket, FLOODING_MESSAGE, flooding_message)
     
     def send_control_message_udp(self, socket, address, control_message):
         header = b'\x01'  # Header para ControlMessage
@@ -74,8 +104,7 @@ class Server:
             self.send_control_message_tcp(s, control_message)
             
             # Recebe e processa a resposta
-            header = s.recv(1)  # Lê o primeiro byte
-            data = s.recv(1024)  # Lê o restante da mensagem
+            header, data = read_message(s)
             
             if header == b'\x01':  # ControlMessage
                 response_message = ControlMessage()
@@ -86,15 +115,8 @@ class Server:
                     with self.neighbors_lock:
                         self.neighbors.clear()  # Limpa vizinhos antigos para o caso de ser uma reativação
                         for neighbor in response_message.neighbors:
-                            self.neighbors[neighbor.node_ip] = {
-                                "node_id": neighbor.node_id,
-                                "control_port": neighbor.control_port,
-                                "data_port": neighbor.data_port,
-                                "node_type": neighbor.node_type,
-                                "status": "active",
-                                "failed-attempts": 0,
-                                "rtsp_port": neighbor.rtsp_port
-                            }
+                            self.neighbors[neighbor.node_ip] = NeighborEntry(neighbor.node_ip, neighbor.node_id, neighbor.node_type,
+                                                                             neighbor.control_port, neighbor.data_port, neighbor.rtsp_port)
                     print(f"Server {self.server_id} neighbors: {self.neighbors}")
                     # Após o registro, notifica os vizinhos sobre o registro
                     self.notify_neighbors_registration()
@@ -110,22 +132,20 @@ class Server:
             
         for neighbor_ip, neighbor_info in neighbors_snapshot.items():
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((neighbor_ip, neighbor_info['control_port']))
-                    notify_message = ControlMessage()
-                    notify_message.type = ControlMessage.UPDATE_NEIGHBORS
-                    notify_message.node_id = self.server_id
-                    notify_message.node_ip = self.server_ip
-                    notify_message.control_port = self.control_port
-                    notify_message.data_port = self.data_port
-                    notify_message.node_type = "server"
-                    notify_message.rtsp_port = self.server_rtsp_port
-                    
-                    self.send_control_message_tcp(s,notify_message)
-                    print(f"Notified neighbor {neighbor_info['node_id']} of registration.")
+                notify_message = ControlMessage()
+                notify_message.type = ControlMessage.UPDATE_NEIGHBORS
+                notify_message.node_id = self.server_id
+                notify_message.node_ip = self.server_ip
+                notify_message.control_port = self.control_port
+                notify_message.data_port = self.data_port
+                notify_message.node_type = "server"
+                notify_message.rtsp_port = self.server_rtsp_port
+                
+                self.control_pool.send((neighbor_ip, neighbor_info.control_port), CONTROL_MESSAGE, notify_message)
+                print(f"Notified neighbor {neighbor_info.node_id} of registration.")
 
             except Exception as e:
-                print(f"Failed to notify neighbor {neighbor_info['node_id']}: {e}")
+                print(f"Failed to notify neighbor {neighbor_info.node_id}: {e}")
                 
     def start(self):
         """
@@ -133,10 +153,26 @@ class Server:
         de controle e dados em threads separadas.
         """
         
+        self.prepare_movies()
+        self.scheduler.start()
         self.register_with_bootstrapper()
+        self.probe.start()
         threading.Thread(target=self.control_server).start()  # Inicia o servidor de controle em uma thread separada
         threading.Thread(target=self.send_ping_to_neighbors).start()  # Enviar PING aos vizinhos
-        threading.Thread(target=self.send_flood_to_neighbors).start() # Enviar FLOODING aos vizinhos
+        self.announce_streams()  # Anuncia os fluxos aos vizinhos
+        threading.Thread(target=self.refresh_announcements, daemon=True).start()  # Refrescamento periódico lento
+
+    def prepare_movies(self):
+        """
+        Pré-codifica cada variante de cada filme uma única vez num ficheiro de frames mapeado
+        em memória, para que os workers apenas tenham de ler os frames já em JPEG.
+        """
+        for movie in sorted(self.streams):
+            try:
+                store = open_store(movie)
+                print(f"Filme {movie} pronto: {len(store)} frames")
+            except IOError as e:
+                print(f"Falha ao preparar o filme {movie}: {e}")
 
     def control_server(self):
         """
@@ -155,14 +191,14 @@ class Server:
         print(f"Connection from {addr} established.")
         with conn:
             while True:
-                # Lê o header para determinar o tipo de mensagem
-                header = conn.recv(1)  # Lê o primeiro byte
-                if not header:
-                    break  # Conexão fechada pelo cliente
-                
-                data = conn.recv(1024)  # Lê o restante da mensagem
-                if not data:
+                # Lê uma mensagem enquadrada (header + comprimento + corpo)
+                try:
+                    header, data = read_message(conn)
+                except (OSError, ValueError) as e:
+                    print(f"Control connection from {addr} closed: {e}")
                     break
+                if header is None:
+                    break  # Conexão fechada pelo vizinho
                 
                 if header == b'\x01':  # ControlMessage
                     control_message = ControlMessage()
@@ -172,6 +208,8 @@ class Server:
                             self.handle_update_neighbors(control_message)
                         elif control_message.type == ControlMessage.PING:
                             self.handle_ping(control_message, conn)
+                        elif control_message.type == ControlMessage.RECEIVER_REPORT:
+                            self.handle_receiver_report(control_message)
                         else:
                             raise ValueError(f"Unknown ControlMessage type: {control_message.type}")
                     except Exception as e:
@@ -188,6 +226,10 @@ class Server:
                             
                         elif flooding_message.type == FloodingMessage.DEACTIVATE_ROUTE:
                             print("DESATIVAÇÃO DO NODE RECEBIDA")
+                            with self.active_workers_lock:
+                                worker = self.active_workers.get(flooding_message.stream_ids[0])
+                            if worker:
+                                worker.unsubscribe(flooding_message.source_ip)
 
                         else:
                             raise ValueError(f"Unknown FloodingMessage type: {flooding_message.type}")
@@ -200,8 +242,8 @@ class Server:
     def receive_neighbors_info(self, flooding_message, filename):
         # Atualiza o flooding_message mais recente
         with self.neighbors_lock:
-            if 'rtp_port' not in self.neighbors[flooding_message.source_ip]:
-                self.neighbors[flooding_message.source_ip]['rtp_port'] = flooding_message.rtp_port
+            if self.neighbors[flooding_message.source_ip].rtp_port is None:
+                self.neighbors[flooding_message.source_ip].rtp_port = flooding_message.rtp_port
 
         threading.Thread(target=self.openRTSP_socket, args=(filename, )).start()  # Chama a função para iniciar o socket 
                         
@@ -216,22 +258,19 @@ class Server:
 
         with self.neighbors_lock: 
             if neighbor_ip in self.neighbors:
-                self.neighbors[neighbor_ip]["status"] = "active"
+                self.neighbors[neighbor_ip].status = Status.ACTIVE
+                self.neighbors[neighbor_ip].failed_attempts = 0
                 print(f"Updated status of existing neighbor {neighbor_id} to active.")
             else:
-                # Armazena as informações do vizinho se ele não estiver presente
-                self.neighbors[neighbor_ip] = {
-                    "node_id": neighbor_id,
-                    "control_port": control_port,
-                    "data_port": data_port,
-                    "node_type": node_type,
-                    "failed-attempts": 0,
-                    "status": "active",  # Define o status como ativo,
-                    "rtsp_port": rtsp_port
-                }
+                # Armazena as informações do vizinho se ele não estiver presente (ativo)
+                self.neighbors[neighbor_ip] = NeighborEntry(neighbor_ip, neighbor_id, node_type, control_port, data_port, rtsp_port)
                 print(f"Added new neighbor: {neighbor_id}")
+            neighbor_info = self.neighbors[neighbor_ip].copy()
                 
         print(f"Server {self.server_id} neighbors: {self.neighbors}")
+
+        # O vizinho (re)registou-se sem estado: envia-lhe o anúncio atual dos fluxos
+        self.send_flooding_message(neighbor_ip, neighbor_info)
         
     def send_ping_to_neighbors(self):
         while True:
@@ -244,50 +283,45 @@ class Server:
 
             for neighbor_ip, neighbor_info in neighbors_snapshot.items():
                 # Verificar status do vizinho e tentativas falhas (não precisa de lock, já capturado no snapshot)
-                if neighbor_info.get("status") == "inactive":
+                if neighbor_info.status is Status.INACTIVE:
                     continue  # Ignora vizinhos inativos
 
-                if neighbor_info.get("failed-attempts", 0) >= 2:
-                    print(f"Neighbor {neighbor_info['node_id']} considered inactive due to lack of PONG response.")
+                if neighbor_info.failed_attempts >= 2:
+                    print(f"Neighbor {neighbor_info.node_id} considered inactive due to lack of PONG response.")
                     with self.neighbors_lock:  # Atualiza o status do vizinho de forma segura
-                        self.neighbors[neighbor_ip]["status"] = "inactive"
+                        self.neighbors[neighbor_ip].status = Status.INACTIVE
+                    self.control_pool.discard((neighbor_ip, neighbor_info.control_port))
                     continue
 
                 try:
-                    # Envia o PING ao vizinho
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                        s.connect((neighbor_ip, neighbor_info['control_port']))
-                        
-                        # Criação e envio da mensagem de PING
-                        ping_message = ControlMessage()
-                        ping_message.type = ControlMessage.PING
-                        ping_message.node_ip = self.server_ip
-                        ping_message.node_id = self.server_id
-                        ping_message.accumulated_time = 0
-                        self.send_control_message_tcp(s, ping_message)
-                        print(f"Sent PING to neighbor {neighbor_info['node_id']}")
-
-                        # Espera pela resposta PONG
-                        header = s.recv(1)  # Lê o primeiro byte
-                        data = s.recv(1024)  # Lê o restante da mensagem
-                        if data:
-                            if header == b'\x01':  # ControlMessage
-                                response_message = ControlMessage()
-                                response_message.ParseFromString(data)
-                                if response_message.type == ControlMessage.PONG:
-                                    print(f"Received PONG from neighbor {response_message.node_id}")
-
-                                    # Atualiza o status do vizinho de forma segura
-                                    with self.neighbors_lock:
-                                        self.neighbors[neighbor_ip]["failed-attempts"] = 0
-                                        self.neighbors[neighbor_ip]["status"] = "active"
+                    # Criação e envio da mensagem de PING na ligação persistente ao vizinho
+                    ping_message = ControlMessage()
+                    ping_message.type = ControlMessage.PING
+                    ping_message.node_ip = self.server_ip
+                    ping_message.node_id = self.server_id
+                    ping_message.accumulated_time = 0
+                    header, data = self.control_pool.request((neighbor_ip, neighbor_info.control_port), CONTROL_MESSAGE, ping_message)
+                    print(f"Sent PING to neighbor {neighbor_info.node_id}")
+
+                    # Processa a resposta PONG
+                    if data:
+                        if header == b'\x01':  # ControlMessage
+                            response_message = ControlMessage()
+                            response_message.ParseFromString(data)
+                            if response_message.type == ControlMessage.PONG:
+                                print(f"Received PONG from neighbor {response_message.node_id}")
+
+                                # Atualiza o status do vizinho de forma segura
+                                with self.neighbors_lock:
+                                    self.neighbors[neighbor_ip].failed_attempts = 0
+                                    self.neighbors[neighbor_ip].status = Status.ACTIVE
 
                 except Exception as e:
-                    print(f"Failed to send PING to neighbor {neighbor_info['node_id']}: {e}")
+                    print(f"Failed to send PING to neighbor {neighbor_info.node_id}: {e}")
                     # Incrementa tentativas falhas de forma segura
                     with self.neighbors_lock:
                         if neighbor_ip in self.neighbors:  # Verifica se o vizinho ainda existe
-                            self.neighbors[neighbor_ip]["failed-attempts"] = self.neighbors[neighbor_ip].get("failed-attempts", 0) + 1
+                            self.neighbors[neighbor_ip].failed_attempts += 1
 
     def handle_ping(self, control_message, conn):
         # Responder a uma mensagem de ping
@@ -298,38 +332,70 @@ class Server:
         self.send_control_message_tcp(conn, pong_message)
         print(f"Sent PONG to neighbor {control_message.node_id}")
                 
-    def send_flood_to_neighbors(self):
-        while True:
-            with self.neighbors_lock:
-                neighbors_snapshot =  self.neighbors.copy()
-                
-            for neighbor_ip, neighbor_info in neighbors_snapshot.items():
-                # Verificar se o vizinho já está marcado como inativo
-                if neighbor_info.get("status") == "active":
-                    self.send_flooding_message(neighbor_ip, neighbor_info)    
-            time.sleep(15)
+    def handle_receiver_report(self, control_message):
+        """Guarda os relatórios de receção de um vizinho e mostra a qualidade de entrega de cada fluxo."""
+        self.reports.update(control_message.node_ip, control_message.reports)
+        for filename, report in self.delivery_quality().items():
+            print(f"Fluxo {filename}: {report.receivers} recetores, {report.fraction_lost:.1%} perdidos "
+                  f"({report.cumulative_lost} no total), jitter {report.jitter * 1000:.1f} ms, latência {report.latency * 1000:.1f} ms")
+
+    def delivery_quality(self):
+        """Qualidade de entrega de cada fluxo (pior caso entre todos os recetores), como ReceptionReport."""
+        return self.reports.aggregate(ReceptionReport)
+
+    def announce_streams(self, movies=None):
+        """
+        Atualização despoletada: anuncia com um novo número de sequência os fluxos
+        que mudaram (por omissão todos) aos vizinhos ativos.
+        """
+        with self.flooding_lock:
+            self.flood_sequence += 1
+
+        with self.neighbors_lock:
+            neighbors_snapshot =  self.neighbors.copy()
+            
+        for neighbor_ip, neighbor_info in neighbors_snapshot.items():
+            # Verificar se o vizinho já está marcado como inativo
+            if neighbor_info.status is Status.ACTIVE:
+                self.send_flooding_message(neighbor_ip, neighbor_info, movies)
                 
-    def send_flooding_message(self, neighbor_ip, neighbor_info):
+    def refresh_announcements(self):
+        """
+        Volta a anunciar periodicamente todos os fluxos com um novo número de sequência, para
+        que os nodes recuperem rotas retiradas por falhas ou anúncios perdidos pelo caminho.
         """
-        Envia uma mensagem de flooding para todos os vizinhos.
+        while True:
+            time.sleep(FLOOD_REFRESH_INTERVAL)
+            self.announce_streams()
+
+    def send_flooding_message(self, neighbor_ip, neighbor_info, movies=None):
         """
+        Envia a um vizinho o anúncio dos fluxos (por omissão todos) com o número de sequência atual.
+        """
+        movies = self.streams if movies is None else movies
         flooding_message = FloodingMessage()
         flooding_message.type = FloodingMessage.FLOODING_UPDATE
         flooding_message.source_id = self.server_id
         flooding_message.source_ip = self.server_ip
-        flooding_message.stream_ids.extend(self.movies)
+        flooding_message.origin_id = self.server_id
+        with self.flooding_lock:
+            flooding_message.sequence = self.flood_sequence
+        flooding_message.metric = 0
+        flooding_message.stream_ids.extend(movies)
+        for name in movies:
+            stream = flooding_message.streams.add()
+            stream.name = name
+            stream.stream_id = self.stream_table[name]
         flooding_message.route_state = "active"
         flooding_message.control_port = self.control_port
         flooding_message.rtsp_port = self.server_rtsp_port
         
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((neighbor_ip, neighbor_info['control_port']))
-                self.send_flooding_message_tcp(s, flooding_message)
-                print(f"Sent flooding message to {neighbor_info['node_id']}")
+            self.control_pool.send((neighbor_ip, neighbor_info.control_port), FLOODING_MESSAGE, flooding_message)
+            print(f"Sent flooding message to {neighbor_info.node_id}")
 
         except Exception as e:
-            print(f"Failed to send flooding message to {neighbor_info['node_id']}: {e}")
+            print(f"Failed to send flooding message to {neighbor_info.node_id}: {e}")
           
     def openRTSP_socket(self, filename):
         """
@@ -340,45 +406,68 @@ class Server:
             try:
                 rtsp_socket, neighbor_address = self.rtspSocket.accept()
                 print(f"Conexão aceita de {neighbor_address}")
-                
-                data = rtsp_socket.recv(256)
-                if data:
-                    decoded_data = data.decode("utf-8")
-                    print("Data received:\n" + decoded_data + "\n")
-                    if not decoded_data.startswith("ACTIVE"):
-                        request = decoded_data.splitlines()
-                        line1 = request[0].split(' ')
-                        requestType = line1[0]
-                        filename = line1[1]
-                        seq = request[1].split(' ')
-                        if requestType != "SETUP": # Ver melhor isto
-                            ip = request[3].split(' ')[1]
-                        else:
-                            ip = request[2].split(' ')[1]
-                            
-                        # Iniciar thread para lidar com a conexão
-                        threading.Thread(
-                            target=self.handle_rtsp_connection,
-                            args=(rtsp_socket, requestType, filename, ip, seq),
-                            daemon=True
-                        ).start()
-                
-                    else:
-                        request = decoded_data.splitlines()
-                        filename = request[0].split(' ')[1]
-                        ip = request[1].split(' ')[1]
-                        rtp_port = request[2].split(' ')[1]
-                            
-                        # Iniciar thread para lidar com a conexão
-                        threading.Thread(
-                            target=self.handle_rtsp_connection2,
-                            args=(rtsp_socket, filename, ip, int(rtp_port)),
-                            daemon=True
-                        ).start()
-                        
+
+                # Cada vizinho mantém a ligação aberta e envia por ela todos os pedidos seguintes
+                threading.Thread(
+                    target=self.serve_rtsp_connection,
+                    args=(rtsp_socket, neighbor_address),
+                    daemon=True
+                ).start()
+
             except Exception as e:
                 print(f"Erro no loop de aceitação: {e}")
+
+    def serve_rtsp_connection(self, rtsp_socket, neighbor_address):
+        """Processa, por ordem, os pedidos (ACTIVE ou RTSP) recebidos numa ligação até o vizinho a fechar."""
+        requests = RequestBuffer()
+        with rtsp_socket:
+            while True:
+                try:
+                    data = rtsp_socket.recv(1024)
+                except OSError as e:
+                    print(f"Ligação RTSP de {neighbor_address} terminada: {e}")
+                    break
+                if not data:
+                    break
+
+                for request in requests.feed(data):
+                    print("Data received:\n" + request)
+                    try:
+                        self.handle_request(rtsp_socket, request.splitlines())
+                    except (IndexError, ValueError) as e:
+                        print(f"Pedido RTSP inválido de {neighbor_address}: {e}")
+        print(f"Conexão RTSP de {neighbor_address} fechada")
+
+    def handle_request(self, rtsp_socket, request):
+        """Despacha um pedido já separado em linhas."""
+        if not request[0].startswith("ACTIVE"):
+            line1 = request[0].split(' ')
+            requestType = line1[0]
+            filename = line1[1]
+            seq = request[1].split(' ')
+            if requestType != "SETUP": # Ver melhor isto
+                ip = request[3].split(' ')[1]
+            else:
+                ip = request[2].split(' ')[1]
+            self.handle_rtsp_connection(rtsp_socket, requestType, filename, ip, seq)
+
+        else:
+            filename = request[0].split(' ')[1]
+            ip = request[1].split(' ')[1]
+            rtp_port = request[2].split(' ')[1]
+            self.handle_rtsp_connection2(rtsp_socket, filename, ip, int(rtp_port))
     
+    def get_worker(self, filename):
+        """Retorna o ServerWorker (fonte partilhada) do fluxo, criando-o se ainda não existir."""
+        with self.active_workers_lock:
+            worker = self.active_workers.get(filename)
+            if worker is None:
+                print(f"Criando nova fonte para o fluxo {filename}")
+                movie, _ = split_variant(filename)
+                worker = ServerWorker(self.server_ip, filename, self.stream_table[filename], self.scheduler, self.timelines[movie])
+                self.active_workers[filename] = worker
+            return worker
+
     def handle_rtsp_connection(self, rtsp_socket, requestType, filename, sender_ip, seq):
         """
         Lida com a conexão RTSP recebida.
@@ -386,32 +475,15 @@ class Server:
         try:
             # Informações do cliente (vizinho)
             with self.neighbors_lock:
-                new_rtp_port = self.neighbors[sender_ip]["rtp_port"]
+                new_rtp_port = self.neighbors[sender_ip].rtp_port
 
             # Processar a conexão
             print(f"Gerindo a conexão para {sender_ip}:{new_rtp_port}, fluxo {filename}")
 
-            # Verifica se já existe um ServerWorker para o fluxo
-            with self.active_workers_lock:
-                existing_worker = self.active_workers.get(filename, None)
-                    
-            if existing_worker:
-                # Atualiza o ServerWorker existente para o novo vizinho
-                existing_worker.update_neighborInfo(sender_ip, rtsp_socket, new_rtp_port)
-                print(f"Atualizada sessão existente para o fluxo {filename} com o vizinho {sender_ip}:{new_rtp_port}")
-                existing_worker.processRtspRequest(requestType, filename, seq)
-            else:
-                # Cria um novo ServerWorker para o fluxo
-                neighborInfo = {
-                    "ip": sender_ip,
-                    "rtp_port": new_rtp_port,
-                    "rtspSocket": rtsp_socket
-                }
-                print(f"Criando nova sessão para o fluxo {filename} com o vizinho {sender_ip}:{new_rtp_port}")
-                worker = ServerWorker(neighborInfo, self.server_ip)
-                with self.active_workers_lock:
-                    self.active_workers[filename] = worker
-                worker.processRtspRequest(requestType, filename, seq)
+            # Subscreve o vizinho à fonte do fluxo e processa o pedido no seu estado
+            worker = self.get_worker(filename)
+            worker.subscribe(sender_ip, rtsp_socket, new_rtp_port)
+            worker.processRtspRequest(requestType, sender_ip, seq)
         except Exception as e:
             print(f"Erro ao processar a conexão RTSP: {e}")
        
@@ -423,25 +495,9 @@ class Server:
             # Processar a conexão
             print(f"Gerindo a conexão para {sender_ip}:{rtp_port}, fluxo {filename}")
 
-            # Verifica se já existe um ServerWorker para o fluxo
-            with self.active_workers_lock:
-                existing_worker = self.active_workers.get(filename, None)
-                    
-            if existing_worker:
-                # Atualiza o ServerWorker existente para o novo vizinho
-                existing_worker.update_neighborInfo(sender_ip, rtsp_socket, rtp_port)
-                print(f"Atualizada sessão existente para o fluxo {filename} com o vizinho {sender_ip}:{rtp_port}")
-            else:
-                # Cria um novo ServerWorker para o fluxo
-                neighborInfo = {
-                    "ip": sender_ip,
-                    "rtp_port": rtp_port,
-                    "rtspSocket": rtsp_socket
-                }
-                print(f"Criando nova sessão para o fluxo {filename} com o vizinho {sender_ip}:{rtp_port}")
-                worker = ServerWorker(neighborInfo, self.server_ip)
-                with self.active_workers_lock:
-                    self.active_workers[filename] = worker
+            # O vizinho que ativou a rota passa a receber o fluxo no estado em que este se encontra
+            worker = self.get_worker(filename)
+            worker.subscribe(sender_ip, rtsp_socket, rtp_port, takeover=True)
         except Exception as e:
             print(f"Erro ao processar a conexão RTSP: {e}")
             
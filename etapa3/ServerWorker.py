@@ -2,7 +2,31 @@ from random import randint
 import sys, traceback, threading, socket, select, time
 
 from VideoStream import VideoStream
-from RtpPacket import RtpPacket
+from RtpJpeg import JpegPacketizer
+from RtpPacket import RTP_CLOCK_RATE
+from FrameScheduler import DEFAULT_FPS
+
+SENDER_REPORT_INTERVAL = 1.0  # Segundos entre relatórios do emissor
+
+class MediaTimeline:
+	"""
+	Relógio de media partilhado pelas variantes (Renditions) de um filme: a mesma origem
+	aleatória de timestamps e a posição (em frames) mais avançada já enviada por qualquer
+	uma delas. Uma variante que começa a ser enviada continua a partir dessa posição, pelo
+	que um cliente que muda de variante não vê o filme recomeçar nem os timestamps saltarem.
+	"""
+	def __init__(self):
+		self.base = randint(0, 0xFFFFFFFF)
+		self.frames = 0
+		self.lock = threading.Lock()
+
+	def advance(self, frames):
+		with self.lock:
+			self.frames = max(self.frames, frames)
+
+	def position(self):
+		with self.lock:
+			return self.frames
 
 class ServerWorker:
 	SETUP = 'SETUP'
@@ -13,165 +37,198 @@ class ServerWorker:
 	INIT = 0
 	READY = 1
 	PLAYING = 2
-	state = INIT
 
 	OK_200 = 0
 	FILE_NOT_FOUND_404 = 1
 	CON_ERR_500 = 2
 	
-	neighborInfo = {}
-	
-	def __init__(self, neighborInfo, server_ip):
+	def __init__(self, server_ip, filename, stream_id, scheduler, timeline=None):
+		"""
+		Fonte de um fluxo de vídeo partilhada por todos os vizinhos que o subscrevem.
+		Cada frame é lido e empacotado uma única vez e enviado a todos os subscritores
+		em estado PLAYING; cada subscritor tem o seu próprio estado PLAY/PAUSE.
+		O ritmo de envio é dado pelo FrameScheduler do servidor.
+		"""
 		self.server_ip = server_ip
-		self.neighborInfo = {} 
-		self.neighborInfo = neighborInfo
-		self.neighbor_lock = threading.Lock()
-		self.active = True
-
-	def update_neighborInfo(self, new_ip, rtspSocket, rtp_port):
+		self.scheduler = scheduler
+		self.filename = filename
+		self.stream_id = stream_id
+		self.packetizer = JpegPacketizer(stream_id, server_ip)
+
+		# Relógio de media: o timestamp vem do índice do frame no fluxo (contando os saltados
+		# e as repetições do vídeo) e do FPS, a partir de uma origem aleatória (RFC 3550)
+		# partilhada com as outras variantes do mesmo filme
+		self.timeline = timeline if timeline is not None else MediaTimeline()
+		self.mediaFrames = 0
+		self.timestampBase = self.timeline.base
+		self.lastSenderReport = 0.0
+		self.producing = False
+		self.resync = False  # Alinhar com a posição do filme no próximo frame
+
+		self.subscribers = {}  # ip -> {"rtp_port", "rtspSocket", "state"}
+		self.subscribers_lock = threading.Lock()
+
+		self.videoStream = None
+		self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	def subscribe(self, ip, rtspSocket, rtp_port, takeover=False):
 		"""
-		Atualiza o destino da sessão de vídeo para um novo IP e porta RTSP sem interromper a sessão.
+		Adiciona (ou atualiza) um vizinho subscritor do fluxo.
+		Com takeover, o vizinho herda o estado atual do fluxo (usado quando uma rota é
+		ativada a meio da transmissão e o vizinho substitui outro caminho).
 		"""
-		with self.neighbor_lock:
-			self.neighborInfo["ip"] = new_ip
-			self.neighborInfo["rtp_port"] = rtp_port
-			self.neighborInfo["rtspSocket"] = rtspSocket
-		print(f"Video session updated to new destination {new_ip}")
-
-	def processRtspRequest(self, requestType, filename, seq):
-		"""Process RTSP request sent from the client."""
-		# Get the request type
-		with self.neighbor_lock:
-			if 'state' not in self.neighborInfo:
-					self.neighborInfo['state'] = self.INIT
-					self.neighborInfo['session'] = filename
-
-		with self.neighbor_lock:
-			neighbors_snapshot =  self.neighborInfo.copy()
+		with self.subscribers_lock:
+			subscriber = self.subscribers.get(ip)
+			if subscriber is None:
+				state = self.INIT
+				if takeover:
+					states = [info['state'] for info in self.subscribers.values()]
+					state = max(states) if states else self.INIT
+				subscriber = self.subscribers[ip] = {"state": state}
+			subscriber["rtp_port"] = rtp_port
+			subscriber["rtspSocket"] = rtspSocket
+			playing = subscriber["state"] == self.PLAYING
+		print(f"Vizinho {ip}:{rtp_port} subscreveu o fluxo {self.filename}")
+
+		if playing:
+			self.startProducer()
+
+	def unsubscribe(self, ip):
+		"""Remove um vizinho subscritor; para o produtor se ninguém mais estiver a receber."""
+		with self.subscribers_lock:
+			self.subscribers.pop(ip, None)
+		print(f"Vizinho {ip} deixou de subscrever o fluxo {self.filename}")
+		self.stopProducerIfIdle()
+
+	def processRtspRequest(self, requestType, ip, seq):
+		"""Process RTSP request sent from a subscribed neighbor."""
+		with self.subscribers_lock:
+			subscriber = self.subscribers.get(ip)
+			if subscriber is None:
+				print(f"Pedido {requestType} de {ip}, que não subscreveu o fluxo {self.filename}")
+				return
+			state = subscriber['state']
 
 		# Process SETUP request
 		if requestType == self.SETUP:
-			if neighbors_snapshot['state'] == self.INIT:
+			if state == self.INIT:
 				# Update state
 				print("processing SETUP\n")
+				try:
+					if self.videoStream is None:
+						self.videoStream = VideoStream(self.filename)
+				except IOError:
+					self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1], subscriber)
+					return
+
+				with self.subscribers_lock:
+					subscriber['state'] = self.READY
 				
-				with self.neighbor_lock:
-					try:
-						self.neighborInfo['videoStream'] = VideoStream(filename)
-						self.neighborInfo['state'] = self.READY
-					except IOError:
-						self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1], self.neighborInfo['session'], filename)
-					
-					# Send RTSP reply
-					self.replyRtsp(self.OK_200, seq[1], self.neighborInfo['session'], filename)
+				# Send RTSP reply
+				self.replyRtsp(self.OK_200, seq[1], subscriber)
 
 		# Process PLAY request 		
 		elif requestType == self.PLAY:
-			if neighbors_snapshot['state'] == self.READY:
+			if state == self.READY:
 				print("processing PLAY\n")
-				with self.neighbor_lock:
-					self.neighborInfo['state'] = self.PLAYING
+				with self.subscribers_lock:
+					subscriber['state'] = self.PLAYING
 				
-					# Create a new socket for RTP/UDP
-					self.neighborInfo['rtpSocket'] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+				self.replyRtsp(self.OK_200, seq[1], subscriber)
 				
-					self.replyRtsp(self.OK_200, seq[1], self.neighborInfo['session'], filename)
-					
-					# Create a new thread and start sending RTP packets
-					self.neighborInfo['event'] = threading.Event()
-					self.neighborInfo['worker']= threading.Thread(target=self.sendRtp, args=(filename,)) 
-					self.neighborInfo['worker'].start()
+				# Start sending RTP packets if the producer is not running yet
+				self.startProducer()
 		
 		# Process PAUSE request
 		elif requestType == self.PAUSE:
-			if neighbors_snapshot['state'] == self.PLAYING:
+			if state == self.PLAYING:
 				print("processing PAUSE\n")
-				with self.neighbor_lock:
-					self.neighborInfo['state'] = self.READY
-					
-					self.neighborInfo['event'].set()
+				with self.subscribers_lock:
+					subscriber['state'] = self.READY
 				
-					self.replyRtsp(self.OK_200, seq[1], self.neighborInfo['session'], filename)
+				self.replyRtsp(self.OK_200, seq[1], subscriber)
+				self.stopProducerIfIdle()
 		
 		# Process TEARDOWN request
 		elif requestType == self.TEARDOWN:
 			print("processing TEARDOWN\n")
-			with self.neighbor_lock:
-
-				self.neighborInfo['event'].set()
-				
-				self.replyRtsp(self.OK_200, seq[1], self.neighborInfo['session'], filename)
-				
-				# Close the RTP socket
-				self.neighborInfo['videoStream'].release() 
-				self.neighborInfo['rtpSocket'].close()
-
-	def sendRtp(self, filename):
-		"""Send RTP packets over UDP."""
-		current_ip = None
-		current_port = None
-		current_socket = None
-
-		while True:
-			with self.neighbor_lock:
-				neighbors_snapshot =  self.neighborInfo.copy()
-				
-			# Verificar se o envio deve ser pausado ou interrompido
-			neighbors_snapshot['event'].wait(0.05)
-
-			if neighbors_snapshot['event'].isSet(): 
-				break
-
-			# Obter os dados do próximo frame
-			data = neighbors_snapshot['videoStream'].nextFrame()
-
-			if data:
-				frameNumber = neighbors_snapshot['videoStream'].frameNbr()
-
-				# Bloquear e verificar se há alterações nos dados do vizinho
-				with self.neighbor_lock:
-					neighbors_snapshot =  self.neighborInfo.copy()
-				
-				ip = neighbors_snapshot.get('ip')
-				port = neighbors_snapshot.get('rtp_port', 0)
-				if ip != current_ip:
-					if current_socket:
-						current_socket.close()
-					current_ip = ip
-					current_port = port
-					current_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-					print(f"RTP destination updated to {current_ip}:{current_port}")
-
-				# Enviar pacote RTP usando o socket atualizado
-				if current_socket and current_ip and current_port and self.active:
-					try:
-						print(f"Sending frame {frameNumber} of video {filename} to {current_ip}:{current_port}")
-						current_socket.sendto(self.makeRtp(data, frameNumber, filename, self.server_ip), (current_ip, current_port))
-					except Exception as e:
-						print(f"Error sending RTP packet: {e}")
-
-	def makeRtp(self, payload, frameNbr, filename, sender_ip):
-		"""RTP-packetize the video data."""
-		version = 2
-		padding = 0
-		extension = 0
-		cc = 0
-		marker = 0
-		pt = 26 # MJPEG type
-		seqnum = frameNbr
-		ssrc = 0 
-
-		rtpPacket = RtpPacket()
-		rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, filename, sender_ip)
-		
-		return rtpPacket.getPacket()
+			self.replyRtsp(self.OK_200, seq[1], subscriber)
+			self.unsubscribe(ip)
+
+	def startProducer(self):
+		"""Ask the scheduler to start pacing this stream at its native frame rate."""
+		if self.videoStream is not None:
+			if not self.producing:
+				self.producing = True
+				self.resync = True
+			self.scheduler.add(self, self.videoStream.fps())
+
+	def stopProducerIfIdle(self):
+		"""Stop pacing the stream when no subscriber is playing."""
+		with self.subscribers_lock:
+			if any(info['state'] == self.PLAYING for info in self.subscribers.values()):
+				return
+		self.producing = False
+		self.scheduler.remove(self)
+
+	def sendFrame(self, skipped=0):
+		"""Send the next frame over UDP to every playing subscriber (called by the scheduler)."""
+		with self.subscribers_lock:
+			destinations = [(ip, info['rtp_port']) for ip, info in self.subscribers.items() if info['state'] == self.PLAYING and info.get('rtp_port')]
+
+		if not destinations or self.videoStream is None:
+			return
+
+		# Ao (re)começar, continua o filme onde as outras variantes já vão
+		if self.resync:
+			self.resync = False
+			self.mediaFrames = max(self.mediaFrames, self.timeline.position())
+			self.videoStream.seek(self.mediaFrames)
+
+		# Frames em atraso são saltados em vez de atrasar o fluxo
+		if skipped:
+			self.videoStream.skipFrames(skipped)
+			self.mediaFrames += skipped
+
+		# Obter os dados do próximo frame (uma única vez para todos os subscritores)
+		data = self.videoStream.nextFrame()
+
+		if data:
+			frameNumber = self.videoStream.frameNbr()
+			timestamp = self.mediaTimestamp(self.mediaFrames)
+			self.mediaFrames += 1
+			self.timeline.advance(self.mediaFrames)
+			packets = self.makeRtp(data, timestamp)
+
+			# Associa periodicamente o relógio de media ao relógio de parede
+			now = time.time()
+			if now - self.lastSenderReport >= SENDER_REPORT_INTERVAL:
+				self.lastSenderReport = now
+				packets.append(self.packetizer.senderReport(timestamp, now))
+
+			for address in destinations:
+				try:
+					print(f"Sending frame {frameNumber} of video {self.filename} to {address[0]}:{address[1]}")
+					for packet in packets:
+						self.rtpSocket.sendto(packet, address)
+				except Exception as e:
+					print(f"Error sending RTP packet: {e}")
+
+	def mediaTimestamp(self, index):
+		"""90 kHz RTP timestamp of the index-th frame of the stream."""
+		fps = self.videoStream.fps() or DEFAULT_FPS
+		return (self.timestampBase + round(index * RTP_CLOCK_RATE / fps)) & 0xFFFFFFFF
+
+	def makeRtp(self, payload, timestamp):
+		"""RTP-packetize the video data into MTU-sized fragments stamped with the media clock."""
+		return self.packetizer.packetize(payload, timestamp)
 		
-	def replyRtsp(self, code, seq, session, filename):
-		"""Send RTSP reply to the client."""
+	def replyRtsp(self, code, seq, subscriber):
+		"""Send RTSP reply to the subscriber."""
 		if code == self.OK_200:
 			#print("200 OK")
-			reply = 'RTSP/1.0 200 OK\nCSeq: ' + seq + '\nSession: ' + session
-			connSocket = self.neighborInfo['rtspSocket']
+			reply = 'RTSP/1.0 200 OK\nCSeq: ' + seq + '\nSession: ' + self.filename
+			connSocket = subscriber['rtspSocket']
 			connSocket.send(reply.encode())
 		
 		# Error messages
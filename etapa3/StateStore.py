@@ -0,0 +1,143 @@
+import threading
+
+class Shard:
+    """
+    Mapa copy-on-write.
+    Os leitores usam o snapshot publicado sem qualquer lock: o dicionário e as entradas
+    publicadas nunca são alterados, cada escrita cria cópias e troca a referência de forma
+    atómica. Os escritores são serializados pelo lock do shard (um escritor de cada vez),
+    que nunca é mantido enquanto se adquire outro lock nem durante I/O.
+    """
+    __slots__ = ("snapshot", "writer")
+
+    def __init__(self):
+        self.snapshot = {}
+        self.writer = threading.Lock()
+
+    # Leitura (sem locks)
+    def get(self, key, default=None):
+        return self.snapshot.get(key, default)
+
+    def items(self):
+        return self.snapshot.items()
+
+    def keys(self):
+        return self.snapshot.keys()
+
+    def __contains__(self, key):
+        return key in self.snapshot
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    # Escrita (copy-on-write)
+    def put(self, key, value):
+        with self.writer:
+            snapshot = dict(self.snapshot)
+            snapshot[key] = value
+            self.snapshot = snapshot
+
+    def replace(self, mapping):
+        """Publica um mapa novo por inteiro."""
+        with self.writer:
+            self.snapshot = dict(mapping)
+
+    def insert(self, key, value):
+        """Publica value se a chave ainda não existir. Retorna a entrada que fica publicada."""
+        with self.writer:
+            current = self.snapshot.get(key)
+            if current is not None:
+                return current
+            snapshot = dict(self.snapshot)
+            snapshot[key] = value
+            self.snapshot = snapshot
+            return value
+
+    def update(self, key, **fields):
+        """Publica uma cópia do registo com os campos alterados. Retorna o novo registo, ou None se não existir."""
+        with self.writer:
+            current = self.snapshot.get(key)
+            if current is None:
+                return None
+            entry = current.replace(**fields)
+            snapshot = dict(self.snapshot)
+            snapshot[key] = entry
+            self.snapshot = snapshot
+            return entry
+
+    def remove(self, key):
+        """Retira a entrada. Retorna a entrada removida, ou None."""
+        with self.writer:
+            if key not in self.snapshot:
+                return None
+            snapshot = dict(self.snapshot)
+            entry = snapshot.pop(key)
+            self.snapshot = snapshot
+            return entry
+
+    def mutate(self, func):
+        """
+        Corre func sobre uma cópia do mapa e publica-a. func não pode alterar os registos
+        existentes no lugar (deve substituí-los com replace()). Retorna o resultado de func.
+        """
+        with self.writer:
+            snapshot = dict(self.snapshot)
+            result = func(snapshot)
+            self.snapshot = snapshot
+            return result
+
+class StateStore:
+    """
+    Estado partilhado do node: vizinhos, ligações RTSP aos upstreams e, separados em
+    shards por fluxo, a tabela de rotas (upstream -> rota) e as sessões
+    (vizinho a jusante -> sessão).
+    Leituras nunca bloqueiam; escritas em fluxos diferentes não se atrasam umas às outras.
+    """
+    def __init__(self):
+        self.neighbors = Shard()  # ip -> informação do vizinho
+        self.rtsp = Shard()       # ip -> socket RTSP persistente para o upstream
+
+        self.route_shards = {}    # stream_id -> Shard(upstream_ip -> rota)
+        self.session_shards = {}  # stream_id -> Shard(vizinho_ip -> sessão)
+        self.shards_lock = threading.Lock()  # Só para criar shards novos
+
+    def shard(self, attribute, stream_id):
+        shard = getattr(self, attribute).get(stream_id)
+        if shard is None:
+            with self.shards_lock:
+                shards = getattr(self, attribute)
+                shard = shards.get(stream_id)
+                if shard is None:
+                    shards = dict(shards)
+                    shard = shards[stream_id] = Shard()
+                    setattr(self, attribute, shards)
+        return shard
+
+    def routes(self, stream_id):
+        """Rotas do fluxo (shard criado na primeira utilização)."""
+        return self.shard("route_shards", stream_id)
+
+    def sessions(self, stream_id):
+        """Sessões do fluxo (shard criado na primeira utilização)."""
+        return self.shard("session_shards", stream_id)
+
+    def route(self, stream_id, upstream_ip):
+        shard = self.route_shards.get(stream_id)
+        return shard.get(upstream_ip) if shard is not None else None
+
+    def upstreams(self):
+        """Vizinhos que anunciam rotas para pelo menos um fluxo."""
+        upstreams = set()
+        for shard in self.route_shards.values():
+            upstreams.update(shard.keys())
+        return upstreams
+
+    def remove_upstream(self, upstream_ip):
+        """Retira as rotas de um vizinho em todos os fluxos."""
+        removed = False
+        for shard in self.route_shards.values():
+            removed = shard.remove(upstream_ip) is not None or removed
+        return removed
+
+    def session_count(self):
+        return sum(len(shard) for shard in self.session_shards.values())
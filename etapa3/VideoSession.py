@@ -1,12 +1,16 @@
 from tkinter import *
 import tkinter.messagebox
-from PIL import Image, ImageTk
-import socket, threading, sys, traceback, os
+import socket, struct, threading, sys, traceback, os, time
 
-from RtpPacket import RtpPacket
+from RtpPacket import RtpPacket, MAX_DATAGRAM_SIZE, PACKET_HEADER_SIZE, RTP_CLOCK_RATE, SequenceWindow, SequenceTracker, readSeqNum, readStreamId, isSenderReport, timestampDelta
+from DatagramIO import ReceiveRing
+from RtpJpeg import JpegReassembler
+from FrameRenderer import FrameRenderer
+from JitterBuffer import JitterBuffer
+from ReceptionReports import ReceptionStats
 
-CACHE_FILE_NAME = "cache-"
-CACHE_FILE_EXT = ".jpg"
+RTP_POLL_TIMEOUT = 0.5  # Segundos sem pacotes até voltar a verificar PAUSE/TEARDOWN
+LATENCY_GAIN = 1 / 16   # Peso de cada frame na média da latência de ponta a ponta
 
 class VideoSession:
     INIT = 0
@@ -26,15 +30,34 @@ class VideoSession:
         self.destination_rtsp_port = destination_rtsp_port
         self.rtp_port = rtp_port 
         self.fileName = fileName
+        self.pendingStream = None  # Variante pedida (SETUP/PLAY) mas ainda não confirmada
         self.rtspSeq = 0
         self.requestSent = -1
         self.teardownAcked = 0
-        self.frameNbr = 1
         self.sessionId = None
         self.active = False # Determina se o video está ou nao em execução
         
         self.rtspSocket = None
         self.rtpSocket = None
+        self.rtpRing = None
+        self.reassembler = JpegReassembler()
+        self.duplicates = SequenceWindow()  # Durante uma troca de PoP os pacotes chegam pelos dois caminhos
+        self.sequence = SequenceTracker()   # Números de sequência estendidos (voltas de 16 bits)
+        self.reception = ReceptionStats(self.sequence, RTP_CLOCK_RATE)  # Perda e jitter para os relatórios de receção
+        self.jitterBuffer = JitterBuffer(self.updateMovie, clock_rate=RTP_CLOCK_RATE)  # Entrega os frames ao ritmo da origem
+        self.senderReport = None  # (relógio de parede, timestamp RTP) do último relatório do emissor
+        self.latency = None       # Latência (suavizada) desde o servidor, em segundos
+
+        # Troca de variante: id do fluxo aceite, se aceita o primeiro pacote de outro fluxo e
+        # deslocamento dos números de sequência para continuarem a crescer no jitter buffer
+        self.streamId = None
+        self.switching = False
+        self.seqOffset = 0
+
+        # Entrega: octetos de frames completos face aos octetos enviados segundo o emissor
+        self.frameOctets = 0
+        self.octetsReported = None  # (octetos enviados, octetos de frames completos) no último relatório do emissor
+        self.delivery = None        # Fração entregue entre os dois últimos relatórios do emissor
         
         self.connectToNeighbor()
         self.createWidgets()
@@ -44,7 +67,7 @@ class VideoSession:
         Atualiza o destino da sessão de vídeo para um novo IP e porta RTSP sem interromper a sessão.
         """
         self.destination_ip = new_ip
-        self.rtsp_port = new_rtsp_port
+        self.destination_rtsp_port = new_rtsp_port
         print(f"Video session updated to new destination {new_ip}:{new_rtsp_port}")
         
     def createWidgets(self):
@@ -62,6 +85,10 @@ class VideoSession:
         
         self.label = Label(self.master, height=20)
         self.label.grid(row=0, column=0, columnspan=4, sticky=W+E+N+S, padx=5, pady=5)
+
+        # Descodificação fora da thread RTP; o label só é atualizado pelo loop do Tk
+        self.renderer = FrameRenderer(self.master, self.label)
+        self.renderer.start()
 	
     def setupMovie(self):
         """Setup button handler."""
@@ -71,8 +98,9 @@ class VideoSession:
     def exitClient(self):
         """Teardown button handler."""
         self.sendRtspRequest(self.TEARDOWN)		
+        self.jitterBuffer.stop()
+        self.renderer.stop()
         self.master.destroy() # Close the gui window
-        os.remove(CACHE_FILE_NAME + self.sessionId + CACHE_FILE_EXT) # Delete the cache image from video
 
     def pauseMovie(self):
         """Pause button handler."""
@@ -82,6 +110,10 @@ class VideoSession:
     def playMovie(self):
         """Play button handler."""
         if self.state == self.READY:
+            # A linha temporal recomeça depois de uma pausa
+            self.jitterBuffer.reset()
+            self.jitterBuffer.start()
+
             # Create a new thread to listen for RTP packets
             threading.Thread(target=self.listenRtp).start()
             self.playEvent = threading.Event()
@@ -92,39 +124,161 @@ class VideoSession:
         """Listen for RTP packets."""
         while True:
             try:
-                data = self.rtpSocket.recv(20480)
-                if data:
-                    rtpPacket = RtpPacket()
-                    rtpPacket.decode(data)
-                    
-                    currFrameNbr = rtpPacket.seqNum()
-                    print("Current Seq Num: " + str(currFrameNbr))
-                                        
-                    if currFrameNbr >= self.frameNbr: # Discard the late packet
-                        self.frameNbr = currFrameNbr
-                        self.updateMovie(self.writeFrame(rtpPacket.getPayload()))
-                    
-                    # Se o vídeo já começou e o currFrameNbr é 1 ou é muito menor do que foi recebido anteriormente, reinicie o vídeo
-                    if self.active:
-                        if currFrameNbr == 1 or currFrameNbr < self.frameNbr - 200:
-                            print("Reiniciando o vídeo...")
-                            self.frameNbr = currFrameNbr # Reinicia o contador de frames
-                            self.updateMovie(self.writeFrame(rtpPacket.getPayload()))  # Atualiza para a primeira imagem
-                    else:
-                        self.active = True
-                        video_started = True  # Marca que o vídeo já começou
-            except:
-                # Stop listening upon requesting PAUSE or TEARDOWN
-                if self.playEvent.isSet(): 
-                    break
-                
-                # Upon receiving ACK for TEARDOWN request,
-                # close the RTP socket
-                if self.teardownAcked == 1:
-                    self.rtpSocket.shutdown(socket.SHUT_RDWR)
-                    self.rtpSocket.close()
-                    break
+                batch = self.rtpRing.receive(RTP_POLL_TIMEOUT)
+            except (socket.timeout, OSError) as e:
+                if self.teardownAcked != 1:
+                    print(f"Erro ao receber pacotes RTP: {e}")
+                batch = []
+
+            for buffer, data, addr in batch:
+                if len(data) < PACKET_HEADER_SIZE:
+                    print(f"Datagrama RTP demasiado curto ({len(data)} bytes) de {addr}, ignorado")
+                    continue
+                try:
+                    self.processPacket(buffer, data)
+                except (struct.error, ValueError) as e:
+                    print(f"Pacote RTP inválido de {addr}: {e}")
+            if batch:
+                continue
+
+            # Stop listening upon requesting PAUSE or TEARDOWN
+            if self.playEvent.isSet(): 
+                break
+            
+            # Upon receiving ACK for TEARDOWN request,
+            # close the RTP socket
+            if self.teardownAcked == 1:
+                self.rtpSocket.shutdown(socket.SHUT_RDWR)
+                self.rtpSocket.close()
+                break
+
+    def processPacket(self, buffer, data):
+        """Processa um datagrama RTP (data é uma memoryview sobre buffer, com o cabeçalho completo)."""
+        streamId = readStreamId(buffer)
+        if streamId != self.streamId:
+            if self.streamId is not None and not self.switching:
+                return  # Variante anterior, ainda a chegar durante a sobreposição
+            self.adoptStream(streamId)
+
+        seq = readSeqNum(buffer)
+        if not self.duplicates.accept(seq):
+            return  # Cópia já recebida pelo outro PoP
+
+        extendedSeq = self.sequence.update(seq)
+        if extendedSeq is None:
+            return  # Salto de numeração ainda por confirmar
+        if self.sequence.restarted:
+            print("Numeração RTP recomeçada, a reiniciar a reprodução...")
+            self.jitterBuffer.reset()
+
+        rtpPacket = RtpPacket()
+        rtpPacket.decode(data)
+        if isSenderReport(buffer):
+            try:
+                self.handleSenderReport(rtpPacket)
+            except (struct.error, ValueError, OverflowError) as e:
+                print(f"Relatório do emissor inválido: {e}")
+            return
+        self.reception.packet_received(rtpPacket.timestamp())
+
+        # Junta os fragmentos até o frame estar completo
+        frame = self.reassembler.push(rtpPacket)
+        if frame is None:
+            return
         
+        timestamp, payload = frame
+        self.frameOctets += len(payload)
+        self.updateLatency(timestamp)
+        print("Current Frame Timestamp: " + str(timestamp))
+
+        # O jitter buffer reordena, descarta os frames atrasados e marca o ritmo.
+        # Uma falha aqui perde só este frame, mas fica registada com o traceback
+        try:
+            self.jitterBuffer.push(extendedSeq + self.seqOffset, timestamp, payload)
+        except Exception:
+            print("Falha ao entregar o frame ao jitter buffer:")
+            traceback.print_exc()
+            return
+        self.active = True
+        
+    def adoptStream(self, streamId):
+        """
+        Passa a aceitar o fluxo streamId (primeiro fluxo ou nova variante). A numeração e as
+        estatísticas recomeçam, mas a reprodução continua: as variantes partilham o relógio de
+        media e os números de sequência continuam a partir dos da variante anterior.
+        """
+        if self.sequence.max_seq is not None:
+            self.seqOffset += self.sequence.extendedMax() + 1
+        self.streamId = streamId
+        self.switching = False
+        self.duplicates = SequenceWindow()
+        self.sequence = SequenceTracker()
+        self.reception = ReceptionStats(self.sequence, RTP_CLOCK_RATE)
+        self.reassembler = JpegReassembler()
+        self.octetsReported = None
+        self.delivery = None
+
+    def handleSenderReport(self, rtpPacket):
+        """Guarda a correspondência entre o relógio de media e o relógio de parede do servidor."""
+        wallclock, timestamp, packets, octets = rtpPacket.senderReport()
+        self.senderReport = (wallclock, timestamp)
+        if self.octetsReported is not None:
+            sent = (octets - self.octetsReported[0]) & 0xFFFFFFFF
+            if sent > 0:
+                self.delivery = min(1.0, (self.frameOctets - self.octetsReported[1]) / sent)
+        self.octetsReported = (octets, self.frameOctets)
+        print(f"Sender report: {packets} pacotes, {octets} octetos enviados pelo servidor")
+
+    def updateLatency(self, timestamp):
+        """
+        Latência de um frame desde o envio pelo servidor: chegada menos o instante em que o frame
+        foi enviado, obtido do último relatório do emissor (assume relógios sincronizados).
+        """
+        if self.senderReport is None:
+            return
+        wallclock, reportTimestamp = self.senderReport
+        sample = time.time() - (wallclock + timestampDelta(timestamp, reportTimestamp) / RTP_CLOCK_RATE)
+        self.latency = sample if self.latency is None else self.latency + (sample - self.latency) * LATENCY_GAIN
+
+    def receptionReport(self, report):
+        """Fill a ReceptionReport with this session's loss, jitter and latency. Return False before any packet."""
+        report.stream = self.fileName
+        return self.reception.report(report, self.latency)
+
+    def changeStream(self, fileName):
+        """
+        Muda para outra variante do filme na mesma sessão: SETUP e PLAY da nova variante na
+        ligação RTSP atual (o PLAY segue quando o SETUP for confirmado). Os pacotes da variante
+        anterior são aceites até chegar o primeiro da nova. Retorna False se não estiver a reproduzir.
+        """
+        if self.state != self.PLAYING or fileName == self.fileName:
+            return False
+        self.pendingStream = fileName
+        self.sessionId = None  # A sessão RTSP tem o nome da variante
+        self.switching = True
+        self.rtspSeq += 1
+        request = f"SETUP {fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nIP: {self.client_ip}\n"
+        self.requestSent = self.SETUP
+        self.rtspSocket.send(request.encode())
+
+        print('\nData sent:\n' + request)
+        return True
+
+    def resumeOnRoute(self):
+        """
+        Depois de mudar de PoP, repete o PLAY na nova ligação RTSP para que o novo PoP
+        comece logo a enviar, enquanto o antigo continua até ser desativado.
+        """
+        if self.state != self.PLAYING:
+            return
+        threading.Thread(target=self.recvRtspReply, args=(self.rtspSocket,), daemon=True).start()
+        self.rtspSeq += 1
+        request = f"PLAY {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}\nIP: {self.client_ip}\n"
+        self.requestSent = self.PLAY
+        self.rtspSocket.send(request.encode())
+
+        print('\nData sent:\n' + request)
+
     def connectToNeighbor(self):
         """Connect to the neighbor. Start a new RTSP/TCP session."""
         self.rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -167,19 +321,22 @@ class VideoSession:
 
         print('\nData sent:\n' + request)
 
-    def recvRtspReply(self):
+    def recvRtspReply(self, rtspSocket=None):
         """Receive RTSP reply from the neighbor."""
+        rtspSocket = rtspSocket or self.rtspSocket
         while True:
-            reply = self.rtspSocket.recv(1024)
+            reply = rtspSocket.recv(1024)
             
             if reply: 
                 print("\nResposta RTSP do vizinho recebida com sucesso\n")
                 self.parseRtspReply(reply.decode("utf-8"))
+            else:
+                break  # Ligação fechada pelo vizinho
             
             # Close the RTSP socket upon requesting Teardown
             if self.requestSent == self.TEARDOWN:
-                self.rtspSocket.shutdown(socket.SHUT_RDWR)
-                self.rtspSocket.close()
+                rtspSocket.shutdown(socket.SHUT_RDWR)
+                rtspSocket.close()
                 break
 
     def parseRtspReply(self, data):
@@ -196,7 +353,15 @@ class VideoSession:
             # Process only if the session ID is the same
             if self.sessionId == session:
                 if int(lines[0].split(' ')[1]) == 200: 
-                    if self.requestSent == self.SETUP:
+                    if self.requestSent == self.SETUP and self.pendingStream is not None:
+                        # Troca de variante: a reprodução continua, falta o PLAY
+                        self.rtspSeq += 1
+                        request = f"PLAY {self.pendingStream} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}\nIP: {self.client_ip}\n"
+                        self.requestSent = self.PLAY
+                        self.rtspSocket.send(request.encode())
+                        print('\nData sent:\n' + request)
+
+                    elif self.requestSent == self.SETUP:
                         self.state = self.READY	
 
                         # Open RTP port.
@@ -204,6 +369,10 @@ class VideoSession:
         
                     elif self.requestSent == self.PLAY:
                         self.state = self.PLAYING
+                        if self.pendingStream is not None:
+                            print(f"Variante {self.pendingStream} em reprodução (era {self.fileName})")
+                            self.fileName = self.pendingStream
+                            self.pendingStream = None
                         print('\nPLAY sent\n')
 
                     elif self.requestSent == self.PAUSE:
@@ -224,8 +393,8 @@ class VideoSession:
         # Create a new datagram socket to receive RTP packets from the server
         self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         
-        # Set the timeout value of the socket to 0.5sec
-        self.rtpSocket.settimeout(0.5)
+        # Pacotes lidos em rajada para buffers pré-alocados (o timeout fica a cargo do anel)
+        self.rtpRing = ReceiveRing(self.rtpSocket, MAX_DATAGRAM_SIZE)
         
         try:
             # Bind the socket to the address using the RTP port given by the client user
@@ -242,15 +411,6 @@ class VideoSession:
         else: # When the user presses cancel, resume playing.
             self.playMovie()
             
-    def writeFrame(self, data):
-        """Write the received frame to a temp image file. Return the image file."""
-        cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
-        with open(cachename, "wb") as file:
-            file.write(data)
-        return cachename
-
-    def updateMovie(self, imageFile):
-        """Update the image file as video frame in the GUI."""
-        photo = ImageTk.PhotoImage(Image.open(imageFile))
-        self.label.configure(image = photo, height=288) 
-        self.label.image = photo
\ No newline at end of file
+    def updateMovie(self, frame):
+        """Hand the received JPEG frame to the decode pipeline (shown by the Tk loop)."""
+        self.renderer.submit(frame)
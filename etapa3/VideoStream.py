@@ -1,37 +1,37 @@
-import cv2
+from FrameStore import open_store
 
 class VideoStream:
     def __init__(self, filename):
         self.filename = filename
-        self.cap = cv2.VideoCapture(filename)  # Usar OpenCV para abrir o vídeo
-        if not self.cap.isOpened():
-            raise IOError(f"Não foi possível abrir o arquivo de vídeo {filename}")
+        self.store = open_store(filename)  # Frames pré-codificados e mapeados em memória
         self.frame_num = 0
 
     def nextFrame(self):
         """Retorna o próximo quadro do vídeo como um array de bytes."""
-        success, frame = self.cap.read()  # Lê o próximo quadro
-        if not success:
-            # Se o vídeo chegou ao fim, reabra o vídeo e reinicie a contagem de quadros
-            self.cap.release()
-            self.cap = cv2.VideoCapture(self.filename)
+        if self.frame_num >= len(self.store):
+            # Se o vídeo chegou ao fim, reinicie a contagem de quadros
             self.frame_num = 0
-            success, frame = self.cap.read()
-
-            # Se ainda assim não conseguir ler, retorna None (erro de arquivo ou fim real)
-            if not success:
-                return None
 
+        frame = self.store.frame(self.frame_num)
         self.frame_num += 1
-        _, encoded_frame = cv2.imencode('.jpg', frame)  # Codifica o quadro em JPEG para envio
-        return encoded_frame.tobytes()  # Converte para bytes
+        return frame
+
+    def skipFrames(self, count):
+        """Avança o vídeo sem enviar os frames (para recuperar de atrasos)."""
+        self.frame_num = (self.frame_num + count) % len(self.store)
+
+    def seek(self, index):
+        """Posiciona o vídeo no frame index (contando as repetições do vídeo)."""
+        self.frame_num = index % len(self.store)
+
+    def fps(self):
+        """Retorna o FPS nativo do vídeo (cv2.CAP_PROP_FPS)."""
+        return self.store.fps
 
     def frameNbr(self):
         """Retorna o número do quadro atual."""
         return self.frame_num
-    
-    def release(self):
-        """Libera o recurso do vídeo."""
-        self.cap.release()
 
-	
\ No newline at end of file
+    def release(self):
+        """Liberta o recurso do vídeo (o FrameStore é partilhado entre sessões)."""
+        self.store = None
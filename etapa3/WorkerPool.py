@@ -0,0 +1,103 @@
+import threading
+from collections import deque
+
+from control_protocol_pb2 import ControlMessage
+from control_protocol_pb2 import FloodingMessage
+
+# Prioridades das mensagens UDP (menor valor = atendida primeiro)
+PRIORITY_HIGH = 0    # Ativação/desativação de rotas
+PRIORITY_NORMAL = 1  # Flooding e atualizações de vizinhos
+PRIORITY_LOW = 2     # ACKs e relatórios de receção periódicos dos clientes
+PRIORITY_LEVELS = 3
+
+DEFAULT_WORKERS = 4
+DEFAULT_CAPACITY = 256  # Máximo de mensagens em espera (todas as prioridades)
+
+def datagram_priority(data):
+    """
+    Classifica um datagrama de controlo sem o desserializar: o byte 0 é o header
+    e, no protobuf, o campo 1 (type) vem primeiro com a tag 0x08 seguida do valor.
+    O campo é omitido quando tem o valor por omissão (0).
+    """
+    if len(data) < 1:
+        return PRIORITY_LOW
+    message_type = data[2] if len(data) >= 3 and data[1] == 0x08 else 0
+
+    if data[0:1] == b'\x02':  # FloodingMessage
+        if message_type in (FloodingMessage.ACTIVATE_ROUTE, FloodingMessage.DEACTIVATE_ROUTE):
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+    if data[0:1] == b'\x01':  # ControlMessage
+        if message_type in (ControlMessage.ACK, ControlMessage.RECEIVER_REPORT):
+            return PRIORITY_LOW
+        return PRIORITY_NORMAL
+    return PRIORITY_LOW
+
+class WorkerPool:
+    """
+    Pool de threads de tamanho fixo com uma fila limitada por prioridades.
+    Quando a fila está cheia descarta a mensagem mais antiga da prioridade mais
+    baixa em espera, para que uma rajada de ACKs nunca atrase uma ativação de rota
+    nem faça crescer o número de threads ou a memória do nó.
+    """
+    def __init__(self, name, workers=DEFAULT_WORKERS, capacity=DEFAULT_CAPACITY):
+        self.name = name
+        self.workers = workers
+        self.capacity = capacity
+
+        self.queues = [deque() for _ in range(PRIORITY_LEVELS)]
+        self.size = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.running = False
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        for _ in range(self.workers):
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, priority, func, *args):
+        """Coloca o trabalho na fila. Retorna False se foi descartado por falta de espaço."""
+        with self.condition:
+            if self.size >= self.capacity:
+                # Descarta a mensagem mais antiga de prioridade igual ou inferior
+                for queue in reversed(self.queues[priority:]):
+                    if queue:
+                        queue.popleft()
+                        self.size -= 1
+                        break
+                else:
+                    # Só há trabalho mais prioritário em espera: descarta o novo
+                    self.record_drop()
+                    return False
+                self.record_drop()
+
+            self.queues[priority].append((func, args))
+            self.size += 1
+            self.condition.notify()
+            return True
+
+    def record_drop(self):
+        self.dropped += 1
+        if self.dropped % 100 == 1:
+            print(f"{self.name}: fila cheia, {self.dropped} mensagens descartadas")
+
+    def next_task(self):
+        with self.condition:
+            while self.size == 0:
+                self.condition.wait()
+            for queue in self.queues:
+                if queue:
+                    self.size -= 1
+                    return queue.popleft()
+
+    def run(self):
+        while True:
+            func, args = self.next_task()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"{self.name}: erro ao processar mensagem: {e}")